@@ -3,11 +3,11 @@ from flask_cors import CORS
 from flask_pymongo import PyMongo
 from flask_bcrypt import Bcrypt
 from .config import Config
-import google.generativeai as genai
+from .services.gemini_services import GeminiModelRegistry
 
 mongo = PyMongo()
 bcrypt = Bcrypt()
-gemini_model = None
+gemini_models = GeminiModelRegistry()
 
 
 def create_app():
@@ -17,14 +17,41 @@ def create_app():
     mongo.init_app(app)
     bcrypt.init_app(app)
 
+    # share one pooled client per Ollama host across all routes
+    from api.services.ollama_services import ollama_pool, model_catalog
+    ollama_pool.init_app(app)
+    model_catalog.init_app(app)
+    from api.services.residency_services import model_residency
+    model_residency.init_app(app)
+    from api.services.response_cache import response_cache
+    response_cache.init_app(app)
+    from api.services.admission_services import admission
+    admission.init_app(app)
+    from api.services.breaker_services import breakers
+    breakers.init_app(app)
+    from api.services.stream_engine import stream_engine
+    stream_engine.init_app(app)
+    from api.services.summary_services import summarizer
+    summarizer.init_app(app)
+    from api.services.persistence_services import write_behind
+    write_behind.init_app(app)
+    from api.services.job_services import chat_jobs
+    chat_jobs.init_app(app)
+    from api.services.metrics_services import metrics
+    metrics.init_app(app)
+    from api.services.retrieval_services import document_retriever
+    document_retriever.init_app(app)
+
     @app.route("/")
     def index():
         return "Welcome to the PrivGPT-Studio Backend!"
 
-    # configure the gemini model
-    genai.configure(api_key=Config.GEMINI_API_KEY)
-    global gemini_model
-    gemini_model = genai.GenerativeModel("models/gemini-2.5-flash")
+    # configure the gemini model registry
+    gemini_models.init_app(app)
+
+    # cli commands
+    from api.services.chat_store import migrate_messages_command
+    app.cli.add_command(migrate_messages_command)
 
     # blueprint imports
     from api.routes.db import db_bp
@@ -37,4 +64,6 @@ def create_app():
     app.register_blueprint(chat_bp)
     from api.routes.auth_routes import auth_bp
     app.register_blueprint(auth_bp)
+    from api.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp)
     return app
\ No newline at end of file
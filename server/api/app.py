@@ -3,8 +3,9 @@ import sys
 # Add parent directory to Python path to allow Server module import
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from api import create_app
-# Initialize Flask app
-app = create_app()
+# Initialize Flask app (not in PDF worker processes, which re-import this module as __mp_main__)
+if __name__ != "__mp_main__":
+    app = create_app()
 # start server
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
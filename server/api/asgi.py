@@ -0,0 +1,179 @@
+import os
+import sys
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+# Add parent directory to Python path to allow Server module import
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import request
+from werkzeug.test import EnvironBuilder
+from api import create_app
+from api.services.stream_engine import stream_engine, encode_event
+
+# ASGI entry point: `uvicorn api.asgi:app`
+# /chat/stream and the streams of background /chat jobs are served natively
+# so an open stream does not hold a thread, every other route is handed to
+# the regular Flask app.
+flask_app = create_app()
+JOB_STREAM_PATH = re.compile(r"/chat/jobs/([^/]+)/stream")
+
+
+class PooledWsgiToAsgi:
+    """
+    Serves a WSGI application under ASGI, running each request on its own
+    thread pool (`executor`), so a slow route (a /chat generation) does not
+    hold up the other non-streaming requests.
+    """
+
+    def __init__(self, wsgi_application, threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError(f"WSGI routes cannot serve {scope['type']} connections")
+        body = await _read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(self.executor, self._run, scope, body, send_sync)
+
+    def _run(self, scope, body, send_sync):
+        # Runs in a pool thread: calls the WSGI app and relays its response as ASGI messages
+        environ = _environ(scope, body)
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and start.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers],
+            }
+
+        output = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in output:
+                if not start.get("sent"):
+                    start["sent"] = True
+                    send_sync(start["message"])
+                if chunk:
+                    send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            if hasattr(output, "close"):
+                output.close()
+        if not start.get("sent"):
+            send_sync(start["message"])
+        send_sync({"type": "http.response.body", "body": b""})
+
+
+wsgi_app = PooledWsgiToAsgi(flask_app, flask_app.config.get("ASGI_WSGI_THREADS", 32))
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _environ(scope, body):
+    # Builds the WSGI environ of an ASGI request whose body has been read
+    server = scope.get("server") or ("localhost", 80)
+    root_path = scope.get("root_path", "")
+    path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+    builder = EnvironBuilder(
+        path=path,
+        base_url=f"{scope.get('scheme', 'http')}://{server[0]}:{server[1]}{root_path}",
+        method=scope["method"],
+        headers=[(k.decode("latin1"), v.decode("latin1")) for k, v in scope["headers"]],
+        query_string=scope["query_string"].decode("latin1"),
+        data=body,
+        environ_base={"REMOTE_ADDR": scope["client"][0]} if scope.get("client") else None,
+    )
+    return builder.get_environ()
+
+
+def _prepare(scope, body, prepare):
+    # Runs prepare(request) in a Flask request context: (response, None) or (None, result)
+    with flask_app.request_context(_environ(scope, body)):
+        try:
+            response, result = prepare(request)
+        except Exception as e:
+            print(f"Error in {scope['path']}:", e)
+            response, result = ({"error": str(e)}, 500), None
+        if response is not None:
+            response = flask_app.make_response(response)
+            flask_app.process_response(response)
+            return (response.status_code, response.headers.to_wsgi_list(), response.get_data()), None
+        return None, result
+
+
+async def serve_events(scope, receive, send, prepare, open_events):
+    # Serves an EventStream as SSE: prepare(request) validates the request, open_events(result) opens the stream
+    body = await _read_body(receive)
+    if body is None:
+        return
+
+    response, result = await asyncio.to_thread(_prepare, scope, body, prepare)
+    if response is not None:
+        status, headers, data = response
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin1"), v.encode("latin1")) for k, v in headers],
+        })
+        await send({"type": "http.response.body", "body": data})
+        return
+
+    from api.routes.chat_routes import SSE_HEADERS
+    headers = [(b"content-type", b"text/event-stream; charset=utf-8")]
+    headers += [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in SSE_HEADERS.items()]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    stream = open_events(result)
+
+    async def pump():
+        async for event in stream:
+            await send({"type": "http.response.body", "body": encode_event(event).encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pump_task, disconnect_task):
+            task.cancel()
+        stream.close()
+    if pump_task.done() and not pump_task.cancelled() and pump_task.exception():
+        raise pump_task.exception()
+
+
+async def app(scope, receive, send):
+    from api.routes.chat_routes import prepare_stream_job, open_job_stream
+
+    job_stream = JOB_STREAM_PATH.fullmatch(scope.get("path", ""))
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/chat/stream":
+        await serve_events(scope, receive, send, prepare_stream_job, stream_engine.open_stream)
+    elif scope["type"] == "http" and scope["method"] == "GET" and job_stream:
+        await serve_events(scope, receive, send, lambda req: open_job_stream(req, job_stream.group(1)),
+                           lambda stream: stream)
+    else:
+        await wsgi_app(scope, receive, send)
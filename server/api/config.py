@@ -8,5 +8,117 @@ class Config:
     MONGO_URI = os.getenv("MONGODB_URL", "mongodb://localhost:27017/privgpt")
     ALLOWED_EXTENSIONS = {"pdf", "png", "jpg", "jpeg", "gif"}
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "your_gemini_api_key")
+    GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash")
+    # Number of (model, system prompt) handles kept in the Gemini model registry
+    GEMINI_MODEL_CACHE_SIZE = int(os.getenv("GEMINI_MODEL_CACHE_SIZE", 64))
     SECRET_KEY = os.getenv("SECRET_KEY", "dev_secret_key")
     MAX_MESSAGES_PER_SESSION = int(os.getenv("MAX_MESSAGES_PER_SESSION", 10))
+
+    # Ollama connection settings
+    OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+    # Pool of Ollama servers ("http://gpu1:11434,http://gpu2:11434"), defaults to OLLAMA_BASE_URL,
+    # and how often their health and loaded models are checked, in seconds (0 = off)
+    OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", "")
+    OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", 10))
+    # Requests one host runs before others that have room are preferred (0 = always stick to the model's host)
+    OLLAMA_HOST_CAPACITY = int(os.getenv("OLLAMA_HOST_CAPACITY", 4))
+    OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 20))
+    OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3))
+    OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 60))
+    # Send the context Ollama returned for the previous turn of a session with the next one
+    OLLAMA_REUSE_CONTEXT = os.getenv("OLLAMA_REUSE_CONTEXT", "true").lower() == "true"
+    # How long Ollama keeps a model loaded after use, and the memory the loaded models
+    # may take together before the least recently used are unloaded (0 = no limit)
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    OLLAMA_MEMORY_BUDGET_MB = int(os.getenv("OLLAMA_MEMORY_BUDGET_MB", 0))
+    OLLAMA_WARMUP_WORKERS = int(os.getenv("OLLAMA_WARMUP_WORKERS", 2))
+    # Warm-ups that may be loading or waiting at once, and model names whose residency is tracked
+    OLLAMA_WARMUP_MAX_PENDING = int(os.getenv("OLLAMA_WARMUP_MAX_PENDING", 8))
+    OLLAMA_RESIDENCY_MAX_TRACKED = int(os.getenv("OLLAMA_RESIDENCY_MAX_TRACKED", 256))
+    # Cache of replies to seeded local requests: entries (0 disables) and lifetime in seconds (0 = no expiry)
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 0))
+    # Admission control in front of Ollama: concurrent requests per model and host (0 disables),
+    # per-model overrides ("model=n,..."), waiting requests per model and per user, max wait in seconds
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 4))
+    ADMISSION_MODEL_LIMITS = os.getenv("ADMISSION_MODEL_LIMITS", "")
+    ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))
+    ADMISSION_MAX_QUEUED_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", 4))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+    # Streams fail over when Ollama sends no first token within this many seconds (0 = off)
+    OLLAMA_TTFT_TIMEOUT = float(os.getenv("OLLAMA_TTFT_TIMEOUT", 15))
+    # Circuit breaker per Ollama backend: opens when the failure share of the last
+    # BREAKER_WINDOW calls (at least BREAKER_MIN_CALLS) reaches BREAKER_ERROR_RATE;
+    # streams slower than BREAKER_SLOW_CALL_SECONDS to the first token count as failures
+    BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))
+    BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+    BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+    BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 10))
+    BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+    BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+    # Hedged requests (opt-in per request): start Gemini too when the local model
+    # has not produced a token after this many seconds; the first to answer wins
+    HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", 2))
+    # /chat/stream sends at most one chunk frame per this many ms (0 sends every token
+    # as its own frame), or earlier once this many bytes of text are buffered
+    SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", 30))
+    SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", 1024))
+    # Threads that run the regular Flask routes under uvicorn (api.asgi)
+    ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 32))
+    # Background /chat jobs (async=1): how many generate at once, how many may be waiting
+    # or running, how long finished results are kept (s), how many finished jobs are kept
+    # at most (0 = no limit) and the longest long-poll (s)
+    CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", 8))
+    CHAT_JOB_MAX_PENDING = int(os.getenv("CHAT_JOB_MAX_PENDING", 256))
+    CHAT_JOB_TTL = float(os.getenv("CHAT_JOB_TTL", 600))
+    CHAT_JOB_MAX_FINISHED = int(os.getenv("CHAT_JOB_MAX_FINISHED", 1024))
+    CHAT_JOB_MAX_WAIT = float(os.getenv("CHAT_JOB_MAX_WAIT", 30))
+    # Upper bound on concurrent upstream connections held by streaming chats
+    STREAM_MAX_CONNECTIONS = int(os.getenv("STREAM_MAX_CONNECTIONS", 2000))
+    # /chat/batch: most items per request and items generated at once per request
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 4))
+    # Write-behind persistence: streamed exchanges are saved by a background writer
+    # in bulk writes of up to BATCH_SIZE; beyond MAX_PENDING queued writes requests save inline
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 200))
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+    WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 5))
+    # Record request/inference metrics and serve them on /metrics (Prometheus text format)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+    # Model catalog cache (seconds)
+    MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", 30))
+    MODEL_CATALOG_STALE_TTL = float(os.getenv("MODEL_CATALOG_STALE_TTL", 300))
+
+    # Budget for the history of @-mentioned sessions added to a prompt (0 disables a limit)
+    MENTION_CONTEXT_MAX_CHARS = int(os.getenv("MENTION_CONTEXT_MAX_CHARS", 16000))
+    MENTION_CONTEXT_MAX_TOKENS = int(os.getenv("MENTION_CONTEXT_MAX_TOKENS", 0))
+
+    # Rolling session summaries used for @-mentions (SUMMARY_REFRESH_EVERY=0 disables them).
+    # "session" summarizes with the session's own model, so local chats never reach Gemini;
+    # "local" or "cloud" always use SUMMARY_MODEL_NAME
+    SUMMARY_REFRESH_EVERY = int(os.getenv("SUMMARY_REFRESH_EVERY", 10))
+    SUMMARY_MODEL_TYPE = os.getenv("SUMMARY_MODEL_TYPE", "session")
+    SUMMARY_MODEL_NAME = os.getenv("SUMMARY_MODEL_NAME", "")
+    # Seconds before a failed summary refresh is retried, doubled after each failure (up to an hour)
+    SUMMARY_RETRY_BACKOFF = float(os.getenv("SUMMARY_RETRY_BACKOFF", 60))
+    SUMMARY_MAX_INPUT_CHARS = int(os.getenv("SUMMARY_MAX_INPUT_CHARS", 24000))
+    SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 2))
+
+    # PDF text extraction limits, parallelism and cache (0 disables a limit)
+    PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 500))
+    PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", 500000))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 64))
+    PDF_WORKERS = int(os.getenv("PDF_WORKERS", 0))
+    PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", 32))
+
+    # Retrieval over uploaded PDFs: embedder ("hashing" = local, "ollama" = RAG_EMBED_MODEL),
+    # chunking, chunks per prompt and the score follow-up questions need to reuse a document
+    RAG_EMBEDDER = os.getenv("RAG_EMBEDDER", "hashing")
+    RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "nomic-embed-text")
+    RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", 1200))
+    RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", 200))
+    RAG_TOP_K = int(os.getenv("RAG_TOP_K", 4))
+    RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", 0.1))
+    RAG_INDEX_CACHE_SIZE = int(os.getenv("RAG_INDEX_CACHE_SIZE", 16))
@@ -1,12 +1,29 @@
 from flask import Blueprint, request, jsonify, Response, current_app
-import requests
+import logging
+import time
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
-from api import gemini_model, mongo
+from api import gemini_models, mongo
 from bson import ObjectId
 from api.utils.file_utils import allowed_file, extract_text_from_pdf_bytes
+from api.services.ollama_services import ollama_pool, call_ollama
+from api.services.residency_services import model_residency
+from api.services.response_cache import response_cache
+from api.services.admission_services import admission, AdmissionRejected, QUEUE_FULL_ERROR
+from api.services.breaker_services import BackendUnavailable
+from api.services.chat_store import (
+    save_messages, get_messages, get_transcripts, clear_messages, delete_session, serialize_message,
+    list_session_summaries, has_reached_limit, MessageLimitReached, LIMIT_REACHED_ERROR,
+    SessionNotFound, SESSION_NOT_FOUND_ERROR, get_failed_writes,
+    load_model_context, save_model_context
+)
+from api.services.stream_engine import stream_engine, iter_sse, iter_ndjson
+from api.services.persistence_services import write_behind
+from api.services.job_services import chat_jobs
+from api.services.metrics_services import metrics, RequestTimings
+from api.services.context_builder import build_mention_context
+from api.services.retrieval_services import document_retriever
 import json
-import google.generativeai as genai
 from api.config import Config
 import jwt
 from functools import wraps
@@ -41,25 +58,203 @@ def has_reached_message_limit(session_id):
         return False
         
     limit = current_app.config.get("MAX_MESSAGES_PER_SESSION", 10)
-    
-    # Optimization: Fetch only the message roles to minimize data transfer
-    session = mongo.db.sessions.find_one(
-        {"_id": ObjectId(session_id)},
-        {"messages.role": 1} 
-    )
-    
-    if not session:
+
+    # Count the exchanges still in the write-behind queue too
+    write_behind.wait_for(session_id=session_id)
+    # Only the maintained counter of user messages (prompts) is read
+    return has_reached_limit(session_id, limit)
+
+def parse_inference_params(form):
+    """
+    Reads the inference parameters of a chat request.
+
+    Args:
+    form (MultiDict): The request form.
+
+    Returns:
+    dict: Sampling parameters, seed and system prompt.
+    """
+    seed_str = form.get("seed", "").strip()
+    return {
+        "temperature": float(form.get("temperature", 0.7)),
+        "top_p": float(form.get("top_p", 0.9)),
+        "top_k": int(form.get("top_k", 40)),
+        "max_tokens": int(form.get("max_tokens", 2048)),
+        "frequency_penalty": float(form.get("frequency_penalty", 0)),
+        "presence_penalty": float(form.get("presence_penalty", 0)),
+        "stop_sequence": form.get("stop_sequence", "").strip(),
+        "seed": int(seed_str) if seed_str else None,
+        "system_prompt": form.get("system_prompt", "").strip(),
+    }
+
+def build_generation_config(params):
+    """
+    Builds the Gemini generation config from inference parameters.
+    """
+    generation_config = {
+        "temperature": params["temperature"],
+        "top_p": params["top_p"],
+        "top_k": params["top_k"],
+        "max_output_tokens": params["max_tokens"],
+    }
+    if params["stop_sequence"]:
+        generation_config["stop_sequences"] = [params["stop_sequence"]]
+    return generation_config
+
+def build_ollama_payload(model_name, prompt, params, stream):
+    """
+    Builds the Ollama /api/generate request body from inference parameters.
+    """
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": current_app.config.get("OLLAMA_KEEP_ALIVE", "30m"),
+        "options": {
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            "top_k": params["top_k"],
+            "num_predict": params["max_tokens"],
+            "frequency_penalty": params["frequency_penalty"],
+            "presence_penalty": params["presence_penalty"],
+        }
+    }
+    if params["stop_sequence"]:
+        payload["options"]["stop"] = [params["stop_sequence"]]
+    if params["seed"] is not None:
+        payload["options"]["seed"] = params["seed"]
+    if params["system_prompt"]:
+        payload["system"] = params["system_prompt"]
+    return payload
+
+def wants_async(req):
+    """
+    Tells whether a /chat request asked to run as a background job (async=true).
+    """
+    return (req.form.get("async") or req.args.get("async", "")).lower() in ("1", "true")
+
+def wants_hedge(form, model_type):
+    """
+    Tells whether a local request asked to be hedged with Gemini (form field hedge=true).
+    """
+    return model_type == "local" and gemini_models.enabled and \
+        form.get("hedge", "").lower() in ("1", "true")
+
+def attach_model_context(payload, session_id):
+    """
+    Continues a local chat from the context Ollama returned for the session's
+    previous turn, so the history does not have to be prefilled again.
+
+    The context is only reused if it was built with the same model, system
+    prompt and options.
+
+    Returns:
+    bool: True if a context was attached.
+    """
+    if not current_app.config.get("OLLAMA_REUSE_CONTEXT", True):
         return False
-        
-    # Count only user messages (prompts)
-    user_msg_count = sum(1 for m in session.get("messages", []) if m.get("role") == "user")
-    
-    return user_msg_count >= limit
+    context = load_model_context(session_id, payload)
+    if context:
+        payload["context"] = context
+        return True
+    return False
+
+def client_identity(req, user_id):
+    """
+    Identifies who a request counts against for admission control.
+
+    Returns:
+    tuple: (user key, authenticated) where guests are keyed by address.
+    """
+    if user_id:
+        return user_id, True
+    return f"guest:{req.remote_addr}", False
+
+def queue_full_response(reason):
+    """
+    Builds the 429 answer for a request shed by admission control.
+    """
+    response = jsonify({"error": QUEUE_FULL_ERROR, "queue_full": True, "reason": reason})
+    response.headers["Retry-After"] = "5"
+    return response, 429
+
+def generate_local_reply(payload, user_key, authenticated):
+    """
+    Runs a non-streaming local generation. Seeded requests are served from
+    the response cache, and identical concurrent ones share one generation.
+    Upstream calls wait for a slot of the model's admission queue.
 
-def save_and_return(session_id, session_name, model_name, user_msg, bot_reply, uploaded_file, file_bytes, user_id=None):
+    Args:
+    payload (dict): Ollama /api/generate request body.
+    user_key (str): Requesting user (see client_identity).
+    authenticated (bool): Whether the user is logged in.
+
+    Returns:
+    tuple: (result, cache_status) where result is Ollama's response JSON and
+           cache_status is "hit", "coalesced", "miss" or None (not cacheable).
+    """
+    key = response_cache.key_for(payload)
+    if key is None:
+        if ollama_pool.rejects(payload["model"]):
+            raise BackendUnavailable("No Ollama host is available (circuits open)")
+        with admission.slot(payload["model"], user_key, authenticated):
+            return call_ollama(payload).json(), None
+
+    def generate():
+        if ollama_pool.rejects(payload["model"]):
+            raise BackendUnavailable("No Ollama host is available (circuits open)")
+        with admission.slot(payload["model"], user_key, authenticated):
+            response = call_ollama(payload)
+        response.raise_for_status()
+        result = response.json()
+        return [result.pop("response", "")], result
+
+    entry, status = response_cache.get_or_generate(key, generate, timeout=current_app.config.get("OLLAMA_READ_TIMEOUT"))
+    return {**entry["final"], "response": "".join(entry["chunks"])}, status
+
+def build_document_context(user_msg, session_id, uploaded_file=None, file_bytes=None):
+    """
+    Picks the parts of uploaded PDFs that are relevant to a message.
+
+    An uploaded PDF is indexed (or its stored index reused) and its top-k
+    chunks are returned; without an upload, the PDFs linked to the session
+    are searched so follow-up questions still see the document.
+
+    Args:
+    user_msg (str): The user's message.
+    session_id (str): The chat session.
+    uploaded_file (FileStorage): The uploaded PDF, if any.
+    file_bytes (bytes): Its content.
+
+    Returns:
+    tuple: (context, report, documents) where documents are the links to
+           save on the session.
+    """
+    try:
+        if uploaded_file is None:
+            context, report, _ = document_retriever.pdf_context(user_msg, session_id)
+            return context, report, None
+        context, report, link = document_retriever.pdf_context(
+            user_msg, session_id, file_bytes, uploaded_file.filename
+        )
+        return context, report, [link]
+    except Exception as e:
+        print("Document retrieval failed:", e)
+        if uploaded_file is None:
+            return "", None, None
+        # Fall back to the whole document
+        return extract_text_from_pdf_bytes(file_bytes), None, None
+
+def save_and_return(session_id, session_name, model_name, user_msg, bot_reply, uploaded_file, file_bytes, user_id=None,
+                    latency_ms=0, timings=None, endpoint="chat"):
     """
     Saves conversation with file info and returns response JSON.
-    
+
+    Args:
+    latency_ms (int): Generation time of the reply.
+    timings (RequestTimings): Phase timings of the request, recorded once saved.
+    endpoint (str): Metrics label of the calling route.
+
     Returns:
     JSON: Chat response and metadata.
     """
@@ -82,40 +277,27 @@ def save_and_return(session_id, session_name, model_name, user_msg, bot_reply, u
         }
     ]
 
-    if session_id != "1":
-        mongo.db.sessions.update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {"messages": {"$each": messages}},
-                "$set": {"session_name": session_name or "How can I help you?"}
-            },
-        )
-    else:
-        session_doc = {
-            "messages": messages,
-            "created_at": datetime.now(),
-            "session_name": session_name or "How can I help you?",
-            "user_id": user_id 
-        }
-        inserted = mongo.db.sessions.insert_one(session_doc)
-        session_id = str(inserted.inserted_id)
-        
-        # Add to user's chat list
-        if user_id:
-             mongo.db.users.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$push": {"chat_sessions": session_id}}
-            )
+    try:
+        with (timings or RequestTimings()).phase("persistence"):
+            session_id = save_messages(session_id, session_name, user_id, messages, rename=True,
+                                       max_user_messages=current_app.config.get("MAX_MESSAGES_PER_SESSION", 10))
+    except MessageLimitReached:
+        return jsonify({"error": LIMIT_REACHED_ERROR, "limit_reached": True}), 403
+    except SessionNotFound:
+        return jsonify({"error": SESSION_NOT_FOUND_ERROR}), 404
+    metrics.record_request(endpoint, timings, model_name, "gemini")
 
     return jsonify({
         "response": bot_reply,
         "session_id": session_id,
         "timestamp": messages[1]["timestamp"].isoformat(),
-        "latency": 0
+        "latency": latency_ms
     })
 
 
 
+logger = logging.getLogger(__name__)
+
 chat_bp = Blueprint('chat_bp', __name__)
 
 
@@ -125,13 +307,21 @@ def chat():
     Handles user chat requests, processes messages, optional file input,
     interacts with local or cloud models, and stores conversation in MongoDB.
 
+    With async=true the request is answered at once with a job id and
+    generated in the background (see submit_chat_job).
+
     Returns:
     JSON: Bot response, session ID, timestamp, and latency.
     """
 
+    if wants_async(request):
+        return submit_chat_job()
+
     try:
+        timings = RequestTimings()
         # Validate user
-        user_id = validate_user(request)
+        with timings.phase("auth"):
+            user_id = validate_user(request)
 
         # ====== Base form data ======
         user_msg = request.form.get("message", "")
@@ -142,45 +332,33 @@ def chat():
         user_timestamp = datetime.now() - timedelta(seconds=10)
         session_id = request.form.get("session_id", "1")
 
-        if has_reached_message_limit(session_id):
+        with timings.phase("limit_check"):
+            limit_reached = has_reached_message_limit(session_id)
+        if limit_reached:
             return jsonify({
-                "error": "Session limit reached. Please start a new chat.",
+                "error": LIMIT_REACHED_ERROR,
                 "limit_reached": True 
         }), 403
 
         # ====== Inference Parameters ======
-        temperature = float(request.form.get("temperature", 0.7))
-        top_p = float(request.form.get("top_p", 0.9))
-        top_k = int(request.form.get("top_k", 40))
-        max_tokens = int(request.form.get("max_tokens", 2048))
-        frequency_penalty = float(request.form.get("frequency_penalty", 0))
-        presence_penalty = float(request.form.get("presence_penalty", 0))
-        stop_sequence = request.form.get("stop_sequence", "").strip()
-        seed_str = request.form.get("seed", "").strip()
-        seed = int(seed_str) if seed_str else None
-        system_prompt = request.form.get("system_prompt", "").strip()
+        params = parse_inference_params(request.form)
+        system_prompt = params["system_prompt"]
 
         # Build generation config for Gemini
-        generation_config = {
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "max_output_tokens": max_tokens,
-        }
-        if stop_sequence:
-            generation_config["stop_sequences"] = [stop_sequence]
+        generation_config = build_generation_config(params)
 
         # Mentions: fetch context
         mention_session_ids = request.form.getlist("mention_session_ids[]")
-        history_context = ""
+        history_context, mention_report = "", None
         if mention_session_ids:
-            print(mention_session_ids)
-            for m_id in mention_session_ids:
-                if ObjectId.is_valid(m_id):
-                    s = mongo.db.sessions.find_one({"_id": ObjectId(m_id)})
-                    if s:
-                        for m in s.get("messages", []):
-                            history_context += f"{m['role']}: {m['content']}\n"
+            with timings.phase("mentions"):
+                history_context, mention_report = build_mention_context(
+                    mention_session_ids,
+                    max_chars=current_app.config.get("MENTION_CONTEXT_MAX_CHARS"),
+                    max_tokens=current_app.config.get("MENTION_CONTEXT_MAX_TOKENS"),
+                )
+            if mention_report["truncated"]:
+                logger.debug("Mention context truncated: %s", mention_report)
         # Handle uploaded file
         if history_context:
             combined_input = (
@@ -193,6 +371,7 @@ def chat():
             combined_input = user_msg
 
         # ====== File Handling (optional) ======
+        document_context, document_report, documents = "", None, None
         uploaded_file = request.files.get("uploaded_file")
         if uploaded_file:
             if not allowed_file(uploaded_file.filename):
@@ -208,67 +387,85 @@ def chat():
             else:
                 # Preprocess file for Gemini
                 if file_ext == "pdf":
-                    extracted_text = extract_text_from_pdf_bytes(file_bytes)
-                    combined_input = f"{combined_input}\n\n[PDF Content Extracted]\n{extracted_text}"
+                    with timings.phase("pdf"):
+                        document_context, document_report, documents = build_document_context(
+                            user_msg, session_id, uploaded_file, file_bytes
+                        )
                 else:
                     # For image/video/etc, handle as media input
-                    # Here gemini_model accepts both text + media
-                    response = gemini_model.generate_content(
-                        [combined_input, {"mime_type": uploaded_file.mimetype or "image/jpeg", "data": file_bytes}],
-                        generation_config=generation_config
-                    )
-                    latency_ms = 0
+                    # Here gemini model accepts both text + media
+                    with timings.phase("inference"):
+                        response = gemini_models.get().generate_content(
+                            [combined_input, {"mime_type": uploaded_file.mimetype or "image/jpeg", "data": file_bytes}],
+                            generation_config=generation_config
+                        )
+                    latency_ms = int(timings.phases["inference"] * 1000)
                     bot_reply = response.text or "No reply."
                     # Save to DB (with uploaded_file info)
                     return save_and_return(session_id, session_name, model_name, user_msg, bot_reply, uploaded_file,
-                                           file_bytes, user_id)
+                                           file_bytes, user_id, latency_ms=latency_ms, timings=timings)
+        else:
+            with timings.phase("pdf"):
+                document_context, document_report, documents = build_document_context(user_msg, session_id)
+        if document_context:
+            combined_input = f"{combined_input}\n\n[PDF Content Extracted]\n{document_context}"
 
         # ====== Model Handling (text only or text+mentions) ======
         bot_reply = "No reply."
         latency_ms = 0
         fallback_used = False
-        if model_type == "local":
-            payload = {
-                "model": model_name,
-                "prompt": combined_input,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "top_p": top_p,
-                    "top_k": top_k,
-                    "num_predict": max_tokens,
-                    "frequency_penalty": frequency_penalty,
-                    "presence_penalty": presence_penalty,
-                }
+        next_context = None
+        cache_status = None
+        ollama_stats = None
+        inference_start = time.perf_counter()
+        if wants_hedge(request.form, model_type):
+            # Race the local model against Gemini on the stream engine
+            payload = build_ollama_payload(model_name, combined_input, params, stream=True)
+            attach_model_context(payload, session_id)
+            model_residency.touch(model_name)
+            user_key, authenticated = client_identity(request, user_id)
+            job = {
+                "model_name": model_name, "payload": payload, "combined_input": combined_input,
+                "system_prompt": system_prompt, "generation_config": generation_config,
+                "cache_key": response_cache.key_for(payload), "user_key": user_key, "authenticated": authenticated,
             }
-            if stop_sequence:
-                payload["options"]["stop"] = [stop_sequence]
-            if seed is not None:
-                payload["options"]["seed"] = seed
-            if system_prompt:
-                payload["system"] = system_prompt
             try:
                 latency_ms = datetime.now()
-                response = requests.post("http://localhost:11434/api/generate", json=payload, timeout=60)
+                bot_reply, winner, final = stream_engine.run(stream_engine.hedged_reply(job))
+                latency_ms = int((datetime.now() - latency_ms).total_seconds() * 1000)
+            except Exception as e:
+                bot_reply = f"Local & fallback error: {str(e)}"
+            else:
+                if winner == "cloud":
+                    fallback_used = True
+                    model_type = "cloud"
+                    model_name = "gemini"
+                else:
+                    next_context = final.get("context")
+                    ollama_stats = final
+        elif model_type == "local":
+            payload = build_ollama_payload(model_name, combined_input, params, stream=False)
+            attach_model_context(payload, session_id)
+            model_residency.touch(model_name)
+            try:
+                latency_ms = datetime.now()
+                result, cache_status = generate_local_reply(payload, *client_identity(request, user_id))
                 latency_ms = int((datetime.now() - latency_ms).total_seconds() * 1000)
-                bot_reply = response.json().get("response", "No reply.")
+                bot_reply = result.get("response", "No reply.")
+                next_context = result.get("context")
+                ollama_stats = result
+            except AdmissionRejected as e:
+                return queue_full_response(e.reason)
             except Exception as e:
                 # Fallback to gemini if available & requested
                 try:
-                    if gemini_model:
+                    if gemini_models.enabled:
                         fallback_used = True
                         model_type = "cloud"
                         model_name = "gemini"
                         latency_ms = datetime.now()
                         # Use model with system instruction if provided
-                        if system_prompt:
-                            model_with_system = genai.GenerativeModel(
-                                "models/gemini-2.5-flash",
-                                system_instruction=system_prompt
-                            )
-                            response = model_with_system.generate_content(combined_input, generation_config=generation_config)
-                        else:
-                            response = gemini_model.generate_content(combined_input, generation_config=generation_config)
+                        response = gemini_models.get(system_prompt).generate_content(combined_input, generation_config=generation_config)
                         latency_ms = int((datetime.now() - latency_ms).total_seconds() * 1000)
                         bot_reply = response.text or f"Local model failed, fallback used: {str(e)}"
                     else:
@@ -278,50 +475,45 @@ def chat():
         else:
             try:
                 if model_name == "gemini":
-                    print(combined_input)
+                    logger.debug("Gemini prompt: %d chars", len(combined_input))
                     latency_ms = datetime.now()
                     # Use model with system instruction if provided
-                    if system_prompt:
-                        model_with_system = genai.GenerativeModel(
-                            "models/gemini-2.5-flash",
-                            system_instruction=system_prompt
-                        )
-                        response = model_with_system.generate_content(combined_input, generation_config=generation_config)
-                    else:
-                        response = gemini_model.generate_content(combined_input, generation_config=generation_config)
+                    response = gemini_models.get(system_prompt).generate_content(combined_input, generation_config=generation_config)
                     latency_ms = int((datetime.now() - latency_ms).total_seconds() * 1000)
                     bot_reply = response.text or "No Reply"
             except Exception as e:
                 bot_reply = f"Cloud model error: {str(e)}"
 
+        timings.add("inference", time.perf_counter() - inference_start)
+        backend = "ollama" if model_type == "local" else "gemini"
+        if cache_status in ("hit", "coalesced"):
+            backend = "cache"
+        metrics.record_ollama(ollama_stats, model_name, backend)
+
         # ====== Message Format ======
         messages = [
             {"role": "user", "content": user_msg, "timestamp": user_timestamp},
             {"role": "bot", "content": bot_reply, "timestamp": datetime.now(), "model_name": model_name}
         ]
 
-        # save chat history to DB
-        if session_id != "1":
-            mongo.db.sessions.update_one(
-                {"_id": ObjectId(session_id)},
-                {"$push": {"messages": {"$each": messages}}},
-            )
-        else:
-            session_doc = {
-                "session_name": session_name or "How can I help you?",
-                "messages": messages,
-                "created_at": datetime.now(),
-                "user_id": user_id
-            }
-            inserted = mongo.db.sessions.insert_one(session_doc)
-            session_id = str(inserted.inserted_id)
-            
-            # Add to user's chat list if logged in
-            if user_id:
-                mongo.db.users.update_one(
-                    {"_id": ObjectId(user_id)},
-                    {"$push": {"chat_sessions": session_id}}
-                )
+        # save chat history to DB, the limit is enforced atomically by the write
+        try:
+            with timings.phase("persistence"):
+                session_id = save_messages(session_id, session_name, user_id, messages,
+                                           max_user_messages=current_app.config.get("MAX_MESSAGES_PER_SESSION", 10),
+                                           documents=documents)
+        except MessageLimitReached:
+            return jsonify({"error": LIMIT_REACHED_ERROR, "limit_reached": True}), 403
+        except SessionNotFound:
+            return jsonify({"error": SESSION_NOT_FOUND_ERROR}), 404
+
+        if next_context and current_app.config.get("OLLAMA_REUSE_CONTEXT", True):
+            try:
+                with timings.phase("persistence"):
+                    save_model_context(session_id, payload, next_context)
+            except Exception as e:
+                print(f"Could not save Ollama context for {session_id}: {e}")
+        metrics.record_request("chat", timings, model_name, backend)
 
         return jsonify({
             "response": bot_reply,
@@ -331,6 +523,9 @@ def chat():
             "fallback_used": fallback_used,
             "model_name": model_name,
             "model_type": model_type,
+            "mention_context": mention_report,
+            "document_context": document_report,
+            "cached": cache_status,
         })
 
     except Exception as e:
@@ -339,283 +534,425 @@ def chat():
 
 
 
-@chat_bp.route("/chat/stream", methods=["POST"])
-def chat_stream():
-    try:
-        # Validate user
-        user_id = validate_user(request)
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Cache-Control'
+}
 
-        # ====== Base form data ======
-        user_msg = request.form.get("message", "")
-        model_type = request.form.get("model_type", "")
-        model_name = request.form.get("model_name", "")
-        session_id = request.form.get("session_id", "1")
-        session_name = request.form.get("session_name", "")
-        if has_reached_message_limit(session_id):
-            def error_generator():
-                err_msg = "Session limit reached. Please start a new chat."
-                # This matches the error format your frontend expects in line 969 of page.tsx
-                yield f"data: {json.dumps({'type': 'error', 'message': err_msg, 'limit_reached': True})}\n\n"
-            
-            return Response(error_generator(), mimetype='text/event-stream')
-        
-        user_timestamp = datetime.now() - timedelta(seconds=10)
+def prepare_stream_job(req, sse=True, endpoint="stream"):
+    """
+    Validates a /chat/stream request and prepares it for the stream engine.
 
-        # ====== Inference Parameters ======
-        temperature = float(request.form.get("temperature", 0.7))
-        top_p = float(request.form.get("top_p", 0.9))
-        top_k = int(request.form.get("top_k", 40))
-        max_tokens = int(request.form.get("max_tokens", 2048))
-        frequency_penalty = float(request.form.get("frequency_penalty", 0))
-        presence_penalty = float(request.form.get("presence_penalty", 0))
-        stop_sequence = request.form.get("stop_sequence", "").strip()
-        seed_str = request.form.get("seed", "").strip()
-        seed = int(seed_str) if seed_str else None
-        system_prompt = request.form.get("system_prompt", "").strip()
+    Everything that needs the request (auth, limits, mentions, uploads) is
+    done here, so the stream itself can run without a request context.
 
-        # Build generation config for Gemini
-        generation_config = {
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "max_output_tokens": max_tokens,
-        }
-        if stop_sequence:
-            generation_config["stop_sequences"] = [stop_sequence]
+    Args:
+    req (Request): The incoming Flask request.
+    sse (bool): Answer a reached message limit as an SSE error event (False: as /chat does).
+    endpoint (str): Metrics label of the calling route.
 
-        # Mentions: fetch context
-        mention_session_ids = request.form.getlist("mention_session_ids[]")
-        history_context = ""
-        if mention_session_ids:
-            print(mention_session_ids)
-            for m_id in mention_session_ids:
-                if ObjectId.is_valid(m_id):
-                    s = mongo.db.sessions.find_one({"_id": ObjectId(m_id)})
-                    if s:
-                        for m in s.get("messages", []):
-                            history_context += f"{m['role']}: {m['content']}\n"
-        if history_context:
-            combined_input = (
-                f"Here is some previous conversation context that you should consider:\n"
-                f"{history_context}\n\n"
-                f"Now, based on the above context, here is the user's new message:\n"
-                f"{user_msg}"
+    Returns:
+    tuple: (response, None) if the request was answered directly,
+           otherwise (None, job) with the job dict for the stream engine.
+    """
+    timings = RequestTimings()
+    # Validate user
+    with timings.phase("auth"):
+        user_id = validate_user(req)
+
+    # ====== Base form data ======
+    user_msg = req.form.get("message", "")
+    model_type = req.form.get("model_type", "")
+    model_name = req.form.get("model_name", "")
+    session_id = req.form.get("session_id", "1")
+    session_name = req.form.get("session_name", "")
+    with timings.phase("limit_check"):
+        limit_reached = has_reached_message_limit(session_id)
+    if limit_reached and not sse:
+        return (jsonify({"error": LIMIT_REACHED_ERROR, "limit_reached": True}), 403), None
+    if limit_reached:
+        def error_generator():
+            err_msg = LIMIT_REACHED_ERROR
+            # This matches the error format your frontend expects in line 969 of page.tsx
+            yield f"data: {json.dumps({'type': 'error', 'message': err_msg, 'limit_reached': True})}\n\n"
+
+        return Response(error_generator(), mimetype='text/event-stream'), None
+
+    user_timestamp = datetime.now() - timedelta(seconds=10)
+
+    # ====== Inference Parameters ======
+    params = parse_inference_params(req.form)
+
+    # Build generation config for Gemini
+    generation_config = build_generation_config(params)
+
+    # Mentions: fetch context
+    mention_session_ids = req.form.getlist("mention_session_ids[]")
+    history_context, mention_report = "", None
+    if mention_session_ids:
+        with timings.phase("mentions"):
+            history_context, mention_report = build_mention_context(
+                mention_session_ids,
+                max_chars=current_app.config.get("MENTION_CONTEXT_MAX_CHARS"),
+                max_tokens=current_app.config.get("MENTION_CONTEXT_MAX_TOKENS"),
             )
-        else:
-            combined_input = user_msg
-        
-        # ====== File Handling (optional) ======
-        uploaded_file = request.files.get("uploaded_file")
-        if uploaded_file:
-            if not allowed_file(uploaded_file.filename):
-                return jsonify({"error": "Unsupported file type"}), 400
-            if uploaded_file.filename == "":
-                return jsonify({"error": "Empty file"}), 400
+        if mention_report["truncated"]:
+            logger.debug("Mention context truncated: %s", mention_report)
+    if history_context:
+        combined_input = (
+            f"Here is some previous conversation context that you should consider:\n"
+            f"{history_context}\n\n"
+            f"Now, based on the above context, here is the user's new message:\n"
+            f"{user_msg}"
+        )
+    else:
+        combined_input = user_msg
 
-            file_bytes = uploaded_file.read()
-            file_ext = uploaded_file.filename.rsplit(".", 1)[-1].lower()
+    # ====== File Handling (optional) ======
+    document_context, document_report, documents = "", None, None
+    uploaded_file = req.files.get("uploaded_file")
+    if uploaded_file:
+        if not allowed_file(uploaded_file.filename):
+            return (jsonify({"error": "Unsupported file type"}), 400), None
+        if uploaded_file.filename == "":
+            return (jsonify({"error": "Empty file"}), 400), None
 
-            if model_type == "local":
-                return jsonify({"error": "Selected local model does not support files"}), 400
+        file_bytes = uploaded_file.read()
+        file_ext = uploaded_file.filename.rsplit(".", 1)[-1].lower()
+
+        if model_type == "local":
+            return (jsonify({"error": "Selected local model does not support files"}), 400), None
+        else:
+            # For file uploads, we'll use non-streaming for now
+            if file_ext == "pdf":
+                with timings.phase("pdf"):
+                    document_context, document_report, documents = build_document_context(
+                        user_msg, session_id, uploaded_file, file_bytes
+                    )
             else:
-                # For file uploads, we'll use non-streaming for now
-                if file_ext == "pdf":
-                    extracted_text = extract_text_from_pdf_bytes(file_bytes)
-                    combined_input = f"{combined_input}\n\n[PDF Content Extracted]\n{extracted_text}"
-                else:
-                    response = gemini_model.generate_content(
+                with timings.phase("inference"):
+                    response = gemini_models.get().generate_content(
                         [combined_input, {"mime_type": uploaded_file.mimetype or "image/jpeg", "data": file_bytes}],
                         generation_config=generation_config
                     )
-                    bot_reply = response.text or "No reply."
-                    return save_and_return(session_id, session_name, model_name, user_msg, bot_reply, uploaded_file, file_bytes)
+                bot_reply = response.text or "No reply."
+                return save_and_return(session_id, session_name, model_name, user_msg, bot_reply, uploaded_file, file_bytes,
+                                       user_id=user_id, latency_ms=int(timings.phases["inference"] * 1000),
+                                       timings=timings, endpoint=endpoint), None
+    else:
+        with timings.phase("pdf"):
+            document_context, document_report, documents = build_document_context(user_msg, session_id)
+    if document_context:
+        combined_input = f"{combined_input}\n\n[PDF Content Extracted]\n{document_context}"
+
+    payload = build_ollama_payload(model_name, combined_input, params, stream=True)
+    cache_key = None
+    user_key, authenticated = client_identity(req, user_id)
+    if model_type == "local":
+        attach_model_context(payload, session_id)
+        model_residency.touch(model_name)
+        cache_key = response_cache.key_for(payload)
+        # Shed load before opening the stream (cacheable requests may still be served from the cache)
+        if not cache_key and admission.would_reject(model_name, authenticated):
+            return queue_full_response("queue_full"), None
+
+    job = {
+        "user_id": user_id,
+        "user_msg": user_msg,
+        "user_timestamp": user_timestamp,
+        "model_type": model_type,
+        "model_name": model_name,
+        "session_id": session_id,
+        "session_name": session_name,
+        "message_limit": current_app.config.get("MAX_MESSAGES_PER_SESSION", 10),
+        "mention_context": mention_report,
+        "document_context": document_report,
+        "documents": documents,
+        "combined_input": combined_input,
+        "system_prompt": params["system_prompt"],
+        "generation_config": generation_config,
+        "payload": payload,
+        "reuse_context": current_app.config.get("OLLAMA_REUSE_CONTEXT", True),
+        "cache_key": cache_key,
+        "user_key": user_key,
+        "authenticated": authenticated,
+        "hedge": wants_hedge(req.form, model_type),
+        "timings": timings,
+        "endpoint": endpoint,
+    }
+    return None, job
+
+
+def submit_chat_job():
+    """
+    Starts a /chat request as a background job.
 
-        def generate_stream():
-            bot_reply = ""
-            start_time = datetime.now()
-            
-            # Send session info first
-            yield f"data: {json.dumps({'type': 'session_info', 'session_id': session_id})}\n\n"
-            
-            try:
-                if model_type == "local":
-                    try:
-                        payload = {
-                            "model": model_name,
-                            "prompt": combined_input,
-                            "stream": True,
-                            "options": {
-                                "temperature": temperature,
-                                "top_p": top_p,
-                                "top_k": top_k,
-                                "num_predict": max_tokens,
-                                "frequency_penalty": frequency_penalty,
-                                "presence_penalty": presence_penalty,
-                            }
-                        }
-                        if stop_sequence:
-                            payload["options"]["stop"] = [stop_sequence]
-                        if seed is not None:
-                            payload["options"]["seed"] = seed
-                        if system_prompt:
-                            payload["system"] = system_prompt
-                        response = requests.post("http://localhost:11434/api/generate", json=payload, stream=True, timeout=60)
-                        response.raise_for_status()
-                        
-                        for line in response.iter_lines():
-                            if line:
-                                try:
-                                    chunk_data = json.loads(line.decode('utf-8'))
-                                    chunk_text = chunk_data.get("response", "")
-                                    if chunk_text:
-                                        bot_reply += chunk_text
-                                        yield f"data: {json.dumps({'type': 'chunk', 'text': chunk_text})}\n\n"
-                                    
-                                    if chunk_data.get("done", False):
-                                        break
-                                except json.JSONDecodeError:
-                                    continue
-                                except GeneratorExit:
-                                    break
-                    except Exception as e:
-                        # Fallback to gemini streaming
-                        if gemini_model:
-                            fallback_msg = f"[Local model failed, switching to gemini: {str(e)}]\n"
-                            bot_reply += fallback_msg
-                            yield f"data: {json.dumps({'type': 'chunk', 'text': fallback_msg})}\n\n"
-                            try:
-                                # Use model with system instruction if provided
-                                if system_prompt:
-                                    model_with_system = genai.GenerativeModel(
-                                        "models/gemini-2.5-flash",
-                                        system_instruction=system_prompt
-                                    )
-                                    response = model_with_system.generate_content(
-                                        combined_input,
-                                        generation_config=generation_config,
-                                        stream=True
-                                    )
-                                else:
-                                    response = gemini_model.generate_content(
-                                        combined_input,
-                                        generation_config=generation_config,
-                                        stream=True
-                                    )
-                                for chunk in response:
-                                    try:
-                                        chunk_text = chunk.text if chunk.text else ""
-                                        if chunk_text:
-                                            bot_reply += chunk_text
-                                            yield f"data: {json.dumps({'type': 'chunk', 'text': chunk_text})}\n\n"
-                                    except GeneratorExit:
-                                        break
-                            except Exception as ge:
-                                err_txt = f"[Fallback gemini error: {str(ge)}]"
-                                bot_reply += err_txt
-                                yield f"data: {json.dumps({'type': 'error', 'message': err_txt})}\n\n"
-                        else:
-                            err_txt = f"[Local model error and no fallback: {str(e)}]"
-                            bot_reply += err_txt
-                            yield f"data: {json.dumps({'type': 'error', 'message': err_txt})}\n\n"
-                                
-                else:  # Cloud model (Gemini)
-                    if model_name == "gemini":
-                        # Gemini streaming
-                        # Use model with system instruction if provided
-                        if system_prompt:
-                            model_with_system = genai.GenerativeModel(
-                                "models/gemini-2.5-flash",
-                                system_instruction=system_prompt
-                            )
-                            response = model_with_system.generate_content(
-                                combined_input,
-                                generation_config=generation_config,
-                                stream=True
-                            )
-                        else:
-                            response = gemini_model.generate_content(
-                                combined_input,
-                                generation_config=generation_config,
-                                stream=True
-                            )
-
-                        for chunk in response:
-                            try:
-                                chunk_text = chunk.text if chunk.text else ""
-                                if chunk_text:
-                                    bot_reply += chunk_text
-                                    yield f"data: {json.dumps({'type': 'chunk', 'text': chunk_text})}\n\n"
-                            except GeneratorExit:
-                                # Handle client disconnect/stop generation
-                                break
-                    
-            except Exception as e:
-                error_msg = f"Error: {str(e)}"
-                bot_reply = error_msg
-                yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-            
-            # Calculate latency
-            end_time = datetime.now()
-            latency_ms = int((end_time - start_time).total_seconds() * 1000)
-            
-            # Save to database only if we have some content
-            if bot_reply.strip():
-                messages = [
-                    {"role": "user", "content": user_msg, "timestamp": user_timestamp},
-                    {"role": "bot", "content": bot_reply, "timestamp": end_time, "model_name": model_name}
-                ]
-
-                final_session_id = session_id
-                if session_id != "1":
-                    mongo.db.sessions.update_one(
-                        {"_id": ObjectId(session_id)},
-                        {"$push": {"messages": {"$each": messages}}},
-                    )
-                else:
-                    session_doc = {
-                        "session_name": session_name or "How can I help you?",
-                        "messages": messages,
-                        "created_at": datetime.now(),
-                        "user_id": user_id
-                    }
-                    inserted = mongo.db.sessions.insert_one(session_doc)
-                    final_session_id = str(inserted.inserted_id)
-
-                    # Add to user's chat list
-                    if user_id:
-                        mongo.db.users.update_one(
-                            {"_id": ObjectId(user_id)},
-                            {"$push": {"chat_sessions": final_session_id}}
-                        )
-                
-                # Send completion message
-                yield f"data: {json.dumps({'type': 'complete', 'session_id': final_session_id, 'timestamp': end_time.isoformat(), 'latency': latency_ms})}\n\n"
+    The request is validated like /chat/stream, then generated on the
+    stream engine while the client polls GET /chat/jobs/<id> or attaches
+    to GET /chat/jobs/<id>/stream.
+    Uploaded images and other media are still answered directly, as
+    /chat/stream does.
+
+    Returns:
+    JSON: job_id, status and the URLs of the job (202), or the error.
+    """
+    try:
+        response, job = prepare_stream_job(request, sse=False, endpoint="job")
+        if response is not None:
+            return response
+        job["fallback_notice"] = False
+        try:
+            job_id = chat_jobs.submit(job)
+        except AdmissionRejected as e:
+            return queue_full_response(e.reason)
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "poll_url": f"/chat/jobs/{job_id}",
+            "stream_url": f"/chat/jobs/{job_id}/stream",
+        }), 202
+    except Exception as e:
+        print("Error in /chat (async):", e)
+        return jsonify({"error": str(e)}), 500
+
+@chat_bp.route("/chat/jobs/<job_id>", methods=["GET"])
+def chat_job(job_id):
+    """
+    Returns the state of a background /chat job.
+
+    With `?wait=<seconds>` the request waits (up to CHAT_JOB_MAX_WAIT) for
+    the job to finish before answering.
+
+    Returns:
+    JSON: job_id, status (queued, running, done, failed) and created_at,
+          with `result` (the /chat response) once done, the error once
+          failed, or `partial` (the text so far) while it runs.
+    """
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    status = chat_jobs.get(job_id, validate_user(request), wait=wait)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
+def open_job_stream(req, job_id):
+    """
+    Attaches to the events of a background /chat job.
+
+    Returns:
+    tuple: (response, None) if the job was not found, otherwise (None, stream)
+           with the job's EventStream.
+    """
+    stream = chat_jobs.open_events(job_id, validate_user(req))
+    if stream is None:
+        return (jsonify({"error": "Job not found"}), 404), None
+    return None, stream
+
+@chat_bp.route("/chat/jobs/<job_id>/stream", methods=["GET"])
+def chat_job_stream(job_id):
+    """
+    Streams a background /chat job as server-sent events, from its first
+    event on. Disconnecting does not stop the job.
+
+    Returns:
+    Response: text/event-stream with the same events as /chat/stream.
+    """
+    response, stream = open_job_stream(request, job_id)
+    if response is not None:
+        return response
+    return Response(iter_sse(stream), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@chat_bp.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Streams a chat reply as server-sent events.
+
+    The stream runs on the asyncio stream engine; this WSGI route only
+    relays its events. Under the ASGI entry point (api/asgi.py) the same
+    job is served without holding a worker thread per stream.
+
+    Returns:
+    Response: text/event-stream of session_info, chunk, complete and error events.
+    """
+    try:
+        response, job = prepare_stream_job(request)
+        if response is not None:
+            return response
 
         return Response(
-            generate_stream(),
+            iter_sse(stream_engine.open_stream(job)),
             mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Cache-Control'
-            }
+            headers=SSE_HEADERS
         )
 
     except Exception as e:
         print("Error in /chat/stream:", e)
         return jsonify({"error": str(e)}), 500
 
+def prepare_batch_job(fields, index, user_id, user_key, authenticated):
+    """
+    Prepares one /chat/batch item for the stream engine.
+
+    Args:
+    fields (dict): The item's fields over the batch defaults, named like the /chat form fields.
+    index (int): Position of the item in the batch.
+    user_id (str): Logged-in user, None for guests.
+    user_key (str): Requesting user for admission control (see client_identity).
+    authenticated (bool): Whether the user is logged in.
+
+    Returns:
+    dict: The job dict for the stream engine.
+    """
+    form = {key: str(value) for key, value in fields.items() if value is not None}
+    params = parse_inference_params(form)
+    model_type = form.get("model_type", "")
+    model_name = form.get("model_name", "")
+    user_msg = form.get("message", "")
+    payload = build_ollama_payload(model_name, user_msg, params, stream=True)
+    return {
+        "index": index,
+        "item_id": fields.get("id"),
+        "user_id": user_id,
+        "user_msg": user_msg,
+        "user_timestamp": datetime.now(),
+        "model_type": model_type,
+        "model_name": model_name,
+        "session_name": form.get("session_name", ""),
+        "combined_input": user_msg,
+        "system_prompt": params["system_prompt"],
+        "generation_config": build_generation_config(params),
+        "payload": payload,
+        "cache_key": response_cache.key_for(payload) if model_type == "local" else None,
+        "user_key": user_key,
+        "authenticated": authenticated,
+        "hedge": wants_hedge(form, model_type),
+    }
+
+@chat_bp.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Runs many prompts in one request with bounded concurrency.
+
+    Expects JSON: { "items": [{"message": "...", "id": "...", ...}], "defaults": {...},
+                    "concurrency": 4, "save": "none", "session_id": "...", "session_name": "..." }
+    Items and defaults take the /chat form fields (model_type, model_name,
+    temperature, ..., seed, system_prompt, hedge, session_name); an item's
+    fields override the defaults.
+    Results are not saved unless asked: "save": "single_session" (or true)
+    puts every exchange into one new session named `session_name`, a
+    "session_id" appends them to that session (within its message limit),
+    and "save": "sessions" makes each item its own session.
+
+    Returns:
+    Response: application/x-ndjson with one result line per item, in the
+              order they complete, followed by a summary line.
+    """
+    try:
+        user_id = validate_user(request)
+        data = request.get_json(silent=True) or {}
+        items = data.get("items")
+        max_items = current_app.config.get("BATCH_MAX_ITEMS", 1000)
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "items must be a non-empty list"}), 400
+        if len(items) > max_items:
+            return jsonify({"error": f"At most {max_items} items per batch"}), 400
+        defaults = data.get("defaults") or {}
+        max_concurrency = current_app.config.get("BATCH_MAX_CONCURRENCY", 4)
+        concurrency = max(1, min(int(data.get("concurrency") or max_concurrency), max_concurrency))
+
+        save = data.get("save", "none")
+        if save is True:
+            save = "single_session"
+        elif save is False or save is None:
+            save = "none"
+        session_id = data.get("session_id")
+        if session_id:
+            if not ObjectId.is_valid(session_id):
+                return jsonify({"error": "Invalid session ID format"}), 400
+            write_behind.wait_for(session_id=session_id)
+            session = mongo.db.sessions.find_one({"_id": ObjectId(session_id)}, {"user_id": 1})
+            if not session or session.get("user_id") != user_id:
+                return jsonify({"error": "Session not found"}), 404
+            save = {"mode": "session", "session_id": session_id,
+                    "message_limit": current_app.config.get("MAX_MESSAGES_PER_SESSION", 10)}
+        elif save in ("none", "single_session", "sessions"):
+            save = {"mode": save, "session_name": data.get("session_name") or f"Batch of {len(items)} prompts"}
+        else:
+            return jsonify({"error": "save must be none, single_session or sessions"}), 400
+
+        user_key, authenticated = client_identity(request, user_id)
+        jobs = []
+        for index, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"message": item}
+            if not isinstance(item, dict) or not item.get("message"):
+                return jsonify({"error": f"Item {index} has no message"}), 400
+            try:
+                jobs.append(prepare_batch_job({**defaults, **item}, index, user_id, user_key, authenticated))
+            except ValueError as e:
+                return jsonify({"error": f"Item {index}: {e}"}), 400
+        for model_name in {job["model_name"] for job in jobs if job["model_type"] == "local"}:
+            model_residency.touch(model_name)
+
+        return Response(
+            iter_ndjson(stream_engine.open_batch(jobs, user_id, concurrency, save)),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    except Exception as e:
+        print("Error in /chat/batch:", e)
+        return jsonify({"error": str(e)}), 500
+
 @chat_bp.route("/chat/history", methods=["POST"])
 def chat_history():
     """
     Fetches chat history for given session IDs.
 
+    With summary mode (`?summary=1` or `"summary": true` in the body) only
+    id, name, created_at, message count and a last-message preview are
+    returned, a page at a time (`limit`, `cursor`).
+
     Returns:
-    JSON: List of sessions with message history.
+    JSON: List of sessions with message history, or in summary mode
+          {"sessions": [...], "next_cursor": str|null}.
     """
     user_id = validate_user(request)
-    
+    data = request.get_json(silent=True) or {}
+    # Include exchanges still in the write-behind queue
+    if user_id:
+        write_behind.wait_for(user_id=user_id)
+    else:
+        for sid in data.get("session_ids", []):
+            write_behind.wait_for(session_id=sid)
+
+    if request.args.get("summary") in ("1", "true") or data.get("summary"):
+        try:
+            limit = int(request.args.get("limit", data.get("limit", 50)))
+        except (TypeError, ValueError):
+            return jsonify({"error": "limit must be an integer"}), 400
+        # A page holds 1 to 200 sessions
+        limit = max(1, min(limit, 200))
+        cursor = request.args.get("cursor", data.get("cursor"))
+        if user_id:
+            query = {"user_id": user_id}
+        else:
+            try:
+                object_ids = [ObjectId(sid) for sid in data.get("session_ids", [])]
+            except Exception as e:
+                return jsonify({"error": "Invalid session ID format"}), 400
+            # Strict check: guest can only see guest chats
+            query = {"_id": {"$in": object_ids}, "user_id": None}
+        try:
+            summaries, next_cursor = list_session_summaries(query, limit=limit, cursor=cursor)
+        except Exception as e:
+            return jsonify({"error": f"Invalid cursor: {str(e)}"}), 400
+        return jsonify({"sessions": summaries, "next_cursor": next_cursor})
+
     if user_id:
         # If logged in, fetch sessions from user's list
         user = mongo.db.users.find_one({"_id": ObjectId(user_id)})
@@ -631,7 +968,6 @@ def chat_history():
     else:
         # If not logged in, fetch only the requested IDs that DO NOT have a user_id
         # This prevents guests from peeking at user sessions even if they guess an ID
-        data = request.json or {}
         id_list = data.get("session_ids", [])
         try:
             object_ids = [ObjectId(sid) for sid in id_list]
@@ -643,46 +979,65 @@ def chat_history():
             "user_id": None # Strict check: guest can only see guest chats
         }).sort("created_at", -1)
 
+    sessions = list(sessions)
+    transcripts = get_transcripts([session["_id"] for session in sessions])
+
     result = []
     for session in sessions:
+        session["messages"] = [serialize_message(msg) for msg in transcripts[session["_id"]]]
         session["_id"] = str(session["_id"])
         if "user_id" in session:
             session["user_id"] = str(session["user_id"])
-            
-        for msg in session.get("messages", []):
-            if hasattr(msg["timestamp"], "isoformat"):
-                msg["timestamp"] = msg["timestamp"].isoformat()
         result.append(session)
 
     return jsonify(result)
 @chat_bp.route("/chat/<session_id>", methods=["GET"])
 def get_session_messages(session_id):
     """
-    Retrieves all messages for a specific chat session.
+    Retrieves messages for a specific chat session.
+
+    Query params (all optional):
+    limit (int): Page size; without it the whole transcript is returned.
+    before (str): Message id; return the page of messages older than it.
+    after (str): Message id; return only messages newer than it (delta sync).
 
     Args:
     session_id (str): MongoDB ObjectId of the session.
 
     Returns:
-    JSON: Session ID and message list or error.
+    JSON: Session ID, message page, has_more flag and cursors, the
+          exchanges that could not be saved, or error.
     """
     try:
-        session = mongo.db.sessions.find_one({"_id": ObjectId(session_id)})
+        write_behind.wait_for(session_id=session_id)
+        session = mongo.db.sessions.find_one({"_id": ObjectId(session_id)}, {"_id": 1, "failed_writes": 1})
 
         if not session:
             return jsonify({"error": "Session not found"}), 404
 
-        # Convert timestamps to ISO format for JSON serialization
-        for msg in session.get("messages", []):
-            if "timestamp" in msg:
-                msg["timestamp"] = msg["timestamp"].isoformat()
-        
+        limit = request.args.get("limit", type=int)
+        if limit is not None and limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        messages, has_more = get_messages(
+            session_id,
+            before=request.args.get("before"),
+            after=request.args.get("after"),
+            limit=limit,
+        )
+        # Convert ids and timestamps for JSON serialization
+        messages = [serialize_message(msg) for msg in messages]
+
         limit_reached = has_reached_message_limit(session_id)
 
         return jsonify({
             "session_id": str(session["_id"]),
-            "messages": session["messages"],
-            "limit_reached": limit_reached
+            "messages": messages,
+            "has_more": has_more,
+            "first_id": messages[0]["id"] if messages else None,
+            "last_id": messages[-1]["id"] if messages else None,
+            "limit_reached": limit_reached,
+            # Exchanges that were answered but could not be saved
+            "failed_writes": get_failed_writes(session_id) if session.get("failed_writes") else []
         })
 
     except Exception as e:
@@ -705,6 +1060,7 @@ def rename_session():
         return jsonify({"error": "Missing session_id or new_name"}), 400
 
     try:
+        write_behind.wait_for(session_id=session_id)
         result = mongo.db.sessions.update_one(
             {"_id": ObjectId(session_id)},
             {"$set": {"session_name": new_name}}
@@ -734,12 +1090,8 @@ def clear():
         return jsonify({"error": "Missing session_id"}), 400
 
     try:
-        result = mongo.db.sessions.update_one(
-            {"_id": ObjectId(session_id)},
-            {"$set": {"messages": []}}
-        )
-
-        if result.matched_count == 0:
+        write_behind.wait_for(session_id=session_id)
+        if not clear_messages(session_id):
             return jsonify({"error": "Session not found"}), 404
 
         return jsonify({"status": "cleared", "session_id": session_id})
@@ -763,10 +1115,9 @@ def delete_chat(session_id):
         if not ObjectId.is_valid(session_id):
             return jsonify({"error": "Invalid session_id"}), 400
 
-        # Attempt to delete
-        result = mongo.db.sessions.delete_one({"_id": ObjectId(session_id)})
-
-        if result.deleted_count == 0:
+        # Attempt to delete the session and its messages
+        write_behind.wait_for(session_id=session_id)
+        if not delete_session(session_id):
             return jsonify({"error": "Chat session not found"}), 404
 
         # Remove from any user's chat list
@@ -1,5 +1,6 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify
 from api import mongo
+from api.services.persistence_services import write_behind
 
 db_bp = Blueprint('db', __name__)
 
@@ -16,4 +17,16 @@ def mongo_test():
         count = mongo.db.sessions.count_documents({})
         return f"Connected to MongoDB! Session count: {count}"
     except Exception as e:
-        return f"MongoDB connection failed: {str(e)}", 500
\ No newline at end of file
+        return f"MongoDB connection failed: {str(e)}", 500
+
+
+@db_bp.route("/db/write_behind")
+def write_behind_status():
+    """
+    Reports the write-behind queue: queued writes, sessions with pending
+    writes, flush latency percentiles and write/retry/failure counts.
+
+    Returns:
+    JSON: Queue depth, flush latency and stats.
+    """
+    return jsonify(write_behind.snapshot())
@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, jsonify
+from api.services.metrics_services import metrics
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+
+@metrics_bp.route("/metrics")
+def prometheus_metrics():
+    """
+    Exposes request phase timings, time to first token, Ollama eval stats
+    and the state of the backend services in the Prometheus text format.
+
+    Returns:
+    Response: text/plain exposition, or 404 when METRICS_ENABLED is off.
+    """
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
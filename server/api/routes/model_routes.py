@@ -1,5 +1,13 @@
 from flask import Blueprint, jsonify, request
-from api.services.ollama_services import get_available_models, get_model_details
+from api import gemini_models
+from api.services.ollama_services import (
+    get_available_models, get_model_details, model_catalog, ollama_pool
+)
+from api.services.residency_services import model_residency
+from api.services.response_cache import response_cache
+from api.services.admission_services import admission, AdmissionRejected
+from api.services.breaker_services import breakers
+from api.services.stream_engine import stream_engine
 
 model_bp=Blueprint('model_bp', __name__)
 
@@ -57,16 +65,96 @@ def model_info():
     
     return jsonify({"error": "Failed to fetch model info"}), 500
 
+@model_bp.route("/models/cache_stats")
+def models_cache_stats():
+    """
+    Returns hit/miss counters of the model catalog cache, the Gemini
+    model registry and the response cache.
+
+    Returns:
+    JSON: Cache counters and current cache sizes.
+    """
+    return jsonify({
+        "catalog": model_catalog.snapshot(),
+        "gemini_models": gemini_models.snapshot(),
+        "responses": response_cache.snapshot(),
+    })
+
+@model_bp.route("/models/admission")
+def models_admission():
+    """
+    Returns the admission control state of each local model: limit, running
+    and queued requests (authenticated and guests) and shed counters.
+
+    Returns:
+    JSON: Admission snapshot.
+    """
+    return jsonify(admission.snapshot())
+
+@model_bp.route("/models/hosts")
+def models_hosts():
+    """
+    Returns the Ollama host pool: health, requests in flight, and the
+    pulled and loaded models used for routing.
+
+    Returns:
+    JSON: Per-host status and routing counters.
+    """
+    return jsonify(ollama_pool.snapshot())
+
+@model_bp.route("/models/backends")
+def models_backends():
+    """
+    Returns the circuit breaker of each local backend: state (closed, open,
+    half_open), recent error rate, time-to-first-token percentiles and
+    when an open circuit will be probed again, plus how often hedged
+    requests started Gemini and which backend won, how many streams
+    were cancelled by their client, and how many streamed chunks were
+    coalesced into how many SSE frames.
+
+    Returns:
+    JSON: Breaker state per backend URL, hedging and stream stats.
+    """
+    return jsonify({"backends": breakers.snapshot(), "hedging": stream_engine.hedge_snapshot(),
+                    "streams": dict(stream_engine.stats)})
+
 select_model_bp = Blueprint('select_model_bp', __name__)
 @select_model_bp.route("/select_model", methods=["POST"])
 def select_model():
     """
-    Selects the current model based on user input.
+    Selects the current model and starts loading it in the background.
+    Expects JSON: { "model": "name", "model_type": "local"|"cloud", "keep_alive": "30m" }
 
     Returns:
-    JSON: Status of model selection.
+    JSON: Status of model selection and the model's warm-up status; 404 for
+          a model no Ollama host has, 429 if too many warm-ups are pending.
+    """
+    data = request.json or {}
+    model_name = data.get("model", "phi3")
+    if data.get("model_type") == "cloud" or model_name == "gemini":
+        return jsonify({"status": "ok", "model": model_name, "warmup": {"state": "ready"}})
+
+    try:
+        known = model_catalog.knows(model_name, fetch=True)
+    except Exception as e:
+        return jsonify({"error": f"Could not list the local models: {e}"}), 503
+    if not known:
+        return jsonify({"error": f"Model {model_name} is not available"}), 404
+    try:
+        warmup = model_residency.warm(model_name, data.get("keep_alive"))
+    except AdmissionRejected as e:
+        response = jsonify({"error": "Too many models are loading, try again shortly", "reason": e.reason})
+        response.headers["Retry-After"] = "5"
+        return response, 429
+    return jsonify({"status": "ok", "model": model_name, "warmup": warmup})
+
+@select_model_bp.route("/select_model/status")
+def select_model_status():
     """
+    Reports warm-up state and residency of local models, so the UI can show
+    when a selected model is ready. Accepts ?model=name to report one model.
 
-    global current_model
-    current_model = request.json.get("model", "phi3")
-    return jsonify({"status": "ok"})
\ No newline at end of file
+    Returns:
+    JSON: Per-model status, resident models and memory budget usage.
+    """
+    return jsonify(model_residency.status(request.args.get("model")))
\ No newline at end of file
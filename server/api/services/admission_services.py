@@ -0,0 +1,340 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from api.config import Config
+from api.services.ollama_services import ollama_pool
+
+QUEUE_FULL_ERROR = "The local model is busy, please retry in a few seconds."
+
+# Queue classes, served in this order
+AUTHENTICATED, GUEST = 0, 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (queue full or waited too long)."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Ticket:
+    """
+    A request's place in a model's admission queue.
+    """
+
+    def __init__(self, model, user, authenticated):
+        self.model = model
+        self.user = user
+        self.priority = AUTHENTICATED if authenticated else GUEST
+        self.granted = False
+        self.rejected = None
+        self.enqueued_at = time.monotonic()
+        self._event = threading.Event()
+        self._waker = None
+
+    @property
+    def done(self):
+        return self.granted or self.rejected is not None
+
+    def _wake(self):
+        self._event.set()
+        waker = self._waker
+        if waker is not None:
+            waker()
+
+    def wait(self, timeout):
+        """Blocks until the ticket is granted or rejected, or the timeout passes."""
+        self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        """Awaits the ticket on the running loop without holding a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        self._waker = lambda: loop.call_soon_threadsafe(resolve)
+        if self.done:
+            return
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waker = None
+
+
+class _ModelQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        # One queue per class: user -> deque of tickets, users served round-robin
+        self.classes = (OrderedDict(), OrderedDict())
+
+
+class AdmissionController:
+    """
+    Per-model concurrency limit in front of Ollama.
+
+    At most `max_concurrent` requests per model and Ollama host run at once. The others wait
+    in a bounded queue where authenticated users are served before guests
+    and, within each class, users take turns so one user's burst cannot
+    starve everybody else. When the queue is full, a guest's place is given
+    to an authenticated user, and otherwise the request is rejected at once
+    instead of waiting for an upstream timeout. A model's queue only
+    exists while it has requests running or waiting, since model names
+    come from the requests.
+    """
+
+    def __init__(self):
+        self.max_concurrent = Config.ADMISSION_MAX_CONCURRENT
+        self.model_limits = self._parse_limits(Config.ADMISSION_MODEL_LIMITS)
+        self.queue_size = Config.ADMISSION_QUEUE_SIZE
+        self.max_queued_per_user = Config.ADMISSION_MAX_QUEUED_PER_USER
+        self.queue_timeout = Config.ADMISSION_QUEUE_TIMEOUT
+        self._models = {}
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_user": 0,
+                      "rejected_timeout": 0, "displaced": 0}
+
+    def init_app(self, app):
+        self.max_concurrent = app.config.get("ADMISSION_MAX_CONCURRENT", self.max_concurrent)
+        self.model_limits = self._parse_limits(app.config.get("ADMISSION_MODEL_LIMITS", ""))
+        self.queue_size = app.config.get("ADMISSION_QUEUE_SIZE", self.queue_size)
+        self.max_queued_per_user = app.config.get("ADMISSION_MAX_QUEUED_PER_USER", self.max_queued_per_user)
+        self.queue_timeout = app.config.get("ADMISSION_QUEUE_TIMEOUT", self.queue_timeout)
+        self._models = {}
+
+    @staticmethod
+    def _parse_limits(spec):
+        # "llama3:8b=2,phi3=6" -> {"llama3:8b": 2, "phi3": 6}
+        limits = {}
+        for item in (spec or "").split(","):
+            name, _, limit = item.strip().rpartition("=")
+            if name and limit.isdigit():
+                limits[name] = int(limit)
+        return limits
+
+    def _queue(self, model):
+        queue = self._models.get(model)
+        if queue is None:
+            limit = self.model_limits.get(model, self.max_concurrent) * ollama_pool.size
+            queue = self._models[model] = _ModelQueue(limit)
+        return queue
+
+    def _drop_if_idle(self, model, queue):
+        # Called with the lock held; forgets a queue nobody is using
+        if not queue.active and not queue.queued and self._models.get(model) is queue:
+            del self._models[model]
+
+    def would_reject(self, model, authenticated):
+        """
+        Tells whether a new request would be turned away right now, so
+        callers can answer 429 before starting any work.
+        """
+        if not self.max_concurrent:
+            return False
+        with self._lock:
+            queue = self._models.get(model)
+            if queue is None or queue.active < queue.limit or queue.queued < self.queue_size:
+                return False
+            return not (authenticated and queue.classes[GUEST])
+
+    def enqueue(self, model, user, authenticated):
+        """
+        Admits a request or puts it in the model's queue.
+
+        Args:
+        model (str): Local model name.
+        user (str): User id, or a guest key such as the client address.
+        authenticated (bool): Whether the user is logged in.
+
+        Returns:
+        Ticket: Granted at once if a slot is free, otherwise queued.
+
+        Raises:
+        AdmissionRejected: If the queue (or the user's share of it) is full.
+        """
+        ticket = Ticket(model, user, authenticated)
+        if not self.max_concurrent:
+            ticket.granted = True
+            return ticket
+        displaced = None
+        with self._lock:
+            queue = self._queue(model)
+            if queue.active < queue.limit and not queue.queued:
+                queue.active += 1
+                ticket.granted = True
+                self.stats["admitted"] += 1
+                return ticket
+            waiting = queue.classes[ticket.priority]
+            if len(waiting.get(user, ())) >= self.max_queued_per_user:
+                self.stats["rejected_user"] += 1
+                self._drop_if_idle(model, queue)
+                raise AdmissionRejected("user_queue_full")
+            if queue.queued >= self.queue_size:
+                if ticket.priority == GUEST or not queue.classes[GUEST]:
+                    self.stats["rejected_full"] += 1
+                    self._drop_if_idle(model, queue)
+                    raise AdmissionRejected("queue_full")
+                # Give the most recently queued guest's place to this user
+                displaced = self._pop_last(queue, GUEST)
+                displaced.rejected = "displaced"
+                self.stats["displaced"] += 1
+            waiting.setdefault(user, deque()).append(ticket)
+            queue.queued += 1
+            self.stats["queued"] += 1
+        if displaced is not None:
+            displaced._wake()
+        return ticket
+
+    def _pop_last(self, queue, priority):
+        waiting = queue.classes[priority]
+        user = next(reversed(waiting))
+        tickets = waiting[user]
+        ticket = tickets.pop()
+        if not tickets:
+            del waiting[user]
+        queue.queued -= 1
+        return ticket
+
+    def _grant_next(self, queue):
+        # Called with the lock held; returns the tickets to wake
+        woken = []
+        while queue.active < queue.limit and queue.queued:
+            waiting = next(w for w in queue.classes if w)
+            user, tickets = next(iter(waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                waiting.move_to_end(user)
+            else:
+                del waiting[user]
+            queue.queued -= 1
+            queue.active += 1
+            ticket.granted = True
+            self.stats["admitted"] += 1
+            woken.append(ticket)
+        return woken
+
+    def _remove(self, queue, ticket):
+        tickets = queue.classes[ticket.priority].get(ticket.user)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue.classes[ticket.priority][ticket.user]
+            queue.queued -= 1
+
+    def release(self, ticket):
+        """
+        Frees a ticket's slot (or its place in the queue) and admits the next request.
+        """
+        if not self.max_concurrent or ticket is None:
+            return
+        with self._lock:
+            queue = self._models.get(ticket.model)
+            if queue is None:
+                # Displaced or expired, and the queue has been dropped since
+                return
+            if ticket.granted:
+                ticket.granted = False
+                queue.active -= 1
+            elif ticket.rejected is None:
+                self._remove(queue, ticket)
+                ticket.rejected = "cancelled"
+            woken = self._grant_next(queue)
+            self._drop_if_idle(ticket.model, queue)
+        for waiter in woken:
+            waiter._wake()
+
+    def expire(self, ticket):
+        """
+        Takes a ticket that waited longer than the queue timeout out of the queue.
+
+        Raises:
+        AdmissionRejected: Unless the ticket got its slot in the meantime.
+        """
+        with self._lock:
+            if ticket.granted:
+                return
+            queue = self._models.get(ticket.model)
+            if queue is not None:
+                self._remove(queue, ticket)
+                self._drop_if_idle(ticket.model, queue)
+            ticket.rejected = "timeout"
+            self.stats["rejected_timeout"] += 1
+        raise AdmissionRejected("timeout")
+
+    def position(self, ticket):
+        """
+        Returns the 1-based position of a queued ticket, 0 once it is admitted.
+        """
+        if ticket.granted:
+            return 0
+        with self._lock:
+            queue = self._models.get(ticket.model)
+            if queue is None:
+                return 0
+            position = 0
+            for priority, waiting in enumerate(queue.classes):
+                if priority < ticket.priority:
+                    position += sum(len(tickets) for tickets in waiting.values())
+                    continue
+                # Replay the round-robin order of this class
+                lanes = [list(tickets) for tickets in waiting.values()]
+                turn = 0
+                while any(lanes):
+                    for lane in lanes:
+                        if turn < len(lane):
+                            position += 1
+                            if lane[turn] is ticket:
+                                return position
+                    turn += 1
+                break
+            return position
+
+    def remaining(self, ticket):
+        return self.queue_timeout - (time.monotonic() - ticket.enqueued_at)
+
+    @contextmanager
+    def slot(self, model, user, authenticated):
+        """
+        Holds a slot of a model for the duration of a blocking request.
+
+        Raises:
+        AdmissionRejected: If the request is shed or waits too long.
+        """
+        ticket = self.enqueue(model, user, authenticated)
+        try:
+            while not ticket.done:
+                if self.remaining(ticket) <= 0:
+                    self.expire(ticket)
+                ticket.wait(max(self.remaining(ticket), 0.01))
+            if ticket.rejected is not None:
+                raise AdmissionRejected(ticket.rejected)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def snapshot(self):
+        with self._lock:
+            models = {
+                name: {
+                    "limit": queue.limit,
+                    "active": queue.active,
+                    "queued": queue.queued,
+                    "queued_authenticated": sum(len(t) for t in queue.classes[AUTHENTICATED].values()),
+                    "queued_guests": sum(len(t) for t in queue.classes[GUEST].values()),
+                }
+                for name, queue in self._models.items()
+            }
+            return {"enabled": bool(self.max_concurrent), "queue_size": self.queue_size,
+                    "models": models, "stats": dict(self.stats)}
+
+
+admission = AdmissionController()
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import deque
+from api.config import Config
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class BackendUnavailable(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome and latency of recent calls to one backend.
+
+    Once at least `min_calls` of the last `window` calls are known and the
+    share of failures (errors, and calls slower than `slow_call_seconds`)
+    reaches `error_rate`, the circuit opens and callers go straight to their
+    fallback. After `open_seconds` a limited number of probe calls are let
+    through (half-open): a successful probe closes the circuit, a failed one
+    opens it again.
+    """
+
+    def __init__(self, name, window, min_calls, error_rate, slow_call_seconds, open_seconds, probes):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes_running = 0
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "last_error": None}
+
+    def available(self):
+        """
+        Tells whether a call could go ahead now (not open, or due for a probe).
+        """
+        return not (self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds)
+
+    def rejects(self):
+        """
+        Tells, without taking a permit, whether a call would be rejected now
+        (open and not yet due for a probe). Rejections are counted.
+        """
+        with self._lock:
+            if not self.available():
+                self.stats["rejected"] += 1
+                return True
+            return False
+
+    def allow(self):
+        """
+        Asks for permission to call the backend.
+
+        Returns:
+        str: "normal" or "probe" when the call may go ahead, None when the
+             circuit is open. Pass it to record() or cancel() afterwards.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return "normal"
+            if self.state == HALF_OPEN and self._probes_running < self.probes:
+                self._probes_running += 1
+                return "probe"
+            self.stats["rejected"] += 1
+            return None
+
+    def record(self, permit, ok, latency=None, error=None):
+        """
+        Reports the outcome of a permitted call.
+
+        Args:
+        permit (str): What allow() returned.
+        ok (bool): Whether the call succeeded.
+        latency (float): Seconds until the first token, if known.
+        error (str): Failure description, shown in the status.
+        """
+        slow = latency is not None and self.slow_call_seconds and latency > self.slow_call_seconds
+        failed = not ok or slow
+        with self._lock:
+            self.stats["calls"] += 1
+            if latency is not None:
+                self._latencies.append(latency)
+            if failed:
+                self.stats["failures"] += 1
+                self.stats["last_error"] = error or f"slow call ({latency:.1f}s)"
+            if permit == "probe":
+                self._probes_running -= 1
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            if self.state != CLOSED:
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.error_rate:
+                self._open()
+
+    def cancel(self, permit):
+        """
+        Gives a permit back without a verdict (e.g. the client went away).
+        """
+        if permit == "probe":
+            with self._lock:
+                self._probes_running -= 1
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.stats["opened"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            outcomes = list(self._outcomes)
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)) if self.state == OPEN else 0.0
+            return {
+                "state": self.state,
+                "error_rate": round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0,
+                "recent_calls": len(outcomes),
+                "ttft_p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "ttft_p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+                "retry_in": round(retry_in, 1),
+                **self.stats,
+            }
+
+
+class BreakerRegistry:
+    """
+    One circuit breaker per local backend (Ollama host URL), created on first use.
+    """
+
+    def __init__(self):
+        self.window = Config.BREAKER_WINDOW
+        self.min_calls = Config.BREAKER_MIN_CALLS
+        self.error_rate = Config.BREAKER_ERROR_RATE
+        self.slow_call_seconds = Config.BREAKER_SLOW_CALL_SECONDS
+        self.open_seconds = Config.BREAKER_OPEN_SECONDS
+        self.probes = Config.BREAKER_HALF_OPEN_PROBES
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.window = app.config.get("BREAKER_WINDOW", self.window)
+        self.min_calls = app.config.get("BREAKER_MIN_CALLS", self.min_calls)
+        self.error_rate = app.config.get("BREAKER_ERROR_RATE", self.error_rate)
+        self.slow_call_seconds = app.config.get("BREAKER_SLOW_CALL_SECONDS", self.slow_call_seconds)
+        self.open_seconds = app.config.get("BREAKER_OPEN_SECONDS", self.open_seconds)
+        self.probes = app.config.get("BREAKER_HALF_OPEN_PROBES", self.probes)
+        self._breakers = {}
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(
+                    name, self.window, self.min_calls, self.error_rate,
+                    self.slow_call_seconds, self.open_seconds, self.probes
+                )
+            return breaker
+
+    def snapshot(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+breakers = BreakerRegistry()
@@ -0,0 +1,789 @@
+import hashlib
+import json
+from array import array
+from datetime import datetime
+import click
+from bson import Binary, ObjectId
+from flask.cli import with_appcontext
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from api import mongo
+from api.services.summary_services import summarizer
+
+_indexes_ready = False
+
+# Length of the last-message preview kept on each session for the sidebar
+PREVIEW_CHARS = 120
+# Ids of the latest queued writes applied to a session, so a retried bulk write is not applied twice
+APPLIED_WRITES_KEPT = 32
+SUMMARY_PROJECTION = {"session_name": 1, "created_at": 1, "message_count": 1, "last_message": 1, "failed_writes": 1}
+
+
+def ensure_indexes():
+    """
+    Creates the indexes used by the chat store (idempotent).
+    """
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    mongo.db.messages.create_index([("session_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+    mongo.db.sessions.create_index([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    mongo.db.model_contexts.create_index([("session_id", ASCENDING), ("model", ASCENDING)], unique=True)
+    mongo.db.failed_writes.create_index([("session_id", ASCENDING), ("failed_at", ASCENDING)])
+    _indexes_ready = True
+
+
+LIMIT_REACHED_ERROR = "Session limit reached. Please start a new chat."
+SESSION_NOT_FOUND_ERROR = "Session not found"
+
+
+class MessageLimitReached(Exception):
+    """Raised when a session has no user messages left under its limit."""
+
+
+class SessionNotFound(Exception):
+    """Raised when messages are saved to a session that does not exist."""
+
+
+def _preview(message):
+    return {
+        "role": message.get("role"),
+        "content": (message.get("content") or "")[:PREVIEW_CHARS],
+        "timestamp": message.get("timestamp"),
+    }
+
+
+def save_messages(session_id, session_name, user_id, messages, rename=False, max_user_messages=None,
+                  documents=None):
+    """
+    Appends messages to a chat session, creating the session if needed.
+
+    Messages live in their own collection; the session document only keeps
+    its metadata and a message counter.
+
+    Args:
+    session_id (str): Session ObjectId, or "1" to start a new session.
+    session_name (str): Name to give a new (or renamed) session.
+    user_id (str): Owner of the session, None for guests.
+    messages (list): Message documents to append.
+    rename (bool): Also overwrite the name of an existing session.
+    max_user_messages (int): Reject the write if the session already holds
+                             this many user messages.
+    documents (list): Uploaded document links to attach to the session.
+
+    Returns:
+    str: The session id the messages were saved to.
+
+    Raises:
+    MessageLimitReached: If the session is at its user message limit.
+    SessionNotFound: If there is no session with that id.
+    """
+    ensure_indexes()
+    now = datetime.now()
+    user_messages = sum(1 for m in messages if m.get("role") == "user")
+
+    if session_id != "1":
+        if not ObjectId.is_valid(session_id):
+            raise SessionNotFound(session_id)
+        session_oid = ObjectId(session_id)
+        update = {
+            "$inc": {"message_count": len(messages), "user_message_count": user_messages},
+            "$set": {"updated_at": now, "last_message": _preview(messages[-1])},
+        }
+        if rename:
+            update["$set"]["session_name"] = session_name or "How can I help you?"
+        if documents:
+            update["$addToSet"] = {"documents": {"$each": documents}}
+        # Check the limit and bump the counters in one atomic update
+        query = {"_id": session_oid}
+        if max_user_messages is not None and user_messages:
+            query["$or"] = [
+                {"user_message_count": {"$lt": max_user_messages}},
+                {"user_message_count": {"$exists": False}},
+            ]
+        result = mongo.db.sessions.update_one(query, update)
+        if result.matched_count == 0:
+            if "$or" in query and mongo.db.sessions.find_one({"_id": session_oid}, {"_id": 1}):
+                raise MessageLimitReached(session_id)
+            raise SessionNotFound(session_id)
+    else:
+        session_doc = {
+            "session_name": session_name or "How can I help you?",
+            "created_at": now,
+            "updated_at": now,
+            "user_id": user_id,
+            "message_count": len(messages),
+            "user_message_count": user_messages,
+            "last_message": _preview(messages[-1]),
+        }
+        if documents:
+            session_doc["documents"] = documents
+        session_oid = mongo.db.sessions.insert_one(session_doc).inserted_id
+        session_id = str(session_oid)
+
+        # Add to user's chat list if logged in
+        if user_id:
+            mongo.db.users.update_one(
+                {"_id": ObjectId(user_id)},
+                {"$push": {"chat_sessions": session_id}}
+            )
+
+    mongo.db.messages.insert_many([{**m, "session_id": session_oid} for m in messages])
+
+    try:
+        summarizer.maybe_schedule(session_oid)
+    except Exception as e:
+        print(f"Could not schedule summary refresh for {session_id}: {e}")
+    return session_id
+
+
+def save_exchanges(exchanges, user_id):
+    """
+    Saves independent exchanges as new sessions, with one bulk write per
+    collection instead of one write per message.
+
+    Args:
+    exchanges (list): (session_name, messages) pairs, one per new session.
+    user_id (str): Owner of the sessions, None for guests.
+
+    Returns:
+    list: The new session ids, in the order of `exchanges`.
+    """
+    if not exchanges:
+        return []
+    ensure_indexes()
+    now = datetime.now()
+    session_docs = [
+        {
+            "session_name": session_name or "How can I help you?",
+            "created_at": now,
+            "updated_at": now,
+            "user_id": user_id,
+            "message_count": len(messages),
+            "user_message_count": sum(1 for m in messages if m.get("role") == "user"),
+            "last_message": _preview(messages[-1]),
+        }
+        for session_name, messages in exchanges
+    ]
+    session_oids = mongo.db.sessions.insert_many(session_docs).inserted_ids
+    mongo.db.messages.insert_many([
+        {**m, "session_id": session_oid}
+        for session_oid, (_, messages) in zip(session_oids, exchanges)
+        for m in messages
+    ])
+    session_ids = [str(session_oid) for session_oid in session_oids]
+    if user_id:
+        mongo.db.users.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$push": {"chat_sessions": {"$each": session_ids}}}
+        )
+    return session_ids
+
+
+def prepare_exchange(session_id, session_name, user_id, messages, max_user_messages=None, documents=None,
+                     model_context=None, reserved=False):
+    """
+    Builds the write of one exchange for apply_exchanges(), with the ids of
+    the session (if new) and of the messages assigned up front.
+
+    Args:
+    session_id (str): Session ObjectId, or "1" to start a new session.
+    session_name (str): Name to give a new session.
+    user_id (str): Owner of the session, None for guests.
+    messages (list): Message documents to append.
+    max_user_messages (int): Reject the write if the session already holds
+                             this many user messages.
+    documents (list): Uploaded document links to attach to the session.
+    model_context (tuple): (payload, context) to store for the next turn,
+                           as save_model_context() does.
+    reserved (bool): The user message was already counted by
+                     reserve_user_message(), so the write skips the limit.
+
+    Returns:
+    dict: The write; its "session_id" is the session the messages go to.
+    """
+    new = session_id == "1"
+    session_oid = ObjectId() if new else ObjectId(session_id)
+    return {
+        "write_id": ObjectId(),
+        "session_oid": session_oid,
+        "session_id": str(session_oid),
+        "new": new,
+        "session_name": session_name,
+        "user_id": user_id,
+        "messages": [{"_id": ObjectId(), **m, "session_id": session_oid} for m in messages],
+        "max_user_messages": max_user_messages,
+        "documents": documents,
+        "model_context": model_context,
+        "reserved": reserved and not new,
+    }
+
+
+def _insert_missing(collection, docs):
+    # The documents carry their ids, so a retried insert only adds the ones still missing
+    try:
+        collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(error.get("code") != 11000 for error in errors):
+            raise
+
+
+def apply_exchanges(writes):
+    """
+    Applies the exchange writes of many requests with one bulk write per
+    collection. Every step is idempotent, so a failed call can be retried.
+
+    Args:
+    writes (list): Writes from prepare_exchange(), in order.
+
+    Returns:
+    list: The writes that were not applied, each with "rejected" set to
+          "limit_reached" (its session was at its user message limit) or
+          "session_not_found".
+    """
+    ensure_indexes()
+    now = datetime.now()
+    new_writes = [w for w in writes if w["new"]]
+    updates = [w for w in writes if not w["new"]]
+
+    if new_writes:
+        session_docs = []
+        for w in new_writes:
+            doc = {
+                "_id": w["session_oid"],
+                "session_name": w["session_name"] or "How can I help you?",
+                "created_at": now,
+                "updated_at": now,
+                "user_id": w["user_id"],
+                "message_count": len(w["messages"]),
+                "user_message_count": sum(1 for m in w["messages"] if m.get("role") == "user"),
+                "last_message": _preview(w["messages"][-1]),
+                "applied_writes": [w["write_id"]],
+            }
+            if w["documents"]:
+                doc["documents"] = w["documents"]
+            session_docs.append(doc)
+        _insert_missing(mongo.db.sessions, session_docs)
+
+        # Add to the users' chat lists
+        user_sessions = {}
+        for w in new_writes:
+            if w["user_id"]:
+                user_sessions.setdefault(w["user_id"], []).append(w["session_id"])
+        if user_sessions:
+            mongo.db.users.bulk_write([
+                UpdateOne({"_id": ObjectId(user_id)}, {"$addToSet": {"chat_sessions": {"$each": session_ids}}})
+                for user_id, session_ids in user_sessions.items()
+            ])
+
+    rejected = []
+    if updates:
+        ops = []
+        for w in updates:
+            user_messages = sum(1 for m in w["messages"] if m.get("role") == "user")
+            if w.get("reserved") and user_messages:
+                # The limit was checked, and one user message counted, before the reply was generated
+                user_messages -= 1
+            # Check the limit and bump the counters in one atomic update, once per write
+            query = {"_id": w["session_oid"], "applied_writes": {"$ne": w["write_id"]}}
+            if w["max_user_messages"] is not None and user_messages and not w.get("reserved"):
+                query["$or"] = [
+                    {"user_message_count": {"$lt": w["max_user_messages"]}},
+                    {"user_message_count": {"$exists": False}},
+                ]
+            update = {
+                "$inc": {"message_count": len(w["messages"]), "user_message_count": user_messages},
+                "$set": {"updated_at": now, "last_message": _preview(w["messages"][-1])},
+                "$push": {"applied_writes": {"$each": [w["write_id"]], "$slice": -APPLIED_WRITES_KEPT}},
+            }
+            if w["documents"]:
+                update["$addToSet"] = {"documents": {"$each": w["documents"]}}
+            ops.append(UpdateOne(query, update))
+        result = mongo.db.sessions.bulk_write(ops, ordered=True)
+        if result.matched_count < len(ops):
+            # Unmatched updates were either applied by an earlier attempt or are over the limit
+            applied = {
+                session["_id"]: set(session.get("applied_writes", []))
+                for session in mongo.db.sessions.find(
+                    {"_id": {"$in": [w["session_oid"] for w in updates]}}, {"applied_writes": 1}
+                )
+            }
+            rejected = [w for w in updates if w["write_id"] not in applied.get(w["session_oid"], ())]
+            for w in rejected:
+                w["rejected"] = "limit_reached" if w["session_oid"] in applied else "session_not_found"
+
+    rejected_ids = {w["write_id"] for w in rejected}
+    applied_writes = [w for w in writes if w["write_id"] not in rejected_ids]
+    messages = [m for w in applied_writes for m in w["messages"]]
+    if messages:
+        _insert_missing(mongo.db.messages, messages)
+    contexts = [
+        UpdateOne(*_model_context_update(w["session_oid"], *w["model_context"]), upsert=True)
+        for w in applied_writes if w["model_context"]
+    ]
+    if contexts:
+        mongo.db.model_contexts.bulk_write(contexts, ordered=False)
+
+    for w in applied_writes:
+        try:
+            summarizer.maybe_schedule(w["session_oid"])
+        except Exception as e:
+            print(f"Could not schedule summary refresh for {w['session_id']}: {e}")
+    return rejected
+
+
+
+def record_failed_exchanges(failures):
+    """
+    Keeps the exchanges the write-behind queue could not save, so the loss
+    is visible to the client rather than only in the logs.
+
+    Each exchange goes to the `failed_writes` collection with its messages
+    and the error, the user message slot it reserved is given back, and its
+    session's "failed_writes" counter is bumped (a new session is created
+    empty so its id stays valid). Safe to call again for the same writes.
+
+    Args:
+    failures (list): (write, error) pairs, writes from prepare_exchange().
+    """
+    if not failures:
+        return
+    ensure_indexes()
+    now = datetime.now()
+    _insert_missing(mongo.db.failed_writes, [
+        {
+            "_id": w["write_id"],
+            "session_id": w["session_oid"],
+            "user_id": w["user_id"],
+            "messages": [{k: v for k, v in m.items() if k != "session_id"} for m in w["messages"]],
+            "documents": w["documents"],
+            "error": str(error),
+            "failed_at": now,
+        }
+        for w, error in failures
+    ])
+
+    ops = []
+    for w, _ in failures:
+        user_messages = sum(1 for m in w["messages"] if m.get("role") == "user")
+        if w.get("reserved") and user_messages:
+            ops.append(UpdateOne(
+                {"_id": w["session_oid"], "applied_writes": {"$ne": w["write_id"]},
+                 "failed_write_ids": {"$ne": w["write_id"]}, "user_message_count": {"$gt": 0}},
+                {"$inc": {"user_message_count": -1}}
+            ))
+        update = {
+            "$inc": {"failed_writes": 1},
+            "$set": {"updated_at": now},
+            "$push": {"failed_write_ids": {"$each": [w["write_id"]], "$slice": -APPLIED_WRITES_KEPT}},
+        }
+        if w["new"]:
+            update["$setOnInsert"] = {
+                "session_name": w["session_name"] or "How can I help you?",
+                "created_at": now,
+                "user_id": w["user_id"],
+                "message_count": 0,
+                "user_message_count": 0,
+            }
+        ops.append(UpdateOne({"_id": w["session_oid"], "failed_write_ids": {"$ne": w["write_id"]}}, update,
+                             upsert=w["new"]))
+    try:
+        mongo.db.sessions.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # A retried upsert of a session already marked collides on _id; it needs nothing more
+        if e.details.get("writeConcernErrors") or any(
+                error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+    user_sessions = {}
+    for w, _ in failures:
+        if w["new"] and w["user_id"]:
+            user_sessions.setdefault(w["user_id"], []).append(w["session_id"])
+    if user_sessions:
+        mongo.db.users.bulk_write([
+            UpdateOne({"_id": ObjectId(user_id)}, {"$addToSet": {"chat_sessions": {"$each": session_ids}}})
+            for user_id, session_ids in user_sessions.items()
+        ])
+
+
+def get_failed_writes(session_id):
+    """
+    Lists the exchanges of a session that could not be saved, oldest first.
+
+    Args:
+    session_id (str): Session ObjectId.
+
+    Returns:
+    list: Dicts with the write id, error, failure time and messages.
+    """
+    failed = mongo.db.failed_writes.find({"session_id": ObjectId(session_id)}).sort("failed_at", ASCENDING)
+    return [
+        {
+            "id": str(record["_id"]),
+            "error": record["error"],
+            "failed_at": record["failed_at"].isoformat(),
+            "messages": [serialize_message(m) for m in record["messages"]],
+        }
+        for record in failed
+    ]
+
+def reserve_user_message(session_id, max_user_messages):
+    """
+    Counts a user message against the session limit before its reply is
+    generated, so a reply is never sent that could not be saved.
+
+    Args:
+    session_id (str): Session ObjectId.
+    max_user_messages (int): Allowed number of user messages.
+
+    Returns:
+    bool: False if the session has no user messages left.
+
+    Raises:
+    SessionNotFound: If there is no session with that id.
+    """
+    if not ObjectId.is_valid(session_id):
+        raise SessionNotFound(session_id)
+    result = mongo.db.sessions.update_one(
+        {"_id": ObjectId(session_id), "$or": [
+            {"user_message_count": {"$lt": max_user_messages}},
+            {"user_message_count": {"$exists": False}},
+        ]},
+        {"$inc": {"user_message_count": 1}}
+    )
+    if result.matched_count == 0 and not mongo.db.sessions.find_one({"_id": ObjectId(session_id)}, {"_id": 1}):
+        raise SessionNotFound(session_id)
+    return result.matched_count == 1
+
+
+def release_user_message(session_id):
+    """
+    Gives back a slot taken by reserve_user_message() when nothing was saved.
+
+    Args:
+    session_id (str): Session ObjectId.
+    """
+    mongo.db.sessions.update_one(
+        {"_id": ObjectId(session_id), "user_message_count": {"$gt": 0}},
+        {"$inc": {"user_message_count": -1}}
+    )
+
+
+def has_reached_limit(session_id, max_user_messages):
+    """
+    Checks the maintained user message counter of a session.
+
+    Args:
+    session_id (str): Session ObjectId.
+    max_user_messages (int): Allowed number of user messages.
+
+    Returns:
+    bool: True if the session has no user messages left.
+    """
+    session = mongo.db.sessions.find_one(
+        {"_id": ObjectId(session_id), "user_message_count": {"$gte": max_user_messages}},
+        {"_id": 1}
+    )
+    return session is not None
+
+
+def _cursor_filter(op, cursor):
+    # Cursors are message ids; ties on timestamp are broken by _id
+    anchor = mongo.db.messages.find_one({"_id": ObjectId(cursor)}, {"timestamp": 1})
+    if not anchor:
+        raise ValueError(f"Unknown message cursor: {cursor}")
+    return {"$or": [
+        {"timestamp": {op: anchor["timestamp"]}},
+        {"timestamp": anchor["timestamp"], "_id": {op: anchor["_id"]}},
+    ]}
+
+
+def get_messages(session_id, before=None, after=None, limit=None):
+    """
+    Fetches messages of a session in chronological order.
+
+    Args:
+    session_id (str): Session ObjectId.
+    before (str): Only return messages older than this message id.
+    after (str): Only return messages newer than this message id.
+    limit (int): Maximum number of messages. With `after` the oldest ones
+                 are returned, otherwise the newest ones.
+
+    Returns:
+    tuple: (messages, has_more) where messages is a list of dicts.
+    """
+    query = {"session_id": ObjectId(session_id)}
+    clauses = []
+    if before:
+        clauses.append(_cursor_filter("$lt", before))
+    if after:
+        clauses.append(_cursor_filter("$gt", after))
+    if clauses:
+        query["$and"] = clauses
+
+    # Page from the end that the client is missing
+    direction = ASCENDING if after else DESCENDING
+    cursor = mongo.db.messages.find(query, {"session_id": 0}).sort(
+        [("timestamp", direction), ("_id", direction)]
+    )
+    if limit:
+        cursor = cursor.limit(limit + 1)
+    messages = list(cursor)
+
+    has_more = bool(limit) and len(messages) > limit
+    if has_more:
+        messages = messages[:limit]
+    if direction == DESCENDING:
+        messages.reverse()
+    return messages, has_more
+
+
+def get_transcripts(session_ids):
+    """
+    Fetches the messages of several sessions in a single query.
+
+    Args:
+    session_ids (list): Session ObjectIds.
+
+    Returns:
+    dict: Session ObjectId -> chronological list of messages.
+    """
+    transcripts = {sid: [] for sid in session_ids}
+    cursor = mongo.db.messages.find({"session_id": {"$in": list(session_ids)}}).sort(
+        [("session_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+    )
+    for message in cursor:
+        transcripts[message.pop("session_id")].append(message)
+    return transcripts
+
+
+def clear_messages(session_id):
+    """
+    Deletes all messages of a session.
+
+    Returns:
+    bool: False if the session does not exist.
+    """
+    session_oid = ObjectId(session_id)
+    result = mongo.db.sessions.update_one(
+        {"_id": session_oid},
+        {
+            "$set": {"message_count": 0, "user_message_count": 0, "updated_at": datetime.now()},
+            "$unset": {
+                "messages": "", "last_message": "", "summary": "", "summary_message_count": "",
+                "summary_last_message_id": "", "summary_updated_at": "", "documents": "", "failed_writes": "",
+            },
+        }
+    )
+    if result.matched_count == 0:
+        return False
+    mongo.db.messages.delete_many({"session_id": session_oid})
+    mongo.db.model_contexts.delete_many({"session_id": session_oid})
+    mongo.db.failed_writes.delete_many({"session_id": session_oid})
+    return True
+
+
+def delete_session(session_id):
+    """
+    Deletes a session and its messages.
+
+    Returns:
+    bool: False if the session does not exist.
+    """
+    session_oid = ObjectId(session_id)
+    result = mongo.db.sessions.delete_one({"_id": session_oid})
+    if result.deleted_count == 0:
+        return False
+    mongo.db.messages.delete_many({"session_id": session_oid})
+    mongo.db.model_contexts.delete_many({"session_id": session_oid})
+    mongo.db.failed_writes.delete_many({"session_id": session_oid})
+    return True
+
+
+def model_context_fingerprint(payload):
+    """
+    Identifies what an Ollama context was computed with: the model, the
+    system prompt and the generation options.
+
+    Args:
+    payload (dict): Ollama /api/generate request body.
+
+    Returns:
+    str: Hex digest.
+    """
+    key = json.dumps(
+        {"model": payload.get("model"), "system": payload.get("system", ""), "options": payload.get("options", {})},
+        sort_keys=True
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def load_model_context(session_id, payload):
+    """
+    Fetches the Ollama context saved by the previous turn of a session.
+
+    Args:
+    session_id (str): Session ObjectId, "1" for a new session.
+    payload (dict): Ollama request body of the upcoming turn.
+
+    Returns:
+    list: The context token ids, or None if there is none or it was built
+          with another model, system prompt or options.
+    """
+    if not ObjectId.is_valid(session_id):
+        return None
+    doc = mongo.db.model_contexts.find_one(
+        {"session_id": ObjectId(session_id), "model": payload.get("model")},
+        {"fingerprint": 1, "context": 1}
+    )
+    if not doc or doc["fingerprint"] != model_context_fingerprint(payload):
+        return None
+    context = array("i")
+    context.frombytes(doc["context"])
+    return context.tolist()
+
+
+def save_model_context(session_id, payload, context):
+    """
+    Stores the context Ollama returned for a turn, replacing the previous one
+    of that (session, model).
+
+    Args:
+    session_id (str): Session ObjectId.
+    payload (dict): Ollama request body of the turn.
+    context (list): Token ids from the final response chunk.
+    """
+    ensure_indexes()
+    mongo.db.model_contexts.update_one(*_model_context_update(ObjectId(session_id), payload, context), upsert=True)
+
+
+def _model_context_update(session_oid, payload, context):
+    return (
+        {"session_id": session_oid, "model": payload.get("model")},
+        {"$set": {
+            "fingerprint": model_context_fingerprint(payload),
+            "context": Binary(array("i", context).tobytes()),
+            "updated_at": datetime.now(),
+        }},
+    )
+
+
+def list_session_summaries(query, limit=50, cursor=None):
+    """
+    Lists lightweight session summaries, newest first, one page at a time.
+
+    Only metadata is read (name, creation time, message count, last-message
+    preview), never the transcripts.
+
+    Args:
+    query (dict): Session filter, e.g. {"user_id": user_id}.
+    limit (int): Page size.
+    cursor (str): next_cursor of the previous page.
+
+    Returns:
+    tuple: (summaries, next_cursor) with next_cursor None on the last page.
+    """
+    ensure_indexes()
+    if cursor:
+        created_at, _, last_id = cursor.rpartition("|")
+        created_at = datetime.fromisoformat(created_at)
+        query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": ObjectId(last_id)}},
+        ]}]}
+
+    sessions = list(
+        mongo.db.sessions.find(query, SUMMARY_PROJECTION)
+        .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+        .limit(limit + 1)
+    )
+
+    next_cursor = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        last = sessions[-1]
+        next_cursor = f"{last['created_at'].isoformat()}|{last['_id']}"
+
+    summaries = []
+    for session in sessions:
+        last_message = session.get("last_message")
+        if last_message and hasattr(last_message.get("timestamp"), "isoformat"):
+            last_message = {**last_message, "timestamp": last_message["timestamp"].isoformat()}
+        summaries.append({
+            "_id": str(session["_id"]),
+            "session_name": session.get("session_name"),
+            "created_at": session["created_at"].isoformat() if session.get("created_at") else None,
+            "message_count": session.get("message_count", 0),
+            "last_message": last_message,
+            "failed_writes": session.get("failed_writes", 0),
+        })
+    return summaries, next_cursor
+
+
+def serialize_message(message):
+    """
+    Converts a stored message into a JSON-serializable dict.
+    """
+    message = dict(message)
+    message["id"] = str(message.pop("_id"))
+    message.pop("session_id", None)
+    message.pop("migrated", None)
+    if hasattr(message.get("timestamp"), "isoformat"):
+        message["timestamp"] = message["timestamp"].isoformat()
+    return message
+
+
+def migrate_embedded_messages():
+    """
+    Moves messages embedded in session documents into the messages collection
+    and backfills the message counters of sessions that lack them.
+
+    Safe to re-run: messages copied by an interrupted run are replaced.
+
+    Returns:
+    dict: Number of migrated sessions and messages, and backfilled counters.
+    """
+    ensure_indexes()
+    migrated = {"sessions": 0, "messages": 0, "counters": 0}
+    sessions = mongo.db.sessions.find({"messages": {"$exists": True}}, {"messages": 1})
+    for session in sessions:
+        messages = session.get("messages") or []
+        mongo.db.messages.delete_many({"session_id": session["_id"], "migrated": True})
+        if messages:
+            mongo.db.messages.insert_many(
+                [{**m, "session_id": session["_id"], "migrated": True} for m in messages]
+            )
+        update = {"$unset": {"messages": ""}, "$set": {
+            "message_count": len(messages),
+            "user_message_count": sum(1 for m in messages if m.get("role") == "user"),
+        }}
+        if messages:
+            update["$set"]["last_message"] = _preview(messages[-1])
+        mongo.db.sessions.update_one({"_id": session["_id"]}, update)
+        migrated["sessions"] += 1
+        migrated["messages"] += len(messages)
+
+    for session in mongo.db.sessions.find({"user_message_count": {"$exists": False}}, {"_id": 1}):
+        counts = {"message_count": 0, "user_message_count": 0}
+        for row in mongo.db.messages.aggregate([
+            {"$match": {"session_id": session["_id"]}},
+            {"$group": {"_id": "$role", "n": {"$sum": 1}}},
+        ]):
+            counts["message_count"] += row["n"]
+            if row["_id"] == "user":
+                counts["user_message_count"] += row["n"]
+        mongo.db.sessions.update_one({"_id": session["_id"]}, {"$set": counts})
+        migrated["counters"] += 1
+    return migrated
+
+
+@click.command("migrate-messages")
+@with_appcontext
+def migrate_messages_command():
+    """Move embedded session messages into the messages collection."""
+    migrated = migrate_embedded_messages()
+    click.echo(
+        f"Migrated {migrated['messages']} messages from {migrated['sessions']} sessions, "
+        f"backfilled counters of {migrated['counters']} sessions."
+    )
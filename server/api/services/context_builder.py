@@ -0,0 +1,156 @@
+from bson import ObjectId
+from pymongo import DESCENDING
+from api import mongo
+from api.config import Config
+from api.services.summary_services import summarizer
+
+
+def estimate_tokens(text):
+    """
+    Rough token estimate (~4 characters per token) used for prompt budgets.
+    """
+    return len(text) // 4 + 1
+
+
+def build_mention_context(session_ids, max_chars=None, max_tokens=None):
+    """
+    Builds the prompt context for @-mentioned sessions within a budget.
+
+    Sessions with a fresh rolling summary contribute that summary plus the
+    few messages written after it; the others contribute raw messages. All
+    messages are read with one projected $in query, newest first. The
+    budget is shared fairly: every session may use an equal share, and
+    what a short session leaves unused goes to the sessions that need
+    more. Reading stops as soon as more messages could not change that
+    split, so old history of long chats is never fetched.
+
+    Args:
+    session_ids (list): Mentioned session ids (strings), in mention order.
+    max_chars (int): Character budget, defaults to MENTION_CONTEXT_MAX_CHARS.
+    max_tokens (int): Optional token budget, defaults to MENTION_CONTEXT_MAX_TOKENS.
+
+    Returns:
+    tuple: (history_context, report) where report tells how much was
+           included and how much was left out by the budget.
+    """
+    max_chars = max_chars if max_chars is not None else Config.MENTION_CONTEXT_MAX_CHARS
+    max_tokens = max_tokens if max_tokens is not None else Config.MENTION_CONTEXT_MAX_TOKENS
+
+    mention_ids = list(dict.fromkeys(ObjectId(s_id) for s_id in session_ids if ObjectId.is_valid(s_id)))
+    report = {
+        "sessions": len(mention_ids),
+        "summaries_used": 0,
+        "messages_included": 0,
+        "messages_omitted": 0,
+        "chars_included": 0,
+        "tokens_included": 0,
+        "truncated": False,
+    }
+    if not mention_ids:
+        return "", report
+
+    sessions = {s["_id"]: s for s in mongo.db.sessions.find(
+        {"_id": {"$in": mention_ids}},
+        {"message_count": 1, "summary": 1, "summary_message_count": 1, "summary_last_message_id": 1}
+    )}
+    mention_ids = [m_id for m_id in mention_ids if m_id in sessions]
+    if not mention_ids:
+        return "", report
+
+    def weight(text):
+        # Share of the budget a text uses (of the tighter limit); 0 without limits
+        return max(len(text) / max_chars if max_chars else 0,
+                   estimate_tokens(text) / max_tokens if max_tokens else 0)
+
+    # Per session: candidate texts (header first, then lines newest first) and their total weight
+    items = {m_id: [] for m_id in mention_ids}
+    totals = {m_id: 0.0 for m_id in mention_ids}
+    expected = {m_id: sessions[m_id].get("message_count", 0) for m_id in mention_ids}
+    headers = {}
+    raw_ids, clauses = [], []
+    for m_id in mention_ids:
+        session = sessions[m_id]
+        if summarizer.is_fresh(session) and session.get("summary_last_message_id"):
+            summary = f"summary of earlier messages: {session['summary']}\n"
+            # A summary too long for an equal share gives way to raw messages
+            if weight(summary) <= 1 / len(mention_ids):
+                headers[m_id] = summary
+                items[m_id].append(summary)
+                totals[m_id] = weight(summary)
+                expected[m_id] -= session.get("summary_message_count", 0)
+                clauses.append({"session_id": m_id, "_id": {"$gt": session["summary_last_message_id"]}})
+                continue
+            report["truncated"] = True
+        raw_ids.append(m_id)
+    if raw_ids:
+        clauses.append({"session_id": {"$in": raw_ids}})
+
+    def fair_share():
+        # The most any session not yet fully read may use, given the others' needs so far
+        left = 1.0
+        needs = sorted(totals.values())
+        for position, need in enumerate(needs):
+            share = left / (len(needs) - position)
+            if need > share:
+                return share
+            left -= need
+        return None  # everything read so far fits
+
+    read = {m_id: 0 for m_id in mention_ids}
+    limited = bool(max_chars or max_tokens)
+    cursor = mongo.db.messages.find(
+        clauses[0] if len(clauses) == 1 else {"$or": clauses},
+        {"_id": 0, "session_id": 1, "role": 1, "content": 1}
+    ).sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    try:
+        for m in cursor:
+            m_id = m["session_id"]
+            read[m_id] += 1
+            if not limited or totals[m_id] <= 1:
+                line = f"{m['role']}: {m['content']}\n"
+                items[m_id].append(line)
+                totals[m_id] += weight(line)
+            if limited:
+                # More messages only lower the share, so stop once every session still
+                # being read already holds more than it may use
+                share = fair_share()
+                if share is not None and all(totals[s_id] > share for s_id in mention_ids
+                                             if read[s_id] < expected[s_id]):
+                    break
+    finally:
+        cursor.close()
+
+    # Smallest need first: each session may use an equal share of what is left
+    lines = {m_id: [] for m_id in mention_ids}
+    included_headers = {}
+    left = 1.0
+    by_need = sorted(mention_ids, key=lambda m_id: totals[m_id])
+    for position, m_id in enumerate(by_need):
+        share = left / (len(by_need) - position)
+        used = 0.0
+        for text in items[m_id]:
+            cost = weight(text)
+            if limited and used + cost > share:
+                report["truncated"] = True
+                break
+            used += cost
+            report["chars_included"] += len(text)
+            report["tokens_included"] += estimate_tokens(text)
+            if headers.get(m_id) is text:
+                included_headers[m_id] = text
+                report["summaries_used"] += 1
+            else:
+                lines[m_id].append(text)
+                report["messages_included"] += 1
+        left -= used
+
+    for m_id in mention_ids:
+        covered = sessions[m_id].get("summary_message_count", 0) if m_id in included_headers else 0
+        missing = sessions[m_id].get("message_count", 0) - covered - len(lines[m_id])
+        report["messages_omitted"] += max(missing, 0)
+
+    # Sessions in mention order, each one chronological
+    history_context = "".join(
+        included_headers.get(m_id, "") + "".join(reversed(lines[m_id])) for m_id in mention_ids
+    )
+    return history_context, report
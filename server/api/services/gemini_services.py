@@ -0,0 +1,69 @@
+import threading
+from collections import OrderedDict
+import google.generativeai as genai
+from api.config import Config
+
+
+class GeminiModelRegistry:
+    """
+    Bounded LRU cache of GenerativeModel handles.
+
+    Handles are keyed by (model id, system instruction), so requests that
+    reuse a system prompt share one handle instead of building a new
+    GenerativeModel for every call.
+    """
+
+    def __init__(self, model_id=None, max_size=None):
+        self.model_id = model_id or Config.GEMINI_MODEL
+        self.max_size = max_size or Config.GEMINI_MODEL_CACHE_SIZE
+        self.enabled = False
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def init_app(self, app):
+        """
+        Configures the Gemini SDK and the registry from the app config.
+
+        Args:
+        app (Flask): The application being created.
+        """
+        self.model_id = app.config.get("GEMINI_MODEL", self.model_id)
+        self.max_size = app.config.get("GEMINI_MODEL_CACHE_SIZE", self.max_size)
+        genai.configure(api_key=app.config.get("GEMINI_API_KEY"))
+        self.enabled = True
+        with self._lock:
+            self._models.clear()
+
+    def get(self, system_instruction=None, model_id=None):
+        """
+        Returns a model handle, creating and caching it on first use.
+
+        Args:
+        system_instruction (str): System prompt of the handle, if any.
+        model_id (str): Gemini model id, defaults to the configured one.
+
+        Returns:
+        genai.GenerativeModel: The cached model handle.
+        """
+        key = (model_id or self.model_id, system_instruction or None)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.stats["hits"] += 1
+                return model
+            self.stats["misses"] += 1
+
+        model = genai.GenerativeModel(key[0], system_instruction=key[1])
+        with self._lock:
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+                self.stats["evictions"] += 1
+        return model
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "size": len(self._models), "max_size": self.max_size}
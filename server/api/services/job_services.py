@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from api.config import Config
+from api.services.admission_services import AdmissionRejected
+from api.services.stream_engine import stream_engine, EventStream
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class ChatJobs:
+    """
+    Runs non-streaming /chat requests in the background.
+
+    A job is a prepared stream job (see chat_routes.prepare_stream_job)
+    generated on the stream engine loop, at most `workers` at a time, so a
+    long generation no longer holds a request thread. Its events are kept
+    for the clients that attach to it later, and its result (the JSON
+    /chat returns) for `ttl` seconds after it finishes, for at most
+    `max_finished` finished jobs (the oldest go first). Once a finished job
+    has no client attached, its chunk events are merged into one. The
+    exchange is saved like /chat/stream saves it.
+    """
+
+    def __init__(self):
+        self.workers = Config.CHAT_JOB_WORKERS
+        self.max_pending = Config.CHAT_JOB_MAX_PENDING
+        self.ttl = Config.CHAT_JOB_TTL
+        self.max_finished = Config.CHAT_JOB_MAX_FINISHED
+        self.max_wait = Config.CHAT_JOB_MAX_WAIT
+        self._jobs = {}
+        # Ids of finished jobs, oldest first
+        self._finished = deque()
+        self._cond = threading.Condition()
+        self._semaphore = None
+        self.stats = {"submitted": 0, "done": 0, "failed": 0, "rejected": 0, "expired": 0, "evicted": 0}
+
+    def init_app(self, app):
+        self.workers = app.config.get("CHAT_JOB_WORKERS", self.workers)
+        self.max_pending = app.config.get("CHAT_JOB_MAX_PENDING", self.max_pending)
+        self.ttl = app.config.get("CHAT_JOB_TTL", self.ttl)
+        self.max_finished = app.config.get("CHAT_JOB_MAX_FINISHED", self.max_finished)
+        self.max_wait = app.config.get("CHAT_JOB_MAX_WAIT", self.max_wait)
+
+    def _purge(self):
+        # Called with the lock held: drops finished jobs older than the TTL, then the oldest over max_finished
+        now = time.monotonic()
+        while self._finished:
+            if now - self._jobs[self._finished[0]]["finished"] > self.ttl:
+                self.stats["expired"] += 1
+            elif self.max_finished and len(self._finished) > self.max_finished:
+                self.stats["evicted"] += 1
+            else:
+                break
+            del self._jobs[self._finished.popleft()]
+
+    @staticmethod
+    def _collapse(record):
+        # Called with the lock held once a finished job has no client attached: one chunk holds the reply
+        events, merged = [], False
+        for event in record["events"]:
+            if event["type"] != "chunk":
+                events.append(event)
+            elif not merged:
+                events.append({"type": "chunk", "text": record["text"]})
+                merged = True
+        record["events"] = events
+
+    def submit(self, job):
+        """
+        Queues a chat job.
+
+        Args:
+        job (dict): Prepared chat request.
+
+        Returns:
+        str: The job id.
+
+        Raises:
+        AdmissionRejected: If `max_pending` jobs are already waiting or running.
+        """
+        with self._cond:
+            self._purge()
+            pending = sum(1 for record in self._jobs.values() if record["finished"] is None)
+            if self.max_pending and pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise AdmissionRejected("job_queue_full")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "owner": job["user_id"],
+                "status": QUEUED,
+                "created_at": datetime.now(),
+                "finished": None,
+                "events": [],
+                "text": "",
+                "result": None,
+                "error": None,
+                "changed": None,
+                "subscribers": 0,
+            }
+            self.stats["submitted"] += 1
+        asyncio.run_coroutine_threadsafe(self._run(self._jobs[job_id], job), stream_engine.loop)
+        return job_id
+
+    def _notify(self, record):
+        # Wakes the subscribers on the engine loop; the caller notifies the threads
+        changed = record["changed"]
+        record["changed"] = None
+        if changed is not None and not changed.done():
+            changed.set_result(None)
+
+    def _add_event(self, record, event):
+        with self._cond:
+            record["events"].append(event)
+            if event["type"] == "chunk":
+                record["text"] += event["text"]
+        self._notify(record)
+
+    async def _run(self, record, job):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        complete, error = None, None
+        try:
+            async with self._semaphore:
+                with self._cond:
+                    record["status"] = RUNNING
+                    self._cond.notify_all()
+                async for event in stream_engine.stream_events(job):
+                    if event["type"] == "complete":
+                        complete = event
+                    elif event["type"] == "error" and (event.get("queue_full") or event.get("limit_reached")):
+                        error = event
+                    self._add_event(record, event)
+        except Exception as e:
+            print(f"Chat job {record['id']} failed: {e}")
+            error = {"type": "error", "message": str(e) or type(e).__name__}
+            self._add_event(record, error)
+
+        with self._cond:
+            if complete is not None and error is None:
+                record["status"] = DONE
+                record["result"] = {
+                    "response": record["text"],
+                    "session_id": complete["session_id"],
+                    "timestamp": complete["timestamp"],
+                    "latency": complete["latency"],
+                    "fallback_used": complete["fallback_used"],
+                    "model_name": complete["model_name"],
+                    "model_type": "cloud" if complete["fallback_used"] else job["model_type"],
+                    "mention_context": job.get("mention_context"),
+                    "document_context": job.get("document_context"),
+                    "cached": complete.get("cached"),
+                }
+            else:
+                record["status"] = FAILED
+                error = error or {"message": "No reply."}
+                record["error"] = {key: value for key, value in error.items() if key != "type"}
+            record["finished"] = time.monotonic()
+            self._finished.append(record["id"])
+            if not record["subscribers"]:
+                self._collapse(record)
+            self._purge()
+            self.stats["done" if record["status"] == DONE else "failed"] += 1
+            self._cond.notify_all()
+        self._notify(record)
+
+    def _visible(self, job_id, user_id):
+        # Called with the lock held; jobs of logged-in users are only shown to them
+        self._purge()
+        record = self._jobs.get(job_id)
+        if record is None or (record["owner"] and record["owner"] != user_id):
+            return None
+        return record
+
+    @staticmethod
+    def _describe(record):
+        status = {
+            "job_id": record["id"],
+            "status": record["status"],
+            "created_at": record["created_at"].isoformat(),
+        }
+        if record["status"] == DONE:
+            status["result"] = record["result"]
+        elif record["status"] == FAILED:
+            status.update(record["error"])
+        else:
+            status["partial"] = record["text"]
+        return status
+
+    def get(self, job_id, user_id=None, wait=0):
+        """
+        Returns the state of a job, optionally waiting for it to finish.
+
+        Args:
+        job_id (str): The job id.
+        user_id (str): The requesting user, None for guests.
+        wait (float): Seconds to wait for the job to finish (capped at `max_wait`).
+
+        Returns:
+        dict: job_id, status and created_at, with the /chat result once done,
+              the error once failed, or the text generated so far. None if
+              there is no such job (or it expired).
+        """
+        deadline = time.monotonic() + min(max(wait, 0), self.max_wait)
+        with self._cond:
+            record = self._visible(job_id, user_id)
+            if record is None:
+                return None
+            while record["finished"] is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._describe(record)
+
+    def open_events(self, job_id, user_id=None):
+        """
+        Attaches to a job's events: the ones so far, then live ones until it finishes.
+
+        Detaching does not stop the job.
+
+        Returns:
+        EventStream: The job's events (session_info, queued, chunk, error,
+                     complete), or None if there is no such job.
+        """
+        with self._cond:
+            record = self._visible(job_id, user_id)
+        if record is None:
+            return None
+        events = self._events(record)
+        if stream_engine.coalesce_ms > 0:
+            events = stream_engine.coalesce(events)
+        return EventStream(stream_engine.loop, events)
+
+    async def _events(self, record):
+        # Runs on the engine loop, like _run, which is what hands it new events
+        sent = 0
+        with self._cond:
+            record["subscribers"] += 1
+        try:
+            while True:
+                with self._cond:
+                    events = record["events"][sent:]
+                    finished = record["finished"] is not None
+                for event in events:
+                    yield event
+                sent += len(events)
+                if finished and not events:
+                    return
+                if not events:
+                    if record["changed"] is None:
+                        record["changed"] = asyncio.get_running_loop().create_future()
+                    await asyncio.shield(record["changed"])
+        finally:
+            with self._cond:
+                record["subscribers"] -= 1
+                if record["finished"] is not None and not record["subscribers"]:
+                    self._collapse(record)
+
+    def snapshot(self):
+        with self._cond:
+            self._purge()
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for record in self._jobs.values():
+                counts[record["status"]] += 1
+            return {"workers": self.workers, "max_pending": self.max_pending, "ttl": self.ttl,
+                    "max_finished": self.max_finished, "jobs": counts, **self.stats}
+
+
+chat_jobs = ChatJobs()
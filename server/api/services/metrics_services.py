@@ -0,0 +1,316 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from api.config import Config
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Upper bounds of the generation speed buckets (tokens per second)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _model_label(model):
+    # Model names come from the request, so only known models get their own series
+    from api.services.ollama_services import model_catalog
+
+    if not model:
+        return "unknown"
+    if model == "gemini" or model_catalog.knows(model):
+        return model
+    return "other"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing value per label combination.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in values]
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets per label combination.
+
+    Observing is a bisect and three additions under a lock, so it is
+    cheap enough to stay on for every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+class RequestTimings:
+    """
+    Phase durations of one request. They are recorded with
+    Metrics.record_request() once the model and backend are known.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class Metrics:
+    """
+    Request and inference metrics, exposed in the Prometheus text format.
+
+    Requests record their phase timings (auth, limit_check, mentions, pdf,
+    inference, persistence), streams their time to first token, and Ollama
+    replies the eval counts and durations of their final chunk, labeled by
+    model (local models in the catalog, "gemini", else "other") and
+    backend ("ollama", "gemini" or "cache"). The state of the
+    other services (pool, breakers, admission, caches, write-behind queue)
+    is read from their snapshots when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.enabled = Config.METRICS_ENABLED
+        self.phase_seconds = Histogram(
+            "privgpt_request_phase_seconds", "Time spent in each phase of a chat request.",
+            ("endpoint", "phase", "model", "backend"))
+        self.request_seconds = Histogram(
+            "privgpt_request_seconds", "Total time to serve a chat request.", ("endpoint", "model", "backend"))
+        self.ttft_seconds = Histogram(
+            "privgpt_time_to_first_token_seconds", "Time from receiving a streamed chat request to its first token.",
+            ("model", "backend"))
+        self.prompt_eval_seconds = Histogram(
+            "privgpt_ollama_prompt_eval_seconds", "Prompt processing time reported by Ollama.", ("model", "backend"))
+        self.eval_seconds = Histogram(
+            "privgpt_ollama_eval_seconds", "Generation time reported by Ollama.", ("model", "backend"))
+        self.tokens_per_second = Histogram(
+            "privgpt_ollama_tokens_per_second", "Generation speed reported by Ollama (eval_count / eval_duration).",
+            ("model", "backend"), buckets=TOKEN_RATE_BUCKETS)
+        self.prompt_tokens = Counter(
+            "privgpt_ollama_prompt_eval_tokens_total", "Prompt tokens processed by Ollama.", ("model", "backend"))
+        self.generated_tokens = Counter(
+            "privgpt_ollama_eval_tokens_total", "Tokens generated by Ollama.", ("model", "backend"))
+        self._metrics = [self.phase_seconds, self.request_seconds, self.ttft_seconds, self.prompt_eval_seconds,
+                         self.eval_seconds, self.tokens_per_second, self.prompt_tokens, self.generated_tokens]
+
+    def init_app(self, app):
+        self.enabled = app.config.get("METRICS_ENABLED", self.enabled)
+
+    def record_request(self, endpoint, timings, model, backend):
+        """
+        Records the phases and total duration of a finished request.
+
+        Args:
+        endpoint (str): "chat", "stream" or "batch".
+        timings (RequestTimings): The request's timings.
+        model (str): Model that produced the reply.
+        backend (str): "ollama", "gemini" or "cache".
+        """
+        if not self.enabled or timings is None:
+            return
+        model = _model_label(model)
+        for phase, seconds in timings.phases.items():
+            self.phase_seconds.observe(seconds, endpoint, phase, model, backend)
+        self.request_seconds.observe(timings.elapsed(), endpoint, model, backend)
+
+    def record_ttft(self, seconds, model, backend):
+        if self.enabled:
+            self.ttft_seconds.observe(seconds, _model_label(model), backend)
+
+    def record_ollama(self, final, model, backend="ollama"):
+        """
+        Records the eval stats of Ollama's final chunk (durations are in ns).
+
+        Args:
+        final (dict): The final chunk (or non-streaming response).
+        model (str): Model name.
+        backend (str): "ollama", or "cache" for a replayed reply (not recorded).
+        """
+        if not self.enabled or not final or backend != "ollama":
+            return
+        model = _model_label(model)
+        eval_count = final.get("eval_count")
+        eval_duration = final.get("eval_duration")
+        prompt_count = final.get("prompt_eval_count")
+        prompt_duration = final.get("prompt_eval_duration")
+        if prompt_duration is not None:
+            self.prompt_eval_seconds.observe(prompt_duration / 1e9, model, backend)
+        if prompt_count:
+            self.prompt_tokens.inc(model, backend, amount=prompt_count)
+        if eval_duration is not None:
+            self.eval_seconds.observe(eval_duration / 1e9, model, backend)
+            if eval_count and eval_duration > 0:
+                self.tokens_per_second.observe(eval_count / (eval_duration / 1e9), model, backend)
+        if eval_count:
+            self.generated_tokens.inc(model, backend, amount=eval_count)
+
+    def _service_samples(self):
+        # (name, type, help, [(label names, label values, value)]) from the other services' snapshots
+        from api import gemini_models
+        from api.services.admission_services import admission
+        from api.services.breaker_services import breakers, OPEN, HALF_OPEN
+        from api.services.job_services import chat_jobs
+        from api.services.ollama_services import ollama_pool, model_catalog
+        from api.services.persistence_services import write_behind
+        from api.services.response_cache import response_cache
+        from api.services.stream_engine import stream_engine
+
+        pool = ollama_pool.snapshot()
+        hosts = pool["hosts"]
+        circuits = breakers.snapshot()
+        queues = admission.snapshot()
+        cache = response_cache.snapshot()
+        writes = write_behind.snapshot()
+        hedging = stream_engine.hedge_snapshot()
+        catalog = model_catalog.snapshot()
+        gemini = gemini_models.snapshot()
+        jobs = chat_jobs.snapshot()
+        states = {OPEN: 2, HALF_OPEN: 1}
+
+        return [
+            ("privgpt_ollama_host_up", "gauge", "Whether an Ollama host passed its last health check.",
+             [(("host",), (h["url"],), int(h["healthy"])) for h in hosts if h["healthy"] is not None]),
+            ("privgpt_ollama_host_active_requests", "gauge", "Requests in flight on an Ollama host.",
+             [(("host",), (h["url"],), h["active"]) for h in hosts]),
+            ("privgpt_ollama_host_routed_total", "counter", "Requests routed to an Ollama host.",
+             [(("host",), (h["url"],), h["routed"]) for h in hosts]),
+            ("privgpt_ollama_host_loaded_models", "gauge", "Models loaded in memory on an Ollama host.",
+             [(("host",), (h["url"],), len(h["loaded"])) for h in hosts]),
+            ("privgpt_ollama_routing_total", "counter", "Pool routing decisions and health checks by kind.",
+             [(("kind",), (kind,), value) for kind, value in pool["stats"].items()]),
+            ("privgpt_breaker_state", "gauge", "Circuit breaker state (0 closed, 1 half open, 2 open).",
+             [(("backend",), (name,), states.get(b["state"], 0)) for name, b in circuits.items()]),
+            ("privgpt_breaker_calls_total", "counter", "Calls through a circuit breaker by outcome.",
+             [(("backend", "outcome"), (name, outcome), b[outcome])
+              for name, b in circuits.items() for outcome in ("calls", "failures", "rejected", "opened")]),
+            ("privgpt_admission_active", "gauge", "Requests holding a slot of a model's admission queue.",
+             [(("model",), (name,), q["active"]) for name, q in queues["models"].items()]),
+            ("privgpt_admission_queued", "gauge", "Requests waiting in a model's admission queue.",
+             [(("model",), (name,), q["queued"]) for name, q in queues["models"].items()]),
+            ("privgpt_admission_total", "counter", "Admission decisions by outcome.",
+             [(("outcome",), (outcome,), value) for outcome, value in queues["stats"].items()]),
+            ("privgpt_response_cache_total", "counter", "Response cache lookups and removals by outcome.",
+             [(("outcome",), (outcome,), cache[outcome])
+              for outcome in ("hits", "misses", "coalesced", "evictions", "expired")]),
+            ("privgpt_response_cache_entries", "gauge", "Replies held in the response cache.",
+             [((), (), cache["size"])]),
+            ("privgpt_model_catalog_total", "counter", "Model catalog cache activity by kind.",
+             [(("kind",), (kind,), catalog[kind]) for kind in model_catalog.stats]),
+            ("privgpt_gemini_models_total", "counter", "Gemini model handle cache activity by kind.",
+             [(("kind",), (kind,), gemini[kind]) for kind in ("hits", "misses", "evictions")]),
+            ("privgpt_streams_total", "counter", "Chat streams by outcome, and streamed chunks and SSE frames.",
+             [(("kind",), (kind,), value) for kind, value in stream_engine.stats.items()]),
+            ("privgpt_hedge_total", "counter", "Hedged requests, how often Gemini was started, and failures.",
+             [(("kind",), (kind,), hedging[kind]) for kind in ("requests", "triggered", "failed")]),
+            ("privgpt_hedge_wins_total", "counter", "Hedged requests won by each backend.",
+             [(("backend",), (name,), wins) for name, wins in hedging["wins"].items()]),
+            ("privgpt_chat_jobs", "gauge", "Background /chat jobs held, by status.",
+             [(("status",), (status,), count) for status, count in jobs["jobs"].items()]),
+            ("privgpt_chat_jobs_total", "counter", "Background /chat jobs by outcome.",
+             [(("outcome",), (outcome,), jobs[outcome])
+              for outcome in ("submitted", "done", "failed", "rejected", "expired")]),
+            ("privgpt_write_behind_depth", "gauge", "Exchanges waiting in the write-behind queue.",
+             [((), (), writes["depth"])]),
+            ("privgpt_write_behind_pending_sessions", "gauge", "Sessions with exchanges not written yet.",
+             [((), (), writes["pending_sessions"])]),
+            ("privgpt_write_behind_flush_seconds", "gauge", "Duration of recent write-behind flushes by quantile.",
+             [(("quantile",), (quantile,), writes[key] / 1000) for quantile, key in
+              (("0.5", "flush_ms_p50"), ("0.95", "flush_ms_p95")) if writes[key] is not None]),
+            ("privgpt_write_behind_total", "counter", "Write-behind queue activity by kind.",
+             [(("kind",), (kind,), writes[kind])
+              for kind in ("queued", "written", "flushes", "retries", "failed", "dropped", "dead_lettered",
+                           "rejected_limit", "rejected_session", "overflow")]),
+        ]
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, kind, help_text, samples in self._service_samples():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_labels(names, values)} {_number(value)}" for names, values, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -1,4 +1,549 @@
+import threading
+import time
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
+from api.config import Config
+from api.services.breaker_services import breakers, BackendUnavailable
+
+
+class OllamaClient:
+    """
+    Pooled, keep-alive HTTP client for the Ollama API.
+
+    A single instance is shared by every route so that requests reuse
+    already-open TCP connections instead of opening a new one per call.
+    """
+
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None, read_timeout=None):
+        self.base_url = (base_url or Config.OLLAMA_BASE_URL).rstrip("/")
+        self.pool_size = pool_size or Config.OLLAMA_POOL_SIZE
+        self.connect_timeout = connect_timeout or Config.OLLAMA_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or Config.OLLAMA_READ_TIMEOUT
+        self.session = self._build_session()
+
+    def init_app(self, app):
+        """
+        Reconfigures the client from the Flask app config.
+
+        Args:
+        app (Flask): The application being created.
+        """
+        self.base_url = app.config.get("OLLAMA_BASE_URL", self.base_url).rstrip("/")
+        self.pool_size = app.config.get("OLLAMA_POOL_SIZE", self.pool_size)
+        self.connect_timeout = app.config.get("OLLAMA_CONNECT_TIMEOUT", self.connect_timeout)
+        self.read_timeout = app.config.get("OLLAMA_READ_TIMEOUT", self.read_timeout)
+        self.session.close()
+        self.session = self._build_session()
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _timeout(self, timeout):
+        # A single number overrides the read timeout only, the connect timeout stays short
+        return (self.connect_timeout, timeout or self.read_timeout)
+
+    def get(self, path, timeout=None, **kwargs):
+        return self.session.get(f"{self.base_url}{path}", timeout=self._timeout(timeout), **kwargs)
+
+    def post(self, path, json=None, stream=False, timeout=None, **kwargs):
+        return self.session.post(
+            f"{self.base_url}{path}", json=json, stream=stream, timeout=self._timeout(timeout), **kwargs
+        )
+
+    def generate(self, payload, stream=False, timeout=None):
+        """
+        Calls Ollama's /api/generate endpoint.
+
+        Args:
+        payload (dict): Request body for /api/generate.
+        stream (bool): Whether to stream the response body.
+        timeout (float): Read timeout in seconds, defaults to the configured one.
+
+        Returns:
+        requests.Response: The raw response.
+        """
+        return self.post("/api/generate", json=payload, stream=stream, timeout=timeout)
+
+
+def parse_hosts(spec, default):
+    """
+    Parses a comma-separated list of Ollama base URLs.
+
+    Args:
+    spec (str): e.g. "http://gpu1:11434,http://gpu2:11434".
+    default (str): Used when the list is empty.
+
+    Returns:
+    list: Base URLs without trailing slashes, duplicates removed.
+    """
+    hosts = []
+    for url in (spec or "").split(","):
+        url = url.strip().rstrip("/")
+        if url and url not in hosts:
+            hosts.append(url)
+    return hosts or [default.rstrip("/")]
+
+
+class OllamaHost:
+    """
+    One Ollama server of the pool and what the pool knows about it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.url = client.base_url
+        self.healthy = None  # unknown until the first health check
+        self.models = set()  # pulled models (/api/tags)
+        self.digests = None  # pulled model name -> digest, None until first listed
+        self.loaded = set()  # models in memory (/api/ps)
+        self.active = 0  # requests routed here that are still running
+        self.routed = 0
+        self.checked_at = None
+        self.last_error = None
+
+
+class OllamaPool:
+    """
+    Routes local model requests across one or more Ollama servers.
+
+    A background thread checks every host's /api/tags and /api/ps. A request
+    goes to a healthy host that already has the model loaded, else to one
+    that has it pulled, else to any healthy host; ties go to the host with
+    the fewest requests in flight. A host running `host_capacity` requests
+    is skipped while another one has room, so a busy model spills over to
+    further hosts. Hosts whose circuit breaker is open are only used when
+    no other host is left.
+    """
+
+    def __init__(self):
+        self.hosts = [OllamaHost(OllamaClient())]
+        self.health_interval = Config.OLLAMA_HEALTH_INTERVAL
+        self.host_capacity = Config.OLLAMA_HOST_CAPACITY
+        self._lock = threading.Lock()
+        self._checker = None
+        # Called with the names of models pulled, re-pulled or deleted on a host (see ModelCatalog)
+        self.on_models_changed = None
+        self._stop = threading.Event()
+        self.stats = {"routed_loaded": 0, "routed_pulled": 0, "routed_least_loaded": 0, "routed_busy": 0,
+                      "health_checks": 0, "health_failures": 0}
+
+    def init_app(self, app):
+        """
+        Builds one pooled client per configured host and starts the health checks.
+
+        Args:
+        app (Flask): The application being created.
+        """
+        urls = parse_hosts(app.config.get("OLLAMA_HOSTS", ""), app.config.get("OLLAMA_BASE_URL", Config.OLLAMA_BASE_URL))
+        self.health_interval = app.config.get("OLLAMA_HEALTH_INTERVAL", self.health_interval)
+        self.host_capacity = app.config.get("OLLAMA_HOST_CAPACITY", self.host_capacity)
+        for host in self.hosts:
+            host.client.session.close()
+        self.hosts = [
+            OllamaHost(OllamaClient(
+                base_url=url,
+                pool_size=app.config.get("OLLAMA_POOL_SIZE"),
+                connect_timeout=app.config.get("OLLAMA_CONNECT_TIMEOUT"),
+                read_timeout=app.config.get("OLLAMA_READ_TIMEOUT"),
+            ))
+            for url in urls
+        ]
+        self.stats = dict.fromkeys(self.stats, 0)
+        if self.health_interval and self._checker is None:
+            self._checker = threading.Thread(target=self._run_checks, name="ollama-health", daemon=True)
+            self._checker.start()
+
+    @property
+    def size(self):
+        return len(self.hosts)
+
+    def _run_checks(self):
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.health_interval)
+
+    def check(self, host):
+        """
+        Refreshes a host's health, pulled models and loaded models.
+
+        Args:
+        host (OllamaHost): The host to check.
+
+        Returns:
+        bool: Whether the host answered.
+        """
+        self.stats["health_checks"] += 1
+        try:
+            tags = host.client.get("/api/tags", timeout=5)
+            tags.raise_for_status()
+            ps = host.client.get("/api/ps", timeout=5)
+            loaded = {m.get("name") or m.get("model") for m in ps.json().get("models", [])} if ps.ok else None
+        except Exception as e:
+            self.stats["health_failures"] += 1
+            with self._lock:
+                host.healthy = False
+                host.last_error = str(e)
+                host.checked_at = time.time()
+            return False
+        with self._lock:
+            host.healthy = True
+            host.last_error = None
+            host.checked_at = time.time()
+            changed = self._set_models(host, tags.json().get("models", []))
+            if loaded is not None:
+                host.loaded = loaded
+        self._models_changed(changed)
+        return True
+
+    def _set_models(self, host, models):
+        # Called with the lock held; returns the names pulled, re-pulled or deleted since the last listing
+        digests = {m["name"]: m.get("digest") for m in models}
+        previous, host.digests = host.digests, digests
+        host.models = set(digests)
+        if previous is None:
+            return set()
+        return {name for name in previous.keys() | digests.keys() if previous.get(name) != digests.get(name)}
+
+    def _models_changed(self, names):
+        if names and self.on_models_changed is not None:
+            self.on_models_changed(names)
+
+    def check_all(self):
+        """
+        Checks every host in parallel.
+        """
+        threads = [threading.Thread(target=self.check, args=(host,), daemon=True) for host in self.hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def mark_loaded(self, host, models):
+        """
+        Records the models a host reported in memory (e.g. from /api/ps).
+        """
+        with self._lock:
+            host.loaded = set(models)
+
+    def host(self, url):
+        return next((host for host in self.hosts if host.url == url), None)
+
+    def _pick(self, model):
+        # Called with the lock held
+        candidates = [host for host in self.hosts
+                      if host.healthy is not False and breakers.get(host.url).available()]
+        if not candidates:
+            # Nothing known to be good: let the request (and its breaker) decide
+            candidates = [host for host in self.hosts if breakers.get(host.url).available()] or self.hosts
+        tiers = (
+            ("routed_loaded", [host for host in candidates if model in host.loaded]),
+            ("routed_pulled", [host for host in candidates if model in host.models]),
+            ("routed_least_loaded", candidates),
+        )
+        for stat, matching in tiers:
+            matching = [host for host in matching if not self.host_capacity or host.active < self.host_capacity]
+            if matching:
+                break
+        else:
+            # Every host is full: queue on the least busy one that has the model
+            stat = "routed_busy"
+            matching = tiers[0][1] or tiers[1][1] or candidates
+        self.stats[stat] += 1
+        host = min(matching, key=lambda h: (h.active, h.routed))
+        host.routed += 1
+        # Ollama loads the model on first use, so keep sending it there
+        host.loaded.add(model)
+        return host
+
+    def acquire(self, model):
+        """
+        Picks the host for a request and counts it as running there.
+
+        Args:
+        model (str): Local model name.
+
+        Returns:
+        OllamaHost: Pass it to release() when the request is done.
+        """
+        with self._lock:
+            host = self._pick(model)
+            host.active += 1
+            return host
+
+    def release(self, host):
+        with self._lock:
+            host.active -= 1
+
+    @contextmanager
+    def lease(self, model):
+        """
+        Holds a host for the duration of a blocking request.
+        """
+        host = self.acquire(model)
+        try:
+            yield host
+        finally:
+            self.release(host)
+
+    def client_for(self, model):
+        """
+        Returns the client of the host a short request for `model` should go to.
+        """
+        with self._lock:
+            return self._pick(model).client
+
+    def rejects(self, model):
+        """
+        Tells whether every host that could serve `model` has an open circuit.
+        Rejections are counted on their breakers.
+        """
+        if any(breakers.get(host.url).available() for host in self.hosts):
+            return False
+        return all([breakers.get(host.url).rejects() for host in self.hosts])
+
+    def fetch_models(self):
+        """
+        Lists the models of every reachable host (/api/tags), merged by name.
+
+        Returns:
+        list: Model entries as returned by Ollama, each with the "hosts" that have it.
+
+        Raises:
+        Exception: The last error if no host answered.
+        """
+        merged, error = {}, None
+        for host in self.hosts:
+            try:
+                res = host.client.get("/api/tags", timeout=5)
+                res.raise_for_status()
+                models = res.json().get("models", [])
+            except Exception as e:
+                error = e
+                with self._lock:
+                    host.healthy = False
+                    host.last_error = str(e)
+                continue
+            with self._lock:
+                host.healthy = True
+                self._set_models(host, models)
+            for m in models:
+                merged.setdefault(m["name"], {**m, "hosts": []})["hosts"].append(host.url)
+        if not merged and error is not None:
+            raise error
+        return list(merged.values())
+
+    def snapshot(self):
+        with self._lock:
+            hosts = [
+                {
+                    "url": host.url,
+                    "healthy": host.healthy,
+                    "active": host.active,
+                    "routed": host.routed,
+                    "models": sorted(host.models),
+                    "loaded": sorted(host.loaded),
+                    "checked_at": host.checked_at,
+                    "last_error": host.last_error,
+                }
+                for host in self.hosts
+            ]
+            return {"hosts": hosts, "health_interval": self.health_interval, "host_capacity": self.host_capacity,
+                    "stats": dict(self.stats)}
+
+
+class ModelCatalog:
+    """
+    In-process cache of the Ollama model catalog.
+
+    The /api/tags listing is served from memory for `ttl` seconds. Once it
+    expires, the stale copy is still served (up to `stale_ttl` seconds) while
+    a background thread refreshes it. The listing is the union of the models
+    of every host in the pool. /api/show payloads are cached by model
+    digest, so re-pulling a model under the same name is picked up as soon
+    as the listing is refreshed. The cache is invalidated early when the
+    pool's health checks see a model pulled, re-pulled or deleted, and when
+    Ollama answers 404 for a model the cache still lists.
+    """
+
+    def __init__(self, pool, ttl=None, stale_ttl=None):
+        self.pool = pool
+        self.ttl = ttl if ttl is not None else Config.MODEL_CATALOG_TTL
+        self.stale_ttl = stale_ttl if stale_ttl is not None else Config.MODEL_CATALOG_STALE_TTL
+        self._lock = threading.Lock()
+        self._models = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._details = {}
+        pool.on_models_changed = self.invalidate_models
+        self.stats = {
+            "tags_hits": 0,
+            "tags_stale_hits": 0,
+            "tags_misses": 0,
+            "show_hits": 0,
+            "show_misses": 0,
+            "background_refreshes": 0,
+            "invalidations": 0,
+            "upstream_requests": 0,
+        }
+
+    def init_app(self, app):
+        self.ttl = app.config.get("MODEL_CATALOG_TTL", self.ttl)
+        self.stale_ttl = app.config.get("MODEL_CATALOG_STALE_TTL", self.stale_ttl)
+
+    def _fetch_models(self):
+        self.stats["upstream_requests"] += 1
+        models = self.pool.fetch_models()
+        with self._lock:
+            self._models = models
+            self._fetched_at = time.monotonic()
+        return models
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch_models()
+        except Exception as e:
+            print(f"Background model catalog refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def models(self):
+        """
+        Returns the cached /api/tags model list, refreshing it if needed.
+
+        Returns:
+        list: Model entries as returned by Ollama (name, digest, size, ...)
+              plus the hosts that have each model.
+        """
+        with self._lock:
+            models = self._models
+            age = time.monotonic() - self._fetched_at
+            if models is not None and age < self.ttl:
+                self.stats["tags_hits"] += 1
+                return models
+            if models is not None and age < self.ttl + self.stale_ttl:
+                self.stats["tags_stale_hits"] += 1
+                if not self._refreshing:
+                    self._refreshing = True
+                    self.stats["background_refreshes"] += 1
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                return models
+            self.stats["tags_misses"] += 1
+        return self._fetch_models()
+
+    def knows(self, model_name, fetch=False):
+        """
+        Tells whether a model is pulled on some host, from what is already
+        cached (the listing and the pool's health checks), without a request.
+
+        Args:
+        model_name (str): Model name, with or without its tag.
+        fetch (bool): Load the listing first if it is not cached (may raise).
+
+        Returns:
+        bool: True if the model is known.
+        """
+        if not model_name:
+            return False
+        names = {model_name, f"{model_name}:latest"}
+        if fetch:
+            self.models()
+        with self._lock:
+            models = self._models or []
+        if any(m.get("name") in names for m in models):
+            return True
+        return any(names & host.models for host in self.pool.hosts)
+
+    def model_details(self, model_name):
+        """
+        Returns the /api/show payload for a model, cached by digest.
+
+        Args:
+        model_name (str): The name of the model to inspect.
+
+        Returns:
+        dict: The /api/show payload.
+        """
+        try:
+            digest = next((m.get("digest") for m in self.models() if m.get("name") == model_name), None)
+        except Exception:
+            digest = None
+        key = digest or f"name:{model_name}"
+
+        with self._lock:
+            details = self._details.get(key)
+        if details is not None:
+            self.stats["show_hits"] += 1
+            return details
+
+        self.stats["show_misses"] += 1
+        self.stats["upstream_requests"] += 1
+        res = self.pool.client_for(model_name).post("/api/show", json={"name": model_name}, timeout=5)
+        res.raise_for_status()
+        details = res.json()
+        with self._lock:
+            self._details[key] = details
+        return details
+
+    def invalidate_models(self, model_names):
+        """
+        Drops the cached listing and the details of models that changed.
+
+        Args:
+        model_names (set): Models that were pulled, re-pulled or deleted.
+        """
+        for model_name in model_names:
+            self.invalidate(model_name)
+
+    def model_missing(self, model_name):
+        """
+        Handles Ollama answering 404 for a model: if the cache still lists
+        it, it was deleted, so the listing is dropped. Unknown names do not
+        touch the cache.
+
+        Args:
+        model_name (str): The requested model.
+        """
+        if self.knows(model_name):
+            self.invalidate(model_name)
+
+    def invalidate(self, model_name=None):
+        """
+        Drops the cached listing, and the cached details of `model_name` if given.
+
+        Args:
+        model_name (str): Model that was pulled or deleted.
+        """
+        with self._lock:
+            self.stats["invalidations"] += 1
+            if model_name:
+                for m in self._models or []:
+                    if m.get("name") == model_name:
+                        self._details.pop(m.get("digest"), None)
+                self._details.pop(f"name:{model_name}", None)
+            else:
+                self._details.clear()
+            self._models = None
+            self._fetched_at = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "cached_models": len(self._models or []),
+                "cached_details": len(self._details),
+                "age_seconds": round(time.monotonic() - self._fetched_at, 3) if self._models is not None else None,
+            }
+
+
+ollama_pool = OllamaPool()
+model_catalog = ModelCatalog(ollama_pool)
+
 
 def get_available_models():
     """
@@ -8,9 +553,8 @@ def get_available_models():
     list: Names of available local models (with full tags).
     """
     try:
-        res = requests.get("http://localhost:11434/api/tags", timeout=5)
         # Return full model names including tags (e.g., "gemma3:1b" instead of just "gemma3")
-        return sorted(m['name'] for m in res.json().get("models", []))
+        return sorted(m['name'] for m in model_catalog.models())
     except:
         return []
 
@@ -25,10 +569,44 @@ def get_model_details(model_name):
     dict: The JSON response from Ollama's /api/show endpoint, or None if failed.
     """
     try:
-        res = requests.post("http://localhost:11434/api/show", json={"name": model_name}, timeout=5)
-        if res.status_code == 200:
-            return res.json()
-        return None
+        return model_catalog.model_details(model_name)
     except Exception as e:
         print(f"Error fetching details for {model_name}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def call_ollama(payload):
+    """
+    Calls Ollama's /api/generate on the pool host picked for the model,
+    through that host's circuit breaker. The breaker is given the time the
+    reply took minus the generation time Ollama reports, i.e. roughly the
+    time to the first token, so its slow-call threshold applies as it does
+    to streams.
+
+    Returns:
+    requests.Response: The raw response.
+
+    Raises:
+    BackendUnavailable: While the host's circuit is open.
+    """
+    with ollama_pool.lease(payload["model"]) as host:
+        breaker = breakers.get(host.url)
+        permit = breaker.allow()
+        if permit is None:
+            raise BackendUnavailable(f"Ollama at {host.url} is unavailable (circuit open)")
+        start = time.perf_counter()
+        try:
+            response = host.client.generate(payload)
+        except Exception as e:
+            breaker.record(permit, False, error=str(e))
+            raise
+        latency = time.perf_counter() - start
+    if response.status_code == 404:
+        model_catalog.model_missing(payload["model"])
+    if response.ok and not payload.get("stream"):
+        try:
+            latency -= response.json().get("eval_duration", 0) / 1e9
+        except ValueError:
+            pass
+    ok = response.status_code < 500
+    breaker.record(permit, ok, latency=max(latency, 0.0), error=None if ok else f"HTTP {response.status_code}")
+    return response
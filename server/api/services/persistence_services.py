@@ -0,0 +1,232 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from pymongo.errors import ConnectionFailure, PyMongoError
+from api.config import Config
+from api.services.chat_store import apply_exchanges, record_failed_exchanges
+
+logger = logging.getLogger(__name__)
+
+def is_transient(error):
+    """
+    Tells whether a Mongo error is worth retrying (network trouble, failover).
+    """
+    if isinstance(error, ConnectionFailure):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+
+class WriteBehindQueue:
+    """
+    Saves chat exchanges in the background so replies do not wait for Mongo.
+
+    Writes from all requests go into one queue and a writer thread applies
+    them together: whatever queued up while the previous flush was running
+    goes into the next bulk write. Transient errors are retried with
+    backoff, and the queue is drained on shutdown. When a batch fails for
+    another reason its writes are applied one at a time, so only the bad
+    one is lost. Exchanges that still cannot be saved are counted ("failed"
+    after the retries, "dropped" on other errors) and dead-lettered with
+    record_failed_exchanges(), which gives back their reserved message
+    slot and marks their session; while Mongo cannot take even that, they
+    are kept in memory and recorded after a later flush. Requests that read
+    a session (or a user's session list) first wait for its pending writes.
+    """
+
+    def __init__(self):
+        self.enabled = Config.WRITE_BEHIND_ENABLED
+        self.batch_size = Config.WRITE_BEHIND_BATCH_SIZE
+        self.max_pending = Config.WRITE_BEHIND_MAX_PENDING
+        self.max_retries = Config.WRITE_BEHIND_MAX_RETRIES
+        self.retry_delay = 0.1
+        self.wait_timeout = 5.0
+        self._queue = deque()
+        # session id / "user:<id>" -> number of writes not applied yet
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._flush_ms = deque(maxlen=256)
+        # (write, error) pairs that failed and are not dead-lettered yet
+        self._unrecorded = []
+        self.stats = {"queued": 0, "written": 0, "flushes": 0, "retries": 0, "failed": 0, "dropped": 0,
+                      "dead_lettered": 0, "rejected_limit": 0, "rejected_session": 0, "overflow": 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get("WRITE_BEHIND_ENABLED", self.enabled)
+        self.batch_size = app.config.get("WRITE_BEHIND_BATCH_SIZE", self.batch_size)
+        self.max_pending = app.config.get("WRITE_BEHIND_MAX_PENDING", self.max_pending)
+        self.max_retries = app.config.get("WRITE_BEHIND_MAX_RETRIES", self.max_retries)
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    @staticmethod
+    def _keys(write):
+        keys = [write["session_id"]]
+        if write["user_id"]:
+            keys.append(f"user:{write['user_id']}")
+        return keys
+
+    def submit(self, write):
+        """
+        Queues an exchange write (see chat_store.prepare_exchange).
+
+        Args:
+        write (dict): The write to apply.
+
+        Returns:
+        bool: False if write-behind is off or the queue is full; the caller
+              then applies the write itself.
+        """
+        with self._cond:
+            if not self.enabled or self._stopping or self._thread is None:
+                return False
+            if len(self._queue) >= self.max_pending:
+                self.stats["overflow"] += 1
+                return False
+            self._queue.append(write)
+            for key in self._keys(write):
+                self._pending[key] = self._pending.get(key, 0) + 1
+            self.stats["queued"] += 1
+            self._cond.notify_all()
+        return True
+
+    def wait_for(self, session_id=None, user_id=None, timeout=None):
+        """
+        Blocks until the queued writes of a session and/or a user are applied.
+
+        Args:
+        session_id (str): Session about to be read or changed.
+        user_id (str): User whose session list is about to be read.
+        timeout (float): Seconds to wait at most, defaults to 5.
+
+        Returns:
+        bool: False if the writes were still pending at the timeout.
+        """
+        keys = [key for key in (session_id, user_id and f"user:{user_id}") if key]
+        deadline = time.monotonic() + (timeout or self.wait_timeout)
+        with self._cond:
+            while any(self._pending.get(key) for key in keys):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every queued write is applied.
+
+        Returns:
+        bool: False if writes were still pending at the timeout.
+        """
+        deadline = time.monotonic() + (timeout or self.wait_timeout)
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._flush(batch)
+
+    def _apply(self, batch):
+        # Returns the rejected writes and the (write, error) pairs that could not be saved
+        for attempt in range(self.max_retries + 1):
+            try:
+                return apply_exchanges(batch), []
+            except Exception as e:
+                if is_transient(e) and attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                if is_transient(e) or len(batch) == 1:
+                    logger.error("Could not save %d queued exchanges (sessions %s)", len(batch),
+                                 ", ".join(sorted({write["session_id"] for write in batch})), exc_info=e)
+                    return [], [(write, e) for write in batch]
+                break
+        # Something in the batch is bad: apply the writes one at a time so only it fails
+        rejected, failed = [], []
+        for write in batch:
+            write_rejected, write_failed = self._apply([write])
+            rejected += write_rejected
+            failed += write_failed
+        return rejected, failed
+
+    def _dead_letter(self, failed):
+        pending = self._unrecorded + failed
+        if not pending:
+            return 0
+        try:
+            record_failed_exchanges(pending)
+        except Exception as e:
+            logger.error("Could not record %d failed exchanges, keeping them for the next flush", len(pending),
+                         exc_info=e)
+            self._unrecorded = pending[-self.max_pending:]
+            return 0
+        self._unrecorded = []
+        return len(pending)
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        rejected, failed = self._apply(batch)
+        for write in rejected:
+            logger.warning("Dropped a queued exchange of session %s: %s", write["session_id"],
+                           "session not found" if write["rejected"] == "session_not_found" else "message limit reached")
+        dead_lettered = self._dead_letter(failed)
+
+        with self._cond:
+            self._flush_ms.append((time.perf_counter() - start) * 1000)
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(batch) - len(rejected) - len(failed)
+            for write in rejected:
+                self.stats["rejected_session" if write["rejected"] == "session_not_found" else "rejected_limit"] += 1
+            for _, error in failed:
+                self.stats["failed" if is_transient(error) else "dropped"] += 1
+            self.stats["dead_lettered"] += dead_lettered
+            for write in batch:
+                for key in self._keys(write):
+                    self._pending[key] -= 1
+                    if not self._pending[key]:
+                        del self._pending[key]
+            self._cond.notify_all()
+
+    def shutdown(self, timeout=10.0):
+        """
+        Stops taking writes and waits for the queued ones to be applied.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        with self._cond:
+            flush_ms = sorted(self._flush_ms)
+            return {
+                "enabled": self.enabled,
+                "depth": len(self._queue),
+                "pending_sessions": sum(1 for key in self._pending if not key.startswith("user:")),
+                "unrecorded_failures": len(self._unrecorded),
+                "flush_ms_last": round(self._flush_ms[-1], 2) if flush_ms else None,
+                "flush_ms_p50": round(flush_ms[len(flush_ms) // 2], 2) if flush_ms else None,
+                "flush_ms_p95": round(flush_ms[int(len(flush_ms) * 0.95)], 2) if flush_ms else None,
+                **self.stats,
+            }
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,251 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from api.config import Config
+from api.services.admission_services import AdmissionRejected
+from api.services.ollama_services import ollama_pool, model_catalog
+
+
+class ModelResidency:
+    """
+    Keeps the local models users rotate between loaded in Ollama.
+
+    Selecting a model starts a background warm-up load with the configured
+    keep_alive, so the first message does not pay the load time. Models
+    are ordered by last use; once the models an Ollama host reports as
+    resident (/api/ps) exceed the memory budget, the least recently used
+    ones are unloaded from that host. Only models in the catalog are
+    tracked, at most `max_tracked` of them (the least recently used ones
+    that are not loading are forgotten first), and at most `max_pending`
+    warm-ups load or wait at once.
+    """
+
+    def __init__(self):
+        self.keep_alive = Config.OLLAMA_KEEP_ALIVE
+        self.memory_budget = Config.OLLAMA_MEMORY_BUDGET_MB * 1024 * 1024
+        self.ps_ttl = 2.0
+        self.max_tracked = Config.OLLAMA_RESIDENCY_MAX_TRACKED
+        self.max_pending = Config.OLLAMA_WARMUP_MAX_PENDING
+        self._executor = ThreadPoolExecutor(max_workers=Config.OLLAMA_WARMUP_WORKERS, thread_name_prefix="warmup")
+        self._lock = threading.Lock()
+        # model name -> warm-up status, most recently used last
+        self._models = OrderedDict()
+        self._resident = []
+        self._resident_at = 0.0
+        self.stats = {"warmups": 0, "failures": 0, "evictions": 0}
+
+    def init_app(self, app):
+        self.keep_alive = app.config.get("OLLAMA_KEEP_ALIVE", self.keep_alive)
+        self.memory_budget = app.config.get("OLLAMA_MEMORY_BUDGET_MB", 0) * 1024 * 1024
+        self.max_tracked = app.config.get("OLLAMA_RESIDENCY_MAX_TRACKED", self.max_tracked)
+        self.max_pending = app.config.get("OLLAMA_WARMUP_MAX_PENDING", self.max_pending)
+
+    def touch(self, model_name):
+        """
+        Marks a model as just used. Models the catalog does not know are ignored.
+
+        Args:
+        model_name (str): Local model name.
+        """
+        if not model_catalog.knows(model_name):
+            return
+        with self._lock:
+            self._touch(model_name)
+
+    def _touch(self, model_name):
+        # Called with the lock held
+        entry = self._models.setdefault(model_name, {"state": "unknown"})
+        entry["last_used"] = datetime.now().isoformat()
+        self._models.move_to_end(model_name)
+        if len(self._models) > self.max_tracked:
+            idle = [name for name, status in self._models.items()
+                    if status["state"] != "loading" and name != model_name]
+            for name in idle[:len(self._models) - self.max_tracked]:
+                del self._models[name]
+        return entry
+
+    def warm(self, model_name, keep_alive=None):
+        """
+        Starts loading a model in the background unless a load is already running.
+
+        Args:
+        model_name (str): Local model name, known to the catalog.
+        keep_alive (str): How long Ollama keeps it loaded, defaults to OLLAMA_KEEP_ALIVE.
+
+        Returns:
+        dict: The model's current status.
+
+        Raises:
+        AdmissionRejected: If `max_pending` warm-ups are already loading or waiting.
+        """
+        with self._lock:
+            current = self._models.get(model_name)
+            if current is None or current["state"] != "loading":
+                loading = sum(1 for status in self._models.values() if status["state"] == "loading")
+                if self.max_pending and loading >= self.max_pending:
+                    raise AdmissionRejected("warmup_queue_full")
+            entry = self._touch(model_name)
+            if entry["state"] != "loading":
+                entry.update({"state": "loading", "started_at": datetime.now().isoformat(), "error": None})
+                self._executor.submit(self._load, model_name, keep_alive or self.keep_alive)
+            return dict(entry)
+
+    def _load(self, model_name, keep_alive):
+        start = time.perf_counter()
+        try:
+            # An empty prompt makes Ollama load the model without generating anything.
+            # The pool remembers the host, so the chat requests that follow go there too
+            with ollama_pool.lease(model_name) as host:
+                response = host.client.generate(
+                    {"model": model_name, "prompt": "", "stream": False, "keep_alive": keep_alive}
+                )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Warm-up of {model_name} failed: {e}")
+            with self._lock:
+                self._models.get(model_name, {}).update({"state": "failed", "error": str(e)})
+                self.stats["failures"] += 1
+            return
+
+        with self._lock:
+            self._models.get(model_name, {}).update({
+                "state": "ready",
+                "host": host.url,
+                "loaded_at": datetime.now().isoformat(),
+                "load_ms": int((time.perf_counter() - start) * 1000),
+            })
+            self.stats["warmups"] += 1
+        try:
+            self.enforce_budget(keep=model_name)
+        except Exception as e:
+            print(f"Could not enforce the model memory budget: {e}")
+
+    def resident_models(self, refresh=False):
+        """
+        Lists the models the Ollama hosts currently hold in memory (/api/ps), cached briefly.
+
+        Returns:
+        list: Dicts with name, size, expires_at and host.
+
+        Raises:
+        Exception: The last error if no host answered.
+        """
+        if refresh or time.monotonic() - self._resident_at > self.ps_ttl:
+            fetched_at = datetime.now().isoformat()
+            resident, answered, error = [], 0, None
+            for host in ollama_pool.hosts:
+                try:
+                    response = host.client.get("/api/ps", timeout=5)
+                    response.raise_for_status()
+                except Exception as e:
+                    error = e
+                    continue
+                answered += 1
+                models = [
+                    {
+                        "name": m.get("name") or m.get("model"),
+                        "size": m.get("size_vram") or m.get("size", 0),
+                        "expires_at": m.get("expires_at"),
+                        "host": host.url,
+                    }
+                    for m in response.json().get("models", [])
+                ]
+                ollama_pool.mark_loaded(host, [m["name"] for m in models])
+                resident.extend(models)
+            if not answered and error is not None:
+                raise error
+            with self._lock:
+                self._resident = resident
+                self._resident_at = time.monotonic()
+                # Models unloaded by Ollama itself (keep_alive expired) are no longer ready
+                names = {m["name"] for m in resident}
+                for name, entry in self._models.items():
+                    if entry["state"] == "ready" and name not in names and entry["loaded_at"] < fetched_at:
+                        entry["state"] = "unloaded"
+        return list(self._resident)
+
+    def enforce_budget(self, keep=None):
+        """
+        Unloads least recently used models until the resident ones fit the
+        budget, which applies to each Ollama host separately.
+
+        Args:
+        keep (str): Model that must stay loaded (the one just warmed up).
+
+        Returns:
+        list: Names of the unloaded models.
+        """
+        if not self.memory_budget:
+            return []
+        per_host = {}
+        for m in self.resident_models(refresh=True):
+            per_host.setdefault(m["host"], {})[m["name"]] = m["size"]
+
+        evicted = []
+        for url, resident in per_host.items():
+            host = ollama_pool.host(url)
+            used = sum(resident.values())
+            with self._lock:
+                # Models we never saw used are the first candidates, then LRU order
+                order = [name for name in resident if name not in self._models] + \
+                        [name for name in self._models if name in resident]
+                loading = {name for name, entry in self._models.items() if entry["state"] == "loading"}
+
+            for name in order:
+                if used <= self.memory_budget or host is None:
+                    break
+                if name == keep or name in loading:
+                    continue
+                response = host.client.generate({"model": name, "prompt": "", "stream": False, "keep_alive": 0})
+                if response.ok:
+                    used -= resident[name]
+                    evicted.append(name)
+                    with self._lock:
+                        self.stats["evictions"] += 1
+                        entry = self._models.get(name)
+                        if entry is not None and entry.get("host") in (None, url):
+                            entry["state"] = "unloaded"
+        if evicted:
+            print(f"Unloaded {evicted} to fit the model memory budget")
+            self._resident_at = 0.0
+        return evicted
+
+    def status(self, model_name=None):
+        """
+        Reports warm-up and residency status for the UI.
+
+        Args:
+        model_name (str): Only report this model.
+
+        Returns:
+        dict: Per-model status, resident models and the memory budget.
+        """
+        try:
+            resident = self.resident_models()
+        except Exception as e:
+            print(f"Could not list resident models: {e}")
+            resident = None
+        resident_names = {m["name"] for m in resident or []}
+        with self._lock:
+            models = {
+                name: {**entry, "resident": name in resident_names}
+                for name, entry in self._models.items()
+                if model_name is None or name == model_name
+            }
+        if model_name is not None and model_name not in models:
+            models[model_name] = {
+                "state": "ready" if model_name in resident_names else "unknown",
+                "resident": model_name in resident_names,
+            }
+        return {
+            "models": models,
+            "resident": resident,
+            "memory_budget_mb": self.memory_budget // (1024 * 1024),
+            "memory_used_mb": sum(m["size"] for m in resident or []) // (1024 * 1024),
+            "stats": dict(self.stats),
+        }
+
+
+model_residency = ModelResidency()
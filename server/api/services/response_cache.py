@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from api.config import Config
+
+# Request fields that do not change what a model generates
+NON_KEY_FIELDS = ("stream", "keep_alive")
+
+
+class ResponseCache:
+    """
+    LRU cache of local model replies for seeded (deterministic) requests.
+
+    Entries are keyed by everything that determines the output: model,
+    full prompt, system prompt, sampling options with the seed, and the
+    conversation context. Identical requests that arrive while the first
+    one is still generating wait for it instead of generating again.
+    """
+
+    def __init__(self):
+        self.max_size = Config.RESPONSE_CACHE_SIZE
+        self.ttl = Config.RESPONSE_CACHE_TTL
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def init_app(self, app):
+        self.max_size = app.config.get("RESPONSE_CACHE_SIZE", self.max_size)
+        self.ttl = app.config.get("RESPONSE_CACHE_TTL", self.ttl)
+
+    def key_for(self, payload):
+        """
+        Builds the cache key of an Ollama /api/generate request.
+
+        Args:
+        payload (dict): The request body.
+
+        Returns:
+        str: The key, or None if the request is not cacheable (no seed, or
+             the cache is disabled).
+        """
+        if not self.max_size or payload.get("options", {}).get("seed") is None:
+            return None
+        key = {k: v for k, v in payload.items() if k not in NON_KEY_FIELDS}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        Looks up a key and, on a miss, makes the caller the one to generate it.
+
+        Returns:
+        tuple: ("hit", entry), ("wait", future) when an identical request is
+               already generating, or ("lead", None) when the caller must
+               generate and then call complete() or abort().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.ttl and time.monotonic() - entry["stored_at"] > self.ttl:
+                    del self._entries[key]
+                    self.stats["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return "hit", entry
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return "wait", future
+            self._inflight[key] = Future()
+            self.stats["misses"] += 1
+            return "lead", None
+
+    def complete(self, key, chunks, final):
+        """
+        Stores a finished generation and hands it to the waiting requests.
+
+        Args:
+        key (str): Cache key from lookup().
+        chunks (list): Reply text chunks, in order.
+        final (dict): Ollama's final chunk (context and eval stats).
+
+        Returns:
+        dict: The stored entry.
+        """
+        entry = {"chunks": list(chunks), "final": final, "stored_at": time.monotonic()}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(entry)
+        return entry
+
+    def abort(self, key, error=None):
+        """
+        Gives up on a generation; waiting requests receive the error and
+        generate on their own.
+        """
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_exception(error or RuntimeError("Generation was cancelled"))
+
+    def get_or_generate(self, key, generate, timeout=None):
+        """
+        Returns the cached reply for a key, generating it at most once.
+
+        Args:
+        key (str): Cache key from key_for().
+        generate (callable): Returns (chunks, final) on a miss.
+        timeout (float): How long to wait for an identical in-flight request.
+
+        Returns:
+        tuple: (entry, status) with status "hit", "coalesced", "miss", or
+               "bypass" when the identical request failed or timed out and
+               the reply was generated without the cache.
+        """
+        status, found = self.lookup(key)
+        if status == "hit":
+            return found, "hit"
+        if status == "wait":
+            try:
+                return found.result(timeout), "coalesced"
+            except Exception:
+                # The other request failed or is too slow, generate without the cache
+                chunks, final = generate()
+                return {"chunks": list(chunks), "final": final, "stored_at": time.monotonic()}, "bypass"
+        try:
+            chunks, final = generate()
+        except BaseException as e:
+            self.abort(key, e)
+            raise
+        return self.complete(key, chunks, final), "miss"
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "size": len(self._entries), "inflight": len(self._inflight),
+                    "max_size": self.max_size, "ttl": self.ttl}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,329 @@
+import hashlib
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from bson import Binary, ObjectId
+from api import mongo
+from api.config import Config
+from api.services.ollama_services import ollama_pool
+from api.utils.file_utils import extract_text_from_pdf_bytes
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def chunk_text(text, size, overlap):
+    """
+    Splits text into overlapping chunks, preferring whitespace boundaries.
+
+    Args:
+    text (str): Text to split.
+    size (int): Maximum chunk length in characters.
+    overlap (int): Characters shared by consecutive chunks.
+
+    Returns:
+    list: The chunks, in document order.
+    """
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Do not cut a word in half if a space is close enough
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary as well
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Local embedder based on the hashing trick: word and word-pair counts
+    hashed into a fixed number of signed buckets. Needs no model and is
+    deterministic, so indexes built with it never have to be rebuilt.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = zlib.crc32(feature.encode())
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Sublinear term frequency, keeping the sign of each bucket
+        return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+
+class OllamaEmbedder:
+    """
+    Embeds texts with an Ollama embedding model (e.g. nomic-embed-text).
+    """
+
+    def __init__(self, model, batch_size=64):
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"ollama:{model}"
+
+    def embed(self, texts):
+        vectors = []
+        client = ollama_pool.client_for(self.model)
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            response = client.post("/api/embed", json={"model": self.model, "input": batch})
+            if response.status_code == 404:
+                # Older servers only have the one-prompt-per-call endpoint
+                for text in batch:
+                    single = client.post("/api/embeddings", json={"model": self.model, "prompt": text})
+                    single.raise_for_status()
+                    vectors.append(single.json()["embedding"])
+                continue
+            response.raise_for_status()
+            vectors.extend(response.json()["embeddings"])
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class DocumentIndex:
+    """
+    Chunks of one document with their unit-length embedding vectors.
+    """
+
+    def __init__(self, index_id, filename, chunks, vectors):
+        self.index_id = index_id
+        self.filename = filename
+        self.chunks = chunks
+        self.vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def search(self, query_vector, k):
+        """
+        Returns the k best matching chunks as (score, position) pairs, best first.
+        """
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), int(i)) for i in top[np.argsort(-scores[top])]]
+
+    def to_document(self, sha256, embedder_name):
+        return {
+            "_id": self.index_id,
+            "sha256": sha256,
+            "filename": self.filename,
+            "embedder": embedder_name,
+            "dim": int(self.vectors.shape[1]),
+            "chunks": self.chunks,
+            "vectors": Binary(self.vectors.tobytes()),
+            "created_at": datetime.now(),
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        vectors = np.frombuffer(doc["vectors"], dtype=np.float32).reshape(len(doc["chunks"]), doc["dim"])
+        return cls(doc["_id"], doc.get("filename"), doc["chunks"], vectors)
+
+
+class DocumentRetriever:
+    """
+    Retrieval over uploaded PDFs.
+
+    Each document is extracted, chunked and embedded once; the index is
+    stored in the document_indexes collection under the file's sha256 and
+    linked to the chat session, so later questions in that session only
+    embed the question and pick the top-k chunks.
+    """
+
+    def __init__(self):
+        self.embedder_type = Config.RAG_EMBEDDER
+        self.embed_model = Config.RAG_EMBED_MODEL
+        self.chunk_chars = Config.RAG_CHUNK_CHARS
+        self.chunk_overlap = Config.RAG_CHUNK_OVERLAP
+        self.top_k = Config.RAG_TOP_K
+        self.min_score = Config.RAG_MIN_SCORE
+        self.cache_size = Config.RAG_INDEX_CACHE_SIZE
+        self._embedder = None
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.embedder_type = app.config.get("RAG_EMBEDDER", self.embedder_type)
+        self.embed_model = app.config.get("RAG_EMBED_MODEL", self.embed_model)
+        self.chunk_chars = app.config.get("RAG_CHUNK_CHARS", self.chunk_chars)
+        self.chunk_overlap = app.config.get("RAG_CHUNK_OVERLAP", self.chunk_overlap)
+        self.top_k = app.config.get("RAG_TOP_K", self.top_k)
+        self.min_score = app.config.get("RAG_MIN_SCORE", self.min_score)
+        self.cache_size = app.config.get("RAG_INDEX_CACHE_SIZE", self.cache_size)
+        self._embedder = None
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            if self.embedder_type == "ollama":
+                self._embedder = OllamaEmbedder(self.embed_model)
+            else:
+                self._embedder = HashingEmbedder()
+        return self._embedder
+
+    def set_embedder(self, embedder):
+        """
+        Plugs in a custom embedder: any object with a `name` and an
+        `embed(texts)` method returning one vector per text.
+        """
+        self._embedder = embedder
+
+    def _cache(self, index):
+        with self._lock:
+            self._indexes[index.index_id] = index
+            self._indexes.move_to_end(index.index_id)
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+
+    def _load(self, index_id):
+        with self._lock:
+            index = self._indexes.get(index_id)
+            if index is not None:
+                self._indexes.move_to_end(index_id)
+                return index
+        doc = mongo.db.document_indexes.find_one({"_id": index_id})
+        if doc is None:
+            return None
+        index = DocumentIndex.from_document(doc)
+        self._cache(index)
+        return index
+
+    def index_pdf(self, file_bytes, filename):
+        """
+        Returns the index of a PDF, building and storing it on first sight.
+
+        Args:
+        file_bytes (bytes): PDF file content.
+        filename (str): Original file name, shown in the prompt.
+
+        Returns:
+        tuple: (index, built) where built is False if it was reused.
+        """
+        sha256 = hashlib.sha256(file_bytes).hexdigest()
+        embedder = self.embedder
+        index_id = f"{sha256}:{embedder.name}:{self.chunk_chars}/{self.chunk_overlap}"
+        index = self._load(index_id)
+        if index is not None:
+            return index, False
+
+        chunks = chunk_text(extract_text_from_pdf_bytes(file_bytes), self.chunk_chars, self.chunk_overlap)
+        vectors = embedder.embed(chunks) if chunks else np.zeros((0, 1), dtype=np.float32)
+        index = DocumentIndex(index_id, filename, chunks, vectors)
+        mongo.db.document_indexes.replace_one(
+            {"_id": index_id}, index.to_document(sha256, embedder.name), upsert=True
+        )
+        self._cache(index)
+        return index, True
+
+    def session_indexes(self, session_id):
+        """
+        Loads the indexes of the documents linked to a session.
+
+        Args:
+        session_id (str): Session ObjectId, "1" for a new session.
+
+        Returns:
+        list: DocumentIndex objects.
+        """
+        if not session_id or not ObjectId.is_valid(session_id):
+            return []
+        session = mongo.db.sessions.find_one({"_id": ObjectId(session_id)}, {"documents": 1})
+        indexes = []
+        for link in (session or {}).get("documents", []):
+            index = self._load(link["index_id"])
+            if index is not None:
+                indexes.append(index)
+        return indexes
+
+    def retrieve(self, query, indexes, min_score=None):
+        """
+        Picks the top-k chunks for a query across several document indexes.
+
+        Args:
+        query (str): The user's message.
+        indexes (list): DocumentIndex objects to search.
+        min_score (float): Drop chunks scoring below this cosine similarity.
+
+        Returns:
+        tuple: (context, report) where context lists the chosen chunks per
+               document in document order, and report tells how many were used.
+        """
+        report = {"documents": len(indexes), "chunks": sum(len(i.chunks) for i in indexes), "chunks_used": 0}
+        if not report["chunks"]:
+            return "", report
+
+        query_vector = _normalize(self.embedder.embed([query])[0])
+        hits = []
+        for index in indexes:
+            if index.vectors.shape[1] != query_vector.shape[0]:
+                continue
+            hits.extend((score, position, index) for score, position in index.search(query_vector, self.top_k))
+        hits.sort(key=lambda hit: -hit[0])
+        hits = [hit for hit in hits[:self.top_k] if min_score is None or hit[0] >= min_score]
+        report["chunks_used"] = len(hits)
+
+        sections = []
+        for index in indexes:
+            positions = sorted(position for _, position, hit_index in hits if hit_index is index)
+            if positions:
+                excerpts = "\n...\n".join(index.chunks[p] for p in positions)
+                sections.append(f"[Relevant excerpts from {index.filename}]\n{excerpts}")
+        return "\n\n".join(sections), report
+
+    def pdf_context(self, query, session_id, file_bytes=None, filename=None):
+        """
+        Builds the document context of a chat message.
+
+        With an uploaded PDF the top-k chunks of that PDF are used. Without
+        one, the documents linked to the session are searched, and only
+        chunks scoring at least RAG_MIN_SCORE are kept.
+
+        Args:
+        query (str): The user's message.
+        session_id (str): The chat session.
+        file_bytes (bytes): Uploaded PDF content, if any.
+        filename (str): Uploaded PDF file name.
+
+        Returns:
+        tuple: (context, report, link) where link is the session document
+               entry to save for a new upload, else None.
+        """
+        if file_bytes is not None:
+            index, built = self.index_pdf(file_bytes, filename)
+            context, report = self.retrieve(query, [index])
+            report["index"] = "built" if built else "cached"
+            link = {"sha256": index.index_id.split(":", 1)[0], "filename": filename, "index_id": index.index_id}
+            return context, report, link
+
+        indexes = self.session_indexes(session_id)
+        if not indexes:
+            return "", None, None
+        context, report = self.retrieve(query, indexes, min_score=self.min_score)
+        return context, report, None
+
+
+document_retriever = DocumentRetriever()
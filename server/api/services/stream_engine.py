@@ -0,0 +1,924 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from datetime import datetime
+import httpx
+from api import gemini_models
+from api.config import Config
+from api.services.response_cache import response_cache
+from api.services.admission_services import admission, AdmissionRejected, QUEUE_FULL_ERROR
+from api.services.breaker_services import breakers, BackendUnavailable
+from api.services.ollama_services import ollama_pool, model_catalog
+from api.services.chat_store import (
+    save_exchanges, prepare_exchange, apply_exchanges, reserve_user_message, release_user_message,
+    SessionNotFound, LIMIT_REACHED_ERROR, SESSION_NOT_FOUND_ERROR
+)
+from api.services.persistence_services import write_behind
+from api.services.metrics_services import metrics, RequestTimings
+
+
+def encode_event(event):
+    """
+    Formats an event dict as a server-sent event frame.
+
+    Args:
+    event (dict): Event with a 'type' key (session_info, queued, chunk, complete, error).
+
+    Returns:
+    str: The SSE frame.
+    """
+    return f"data: {json.dumps(event)}\n\n"
+
+
+class EventStream:
+    """
+    Handle on a stream running on the engine loop.
+
+    It can be consumed with a plain `for` loop from a WSGI worker thread or
+    with `async for` from any other event loop (e.g. the ASGI server's).
+    """
+
+    def __init__(self, loop, agen):
+        self._loop = loop
+        self._agen = agen
+        self._finished = False
+
+    async def _anext(self):
+        return await self._agen.__anext__()
+
+    def _next(self):
+        # Step the generator from the engine loop, so that loop (not the caller's) finalizes it
+        return asyncio.run_coroutine_threadsafe(self._anext(), self._loop)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        try:
+            return self._next().result()
+        except StopAsyncIteration:
+            self._finished = True
+            raise StopIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._finished:
+            raise StopAsyncIteration
+        try:
+            return await asyncio.wrap_future(self._next())
+        except StopAsyncIteration:
+            self._finished = True
+            raise
+
+    async def _aclose(self):
+        try:
+            await self._agen.aclose()
+        except RuntimeError:
+            # A cancelled __anext__ is still unwinding, it finalizes the generator itself
+            pass
+
+    def close(self):
+        if not self._finished:
+            self._finished = True
+            asyncio.run_coroutine_threadsafe(self._aclose(), self._loop)
+
+
+class StreamEngine:
+    """
+    Runs chat streams as coroutines on one background asyncio loop.
+
+    Upstream I/O (Ollama over httpx, Gemini through its async API) is
+    multiplexed on that loop, so an open stream costs a coroutine rather
+    than a blocked thread.
+    """
+
+    def __init__(self):
+        self.max_connections = Config.STREAM_MAX_CONNECTIONS
+        self.pool_size = Config.OLLAMA_POOL_SIZE
+        self.connect_timeout = Config.OLLAMA_CONNECT_TIMEOUT
+        self.read_timeout = Config.OLLAMA_READ_TIMEOUT
+        self.ttft_timeout = Config.OLLAMA_TTFT_TIMEOUT
+        self.hedge_delay = Config.HEDGE_DELAY
+        self.coalesce_ms = Config.SSE_COALESCE_MS
+        self.coalesce_bytes = Config.SSE_COALESCE_BYTES
+        self.hedge_stats = {"requests": 0, "triggered": 0, "wins": {"local": 0, "cloud": 0}, "failed": 0}
+        self.stats = {"streams": 0, "completed": 0, "cancelled": 0, "interrupted_saved": 0,
+                      "chunks": 0, "chunk_frames": 0}
+        self._loop = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_connections = app.config.get("STREAM_MAX_CONNECTIONS", self.max_connections)
+        self.pool_size = app.config.get("OLLAMA_POOL_SIZE", self.pool_size)
+        self.connect_timeout = app.config.get("OLLAMA_CONNECT_TIMEOUT", self.connect_timeout)
+        self.read_timeout = app.config.get("OLLAMA_READ_TIMEOUT", self.read_timeout)
+        self.ttft_timeout = app.config.get("OLLAMA_TTFT_TIMEOUT", self.ttft_timeout)
+        self.hedge_delay = app.config.get("HEDGE_DELAY", self.hedge_delay)
+        self.coalesce_ms = app.config.get("SSE_COALESCE_MS", self.coalesce_ms)
+        self.coalesce_bytes = app.config.get("SSE_COALESCE_BYTES", self.coalesce_bytes)
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="stream-engine", daemon=True).start()
+            return self._loop
+
+    def _http_client(self):
+        # Only ever called from the engine loop, so the pool is bound to it
+        if self._client is None:
+            # No base URL: requests are addressed to the pool host picked for them
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=None),
+            )
+        return self._client
+
+    def open_stream(self, job):
+        """
+        Starts a chat stream on the engine loop.
+
+        Args:
+        job (dict): Prepared chat request (see chat_routes.prepare_stream_job).
+
+        Returns:
+        EventStream: Iterator over the stream's event dicts.
+        """
+        events = self.stream_events(job)
+        if self.coalesce_ms > 0:
+            events = self.coalesce(events)
+        return EventStream(self.loop, events)
+
+    def open_batch(self, jobs, user_id, concurrency, save):
+        """
+        Starts a batch of chat requests on the engine loop.
+
+        Args:
+        jobs (list): Prepared batch items (see chat_routes.prepare_batch_job).
+        user_id (str): Owner of the sessions the results are saved to.
+        concurrency (int): How many items run at once.
+        save (dict): Where results are saved (see batch_events).
+
+        Returns:
+        EventStream: Iterator over result dicts, then a summary dict.
+        """
+        return EventStream(self.loop, self.batch_events(jobs, user_id, concurrency, save))
+
+    async def coalesce(self, events):
+        """
+        Merges consecutive chunk events so a fast stream sends at most one
+        chunk frame per `coalesce_ms` window.
+
+        The events are read ahead by a task into a buffer. A chunk is sent
+        at once when no frame went out during the last window (so the first
+        token and slow streams are never delayed); otherwise the chunks that
+        arrive until the end of the window, or until `coalesce_bytes` of
+        text are buffered, go out as one frame. Other events are sent in
+        order, right after the chunks before them.
+
+        Args:
+        events (async generator): Events from stream_events().
+
+        Yields:
+        dict: The same events, with runs of chunks merged.
+        """
+        loop = asyncio.get_running_loop()
+        window = self.coalesce_ms / 1000
+        buffered = deque()
+        size = 0
+        wake = None
+
+        def notify():
+            if wake is not None and not wake.done():
+                wake.set_result(None)
+
+        async def read_ahead():
+            nonlocal size
+            try:
+                async for event in events:
+                    buffered.append(event)
+                    if event.get("type") == "chunk":
+                        self.stats["chunks"] += 1
+                        size += len(event["text"].encode("utf-8"))
+                        if size < self.coalesce_bytes and len(buffered) > 1:
+                            continue
+                    notify()
+            finally:
+                notify()
+
+        reader = asyncio.ensure_future(read_ahead())
+        last_sent = float("-inf")
+        try:
+            while buffered or not reader.done():
+                if not buffered:
+                    wake = loop.create_future()
+                    await wake
+                delay = last_sent + window - loop.time()
+                if delay > 0 and buffered[-1].get("type") == "chunk" and size < self.coalesce_bytes \
+                        and not reader.done():
+                    # Let the tokens of this window collect
+                    wake = loop.create_future()
+                    timer = loop.call_later(delay, notify)
+                    try:
+                        await wake
+                    finally:
+                        timer.cancel()
+                while buffered:
+                    if buffered[0].get("type") != "chunk":
+                        yield buffered.popleft()
+                        continue
+                    texts = []
+                    while buffered and buffered[0].get("type") == "chunk":
+                        texts.append(buffered.popleft()["text"])
+                    size = 0
+                    last_sent = loop.time()
+                    self.stats["chunk_frames"] += 1
+                    yield {"type": "chunk", "text": "".join(texts)}
+            # Re-raise an error of the stream, if any
+            await reader
+        finally:
+            if not reader.done():
+                # Cancelling the read closes the upstream streams (see stream_events)
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+            await events.aclose()
+
+    async def _before(self, deadline, awaitable):
+        if deadline is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(deadline - self.loop.time(), 0))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No first token from Ollama within {self.ttft_timeout:g}s")
+
+    async def _ollama_stream(self, payload, final=None):
+        # The last chunk (done=True) carries the context and eval stats, kept in `final`.
+        # Until the first token arrives the call is bounded by the TTFT deadline, so a
+        # hung or overloaded backend fails over in seconds rather than at the read timeout
+        host = ollama_pool.acquire(payload["model"])
+        stream = self._host_stream(host, payload, final)
+        try:
+            async for chunk_text in stream:
+                yield chunk_text
+        finally:
+            await stream.aclose()
+            ollama_pool.release(host)
+
+    async def _host_stream(self, host, payload, final):
+        breaker = breakers.get(host.url)
+        permit = breaker.allow()
+        if permit is None:
+            raise BackendUnavailable(f"Ollama at {host.url} is unavailable (circuit open)")
+        start = self.loop.time()
+        deadline = start + self.ttft_timeout if self.ttft_timeout else None
+        first_token_at = None
+        client = self._http_client()
+        try:
+            response = await self._before(
+                deadline, client.send(client.build_request("POST", f"{host.url}/api/generate", json=payload), stream=True)
+            )
+            try:
+                if response.status_code == 404:
+                    model_catalog.model_missing(payload["model"])
+                response.raise_for_status()
+                lines = response.aiter_lines()
+                while True:
+                    try:
+                        if first_token_at is None:
+                            line = await self._before(deadline, lines.__anext__())
+                        else:
+                            line = await lines.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    if not line:
+                        continue
+                    try:
+                        chunk_data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    chunk_text = chunk_data.get("response", "")
+                    if chunk_text:
+                        if first_token_at is None:
+                            first_token_at = self.loop.time()
+                        yield chunk_text
+                    if chunk_data.get("done", False):
+                        if final is not None:
+                            final.update(chunk_data)
+                        break
+            finally:
+                await response.aclose()
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.cancel(permit)
+            raise
+        except Exception as e:
+            breaker.record(permit, False, error=str(e) or type(e).__name__)
+            raise
+        breaker.record(permit, True, latency=(first_token_at or self.loop.time()) - start)
+
+    async def _wait_for_admission(self, ticket):
+        # Reports the queue position whenever it changes until a slot is free
+        last_position = None
+        while not ticket.done:
+            if admission.remaining(ticket) <= 0:
+                admission.expire(ticket)
+            position = admission.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield {"type": "queued", "position": position}
+            await ticket.wait_async(min(1.0, max(admission.remaining(ticket), 0.01)))
+        if ticket.rejected is not None:
+            raise AdmissionRejected(ticket.rejected)
+
+    async def _local_stream(self, job, final, cache_info):
+        # Yields reply text, plus "queued" event dicts while waiting for admission.
+        # Seeded requests go through the response cache: a hit is replayed, an
+        # identical request already generating is waited for, a miss is stored
+        key = job.get("cache_key")
+        status = None
+        if key:
+            status, found = response_cache.lookup(key)
+            if status == "wait":
+                try:
+                    # Shielded so that a disconnecting follower does not cancel the shared result
+                    found = await asyncio.shield(asyncio.wrap_future(found))
+                    status = "coalesced"
+                except Exception:
+                    status = None  # the other request failed, generate without the cache
+            cache_info["status"] = "miss" if status == "lead" else status or "bypass"
+            if status in ("hit", "coalesced"):
+                final.update(found["final"])
+                for chunk_text in found["chunks"]:
+                    yield chunk_text
+                return
+
+        chunks = []
+        completed = False
+        ticket = None
+        try:
+            if ollama_pool.rejects(job["model_name"]):
+                # Do not queue for backends that are known to be failing
+                raise BackendUnavailable("No Ollama host is available (circuits open)")
+            ticket = admission.enqueue(job["model_name"], job["user_key"], job["authenticated"])
+            async for event in self._wait_for_admission(ticket):
+                yield event
+            async with aclosing(self._ollama_stream(job["payload"], final)) as stream:
+                async for chunk_text in stream:
+                    chunks.append(chunk_text)
+                    yield chunk_text
+            if status == "lead":
+                response_cache.complete(key, chunks, dict(final))
+                completed = True
+        finally:
+            admission.release(ticket)
+            if status == "lead" and not completed:
+                response_cache.abort(key)
+
+    async def _gemini_stream(self, job):
+        # Use model with system instruction if provided
+        model = gemini_models.get(job["system_prompt"])
+        response = await model.generate_content_async(
+            job["combined_input"],
+            generation_config=job["generation_config"],
+            stream=True
+        )
+        chunks = response.__aiter__()
+        try:
+            async for chunk in chunks:
+                chunk_text = chunk.text if chunk.text else ""
+                if chunk_text:
+                    yield chunk_text
+        finally:
+            # Closing the response stream stops the generation when the reader leaves early
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def _pump(self, name, agen, queue):
+        # Forwards one backend's output to the shared race queue
+        try:
+            async for item in agen:
+                await queue.put((name, "item", item))
+            await queue.put((name, "done", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put((name, "error", e))
+        finally:
+            await agen.aclose()
+
+    async def _hedged_stream(self, job, final, cache_info, outcome):
+        """
+        Races the local model against Gemini.
+
+        The local generation starts first; if it has not produced a token
+        after `hedge_delay` seconds (or fails), Gemini is started too. The
+        first backend to produce a token wins and the other is cancelled.
+        The winner ("local" or "cloud") is stored in outcome["winner"].
+
+        Yields:
+        str | dict: Reply text of the winner, and queued events of the local request.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        tasks = {"local": asyncio.ensure_future(self._pump("local", self._local_stream(job, final, cache_info), queue))}
+        hedge_at = loop.time() + self.hedge_delay
+        winner = None
+        errors = {}
+        self.hedge_stats["requests"] += 1
+
+        def start_cloud():
+            tasks["cloud"] = asyncio.ensure_future(self._pump("cloud", self._gemini_stream(job), queue))
+            outcome["cloud_tried"] = True
+            self.hedge_stats["triggered"] += 1
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and "cloud" not in tasks:
+                    timeout = max(hedge_at - loop.time(), 0)
+                try:
+                    name, kind, item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    start_cloud()
+                    continue
+                if winner is not None and name != winner:
+                    continue
+                if kind == "item":
+                    if isinstance(item, dict):
+                        if winner is None:
+                            yield item
+                        continue
+                    if winner is None:
+                        winner = outcome["winner"] = name
+                        self.hedge_stats["wins"][name] += 1
+                        for other, task in tasks.items():
+                            if other != name:
+                                task.cancel()
+                    yield item
+                elif kind == "done":
+                    if winner is None:
+                        # Finished without any text; still the first to answer
+                        winner = outcome["winner"] = name
+                        self.hedge_stats["wins"][name] += 1
+                        for other, task in tasks.items():
+                            if other != name:
+                                task.cancel()
+                    return
+                else:
+                    if winner is not None:
+                        raise item
+                    errors[name] = item
+                    if name == "local" and "cloud" not in tasks:
+                        start_cloud()
+                    elif len(errors) == len(tasks):
+                        self.hedge_stats["failed"] += 1
+                        raise errors.get("local", item)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Wait until the losing and abandoned streams have closed their connections
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def hedged_reply(self, job):
+        """
+        Runs a hedged generation to completion, for non-streaming requests.
+
+        Returns:
+        tuple: (reply text, winner, Ollama's final chunk).
+        """
+        final, outcome, reply = {}, {}, ""
+        async for item in self._hedged_stream(job, final, {}, outcome):
+            if not isinstance(item, dict):
+                reply += item
+        return reply, outcome.get("winner"), final
+
+    def hedge_snapshot(self):
+        """
+        Reports how often hedging kicked in and which backend won.
+        """
+        stats = self.hedge_stats
+        decided = sum(stats["wins"].values())
+        return {
+            "delay": self.hedge_delay,
+            **stats,
+            "wins": dict(stats["wins"]),
+            "win_rate": {name: round(wins / decided, 3) if decided else None for name, wins in stats["wins"].items()},
+            "trigger_rate": round(stats["triggered"] / stats["requests"], 3) if stats["requests"] else None,
+        }
+
+    def run(self, coro, timeout=None):
+        """
+        Runs a coroutine on the engine loop and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def _reply(self, job):
+        # Generates one batch item to completion, with the same fallback as /chat
+        start = self.loop.time()
+        timings = RequestTimings()
+        final, cache_info, outcome = {}, {}, {}
+        result = {"type": "result", "index": job["index"], "id": job["item_id"],
+                  "model_name": job["model_name"], "fallback_used": False}
+        reply = ""
+        try:
+            if job["model_type"] == "local":
+                if job.get("hedge") and gemini_models.enabled:
+                    source = self._hedged_stream(job, final, cache_info, outcome)
+                else:
+                    source = self._local_stream(job, final, cache_info)
+                try:
+                    async with aclosing(source):
+                        async for chunk_text in source:
+                            if not isinstance(chunk_text, dict):
+                                reply += chunk_text
+                except AdmissionRejected:
+                    raise
+                except Exception:
+                    if not gemini_models.enabled or outcome.get("cloud_tried"):
+                        raise
+                    reply = ""
+                    outcome["winner"] = "cloud"
+                    async with aclosing(self._gemini_stream(job)) as stream:
+                        async for chunk_text in stream:
+                            reply += chunk_text
+                if outcome.get("winner") == "cloud":
+                    result.update(model_name="gemini", fallback_used=True)
+            elif job["model_name"] == "gemini":
+                async with aclosing(self._gemini_stream(job)) as stream:
+                    async for chunk_text in stream:
+                        reply += chunk_text
+            else:
+                raise ValueError(f"Unknown model {job['model_name']!r}")
+        except AdmissionRejected as e:
+            result.update(error=QUEUE_FULL_ERROR, queue_full=True, reason=e.reason)
+        except Exception as e:
+            result["error"] = str(e) or type(e).__name__
+        if "error" not in result:
+            result["response"] = reply
+        if cache_info.get("status"):
+            result["cached"] = cache_info["status"]
+        result["latency"] = int((self.loop.time() - start) * 1000)
+        if "error" not in result:
+            backend = "gemini" if result["model_name"] == "gemini" else "ollama"
+            if cache_info.get("status") in ("hit", "coalesced"):
+                backend = "cache"
+            timings.add("inference", timings.elapsed())
+            metrics.record_ollama(final, result["model_name"], backend)
+            metrics.record_request("batch", timings, result["model_name"], backend)
+        return result
+
+    async def batch_events(self, jobs, user_id, concurrency, save):
+        """
+        Runs batch items with bounded concurrency and yields their results as
+        they complete.
+
+        Successful results are saved in groups: everything that finished
+        while the previous bulk write was running goes into the next one.
+        `save` is {"mode": ...} with mode "none", "single_session" (one new
+        session, named save["session_name"], holds every exchange),
+        "session" (appended to save["session_id"], within its message
+        limit save["message_limit"]) or "sessions" (a new session per item).
+
+        Yields:
+        dict: One result per item (with its index, in completion order),
+              then a summary.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        finished = asyncio.Queue()
+        start = self.loop.time()
+        counts = {"succeeded": 0, "failed": 0, "saved": 0}
+        mode = save["mode"]
+        target = save.get("session_id") if mode == "session" else "1"
+
+        async def run(job):
+            async with semaphore:
+                result = await self._reply(job)
+            result["timestamp"] = datetime.now()
+            finished.put_nowait((job, result))
+
+        tasks = [asyncio.ensure_future(run(job)) for job in jobs]
+        try:
+            remaining = len(jobs)
+            while remaining:
+                group = [await finished.get()]
+                while not finished.empty():
+                    group.append(finished.get_nowait())
+                remaining -= len(group)
+
+                succeeded = [(job, result) for job, result in group if "error" not in result]
+                if mode != "none" and succeeded:
+                    exchanges = [
+                        (job["session_name"], [
+                            {"role": "user", "content": job["user_msg"], "timestamp": job["user_timestamp"]},
+                            {"role": "bot", "content": result["response"], "timestamp": result["timestamp"],
+                             "model_name": result["model_name"]},
+                        ])
+                        for job, result in succeeded
+                    ]
+                    try:
+                        if mode == "sessions":
+                            session_ids = await asyncio.to_thread(save_exchanges, exchanges, user_id)
+                            reasons = [None] * len(session_ids)
+                        else:
+                            # Into one session: the first write of a single_session batch creates it
+                            writes, session_id = [], target
+                            for _, messages in exchanges:
+                                writes.append(prepare_exchange(
+                                    session_id, save.get("session_name"), user_id, messages,
+                                    max_user_messages=save.get("message_limit")))
+                                session_id = writes[-1]["session_id"]
+                            rejected = {w["write_id"]: w["rejected"]
+                                        for w in await asyncio.to_thread(apply_exchanges, writes)}
+                            target = session_id
+                            session_ids = [None if w["write_id"] in rejected else w["session_id"] for w in writes]
+                            reasons = [rejected.get(w["write_id"]) for w in writes]
+                        for (_, result), session_id, reason in zip(succeeded, session_ids, reasons):
+                            if session_id is None:
+                                result["save_error"] = self._rejected_event(reason)["message"]
+                            else:
+                                result["session_id"] = session_id
+                                counts["saved"] += 1
+                    except Exception as e:
+                        print(f"Could not save batch results: {e}")
+                        for _, result in succeeded:
+                            result["save_error"] = str(e)
+
+                counts["succeeded"] += len(succeeded)
+                counts["failed"] += len(group) - len(succeeded)
+                for _, result in group:
+                    result["timestamp"] = result["timestamp"].isoformat()
+                    yield result
+
+            yield {"type": "summary", "items": len(jobs), **counts,
+                   "latency": int((self.loop.time() - start) * 1000)}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _persist(self, write):
+        # Hands the write to the write-behind queue, or applies it here when the queue is off or full;
+        # returns why the write was rejected, None once it is saved or queued
+        if write_behind.submit(write):
+            return None
+        rejected = await asyncio.to_thread(apply_exchanges, [write])
+        return rejected[0]["rejected"] if rejected else None
+
+    def _rejected_event(self, reason):
+        if reason == "session_not_found":
+            return {"type": "error", "message": SESSION_NOT_FOUND_ERROR, "session_not_found": True}
+        return {"type": "error", "message": LIMIT_REACHED_ERROR, "limit_reached": True}
+
+    @staticmethod
+    def _reserves(job):
+        # Existing sessions count the user message before generating; new ones start at zero
+        return job["session_id"] != "1" and job.get("message_limit") is not None
+
+    async def _reserve(self, job):
+        # Takes the session's next user message slot, once its queued writes are applied;
+        # returns why it could not, None on success
+        def reserve():
+            write_behind.wait_for(session_id=job["session_id"])
+            try:
+                return None if reserve_user_message(job["session_id"], job["message_limit"]) else "limit_reached"
+            except SessionNotFound:
+                return "session_not_found"
+        return await asyncio.to_thread(reserve)
+
+    async def _release(self, job):
+        # Gives the slot back when the request ends without saving anything
+        if not self._reserves(job):
+            return
+        try:
+            await asyncio.to_thread(release_user_message, job["session_id"])
+        except Exception as e:
+            print(f"Could not release the message slot of {job['session_id']}: {e}")
+
+    async def _save_interrupted(self, job, bot_reply, reply_model):
+        # Keeps the part of a reply that was streamed before the client went away
+        if not bot_reply.strip():
+            await self._release(job)
+            return
+        messages = [
+            {"role": "user", "content": job["user_msg"], "timestamp": job["user_timestamp"]},
+            {"role": "bot", "content": bot_reply, "timestamp": datetime.now(), "model_name": reply_model,
+             "interrupted": True}
+        ]
+        write = prepare_exchange(job["session_id"], job["session_name"], job["user_id"], messages,
+                                 max_user_messages=job["message_limit"], documents=job.get("documents"),
+                                 reserved=self._reserves(job))
+        try:
+            if await self._persist(write) is None:
+                self.stats["interrupted_saved"] += 1
+        except Exception as e:
+            print(f"Could not save interrupted reply for {job['session_id']}: {e}")
+
+    async def stream_events(self, job):
+        """
+        Generates the SSE events of one chat request and saves the exchange
+        (through the write-behind queue, so "complete" is sent right away; an
+        exchange the queue cannot save is kept in `failed_writes` and listed
+        with the session's messages).
+
+        The session's message limit is checked (and the user message
+        counted) before anything is generated, so a reply is never streamed
+        that could not be saved. If the client disconnects, the upstream
+        streams are closed at once and the partial reply is saved with
+        "interrupted": True.
+
+        Args:
+        job (dict): Prepared chat request.
+
+        Yields:
+        dict: session_info, queued, chunk, error and complete events.
+        """
+        bot_reply = ""
+        start_time = datetime.now()
+        ollama_final = {}
+        cache_info = {}
+        outcome = {}
+        reply_model = job["model_name"]
+        backend = "gemini" if job["model_type"] != "local" else "ollama"
+        fallback_used = False
+        timings = job.get("timings")
+        inference_start = time.perf_counter()
+        first_token_at = None
+        self.stats["streams"] += 1
+
+        def on_token():
+            nonlocal first_token_at
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+
+        if self._reserves(job):
+            reason = await self._reserve(job)
+            if reason:
+                yield self._rejected_event(reason)
+                return
+
+        # Send session info first
+        session_info = {"type": "session_info", "session_id": job["session_id"]}
+        if job.get("mention_context"):
+            session_info["mention_context"] = job["mention_context"]
+        if job.get("document_context"):
+            session_info["document_context"] = job["document_context"]
+
+        try:
+            yield session_info
+            if job["model_type"] == "local":
+                if job.get("hedge") and gemini_models.enabled:
+                    source = self._hedged_stream(job, ollama_final, cache_info, outcome)
+                else:
+                    source = self._local_stream(job, ollama_final, cache_info)
+                try:
+                    async with aclosing(source):
+                        async for chunk_text in source:
+                            if isinstance(chunk_text, dict):
+                                yield chunk_text
+                                continue
+                            on_token()
+                            bot_reply += chunk_text
+                            yield {"type": "chunk", "text": chunk_text}
+                except AdmissionRejected as e:
+                    # Shed load instead of piling the request onto Gemini
+                    await self._release(job)
+                    yield {"type": "error", "message": QUEUE_FULL_ERROR, "queue_full": True, "reason": e.reason}
+                    return
+                except Exception as e:
+                    # Fallback to gemini streaming (a hedged request has already tried it)
+                    if gemini_models.enabled and not outcome.get("cloud_tried"):
+                        # Background /chat jobs reply like /chat: without the notice
+                        if job.get("fallback_notice", True):
+                            fallback_msg = f"[Local model failed, switching to gemini: {str(e)}]\n"
+                            bot_reply += fallback_msg
+                            yield {"type": "chunk", "text": fallback_msg}
+                        fallback_used = True
+                        reply_model = backend = "gemini"
+                        try:
+                            async with aclosing(self._gemini_stream(job)) as stream:
+                                async for chunk_text in stream:
+                                    on_token()
+                                    bot_reply += chunk_text
+                                    yield {"type": "chunk", "text": chunk_text}
+                        except Exception as ge:
+                            err_txt = f"[Fallback gemini error: {str(ge)}]"
+                            bot_reply += err_txt
+                            yield {"type": "error", "message": err_txt}
+                    else:
+                        err_txt = f"[Local model error and no fallback: {str(e)}]"
+                        if outcome.get("cloud_tried"):
+                            err_txt = f"[Local and gemini both failed: {str(e)}]"
+                        bot_reply += err_txt
+                        yield {"type": "error", "message": err_txt}
+
+            elif job["model_name"] == "gemini":  # Cloud model (Gemini)
+                async with aclosing(self._gemini_stream(job)) as stream:
+                    async for chunk_text in stream:
+                        on_token()
+                        bot_reply += chunk_text
+                        yield {"type": "chunk", "text": chunk_text}
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # Client disconnected: the upstream streams were closed on the way out
+            self.stats["cancelled"] += 1
+            await self._save_interrupted(job, bot_reply, "gemini" if outcome.get("winner") == "cloud" else reply_model)
+            raise
+        except Exception as e:
+            error_msg = f"Error: {str(e)}"
+            bot_reply = error_msg
+            yield {"type": "error", "message": error_msg}
+
+        if outcome.get("winner") == "cloud":
+            reply_model = backend = "gemini"
+            fallback_used = True
+        elif cache_info.get("status") in ("hit", "coalesced"):
+            backend = "cache"
+
+        # Calculate latency
+        end_time = datetime.now()
+        latency_ms = int((end_time - start_time).total_seconds() * 1000)
+        if timings is not None:
+            timings.add("inference", time.perf_counter() - inference_start)
+            if first_token_at is not None:
+                metrics.record_ttft(first_token_at - timings.started, reply_model, backend)
+        metrics.record_ollama(ollama_final, reply_model, backend)
+
+        # Save to database only if we have some content
+        if bot_reply.strip():
+            messages = [
+                {"role": "user", "content": job["user_msg"], "timestamp": job["user_timestamp"]},
+                {"role": "bot", "content": bot_reply, "timestamp": end_time, "model_name": reply_model}
+            ]
+            model_context = None
+            if ollama_final.get("context") and job.get("reuse_context") and reply_model != "gemini":
+                model_context = (job["payload"], ollama_final["context"])
+            # The session id is assigned up front, so completion does not wait for the write
+            write = prepare_exchange(job["session_id"], job["session_name"], job["user_id"], messages,
+                                     max_user_messages=job["message_limit"], documents=job.get("documents"),
+                                     model_context=model_context, reserved=self._reserves(job))
+            persist_start = time.perf_counter()
+            try:
+                rejected = await self._persist(write)
+            except Exception as e:
+                print(f"Could not save the reply for {job['session_id']}: {e}")
+                await self._release(job)
+                yield {"type": "error", "message": f"Could not save the reply: {e}", "save_failed": True}
+                return
+            if timings is not None:
+                timings.add("persistence", time.perf_counter() - persist_start)
+            metrics.record_request(job.get("endpoint", "stream"), timings, reply_model, backend)
+            if rejected:
+                yield self._rejected_event(rejected)
+                return
+            final_session_id = write["session_id"]
+
+            # Send completion message
+            complete = {"type": "complete", "session_id": final_session_id,
+                        "timestamp": end_time.isoformat(), "latency": latency_ms,
+                        "model_name": reply_model, "fallback_used": fallback_used}
+            if cache_info.get("status"):
+                complete["cached"] = cache_info["status"]
+            if outcome:
+                complete["hedged"] = outcome.get("cloud_tried", False)
+            self.stats["completed"] += 1
+            yield complete
+        else:
+            metrics.record_request(job.get("endpoint", "stream"), timings, reply_model, backend)
+            await self._release(job)
+
+
+stream_engine = StreamEngine()
+
+
+def iter_ndjson(stream):
+    """
+    Encodes an EventStream as newline-delimited JSON for a WSGI response.
+
+    Closing the response (client disconnect) closes the stream.
+    """
+    try:
+        for event in stream:
+            yield json.dumps(event) + "\n"
+    finally:
+        stream.close()
+
+
+def iter_sse(stream):
+    """
+    Encodes an EventStream as SSE frames for a WSGI response.
+
+    Closing the response (client disconnect) closes the stream.
+    """
+    try:
+        for event in stream:
+            yield encode_event(event)
+    finally:
+        stream.close()
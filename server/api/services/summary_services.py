@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING
+from api import mongo, gemini_models
+from api.config import Config
+from api.services.admission_services import admission
+from api.services.breaker_services import BackendUnavailable
+from api.services.ollama_services import ollama_pool, call_ollama
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a chat between a user and an assistant. "
+    "Merge the previous summary with the new messages into one concise summary "
+    "(at most 200 words) that keeps names, facts, decisions and open questions."
+)
+
+
+class SessionSummarizer:
+    """
+    Keeps an incrementally updated summary on each chat session.
+
+    After every `refresh_every` new messages a background job folds them into
+    the stored summary using the configured model, so the cost of
+    summarizing is paid once per session instead of once per @-mention.
+    By default that is the session's own model: a session that ever used
+    a local model is summarized by its latest local model (through the
+    admission queue and circuit breaker, as a guest), and only sessions
+    held with Gemini alone are summarized by Gemini. A failed refresh is
+    retried after a backoff that doubles with each failure.
+    """
+
+    def __init__(self):
+        self.refresh_every = Config.SUMMARY_REFRESH_EVERY
+        self.model_type = Config.SUMMARY_MODEL_TYPE
+        self.model_name = Config.SUMMARY_MODEL_NAME
+        self.max_input_chars = Config.SUMMARY_MAX_INPUT_CHARS
+        self.retry_backoff = Config.SUMMARY_RETRY_BACKOFF
+        self.claim_timeout = timedelta(minutes=10)
+        self._executor = ThreadPoolExecutor(max_workers=Config.SUMMARY_WORKERS, thread_name_prefix="summary")
+
+    def init_app(self, app):
+        self.refresh_every = app.config.get("SUMMARY_REFRESH_EVERY", self.refresh_every)
+        self.model_type = app.config.get("SUMMARY_MODEL_TYPE", self.model_type)
+        self.model_name = app.config.get("SUMMARY_MODEL_NAME", self.model_name)
+        self.max_input_chars = app.config.get("SUMMARY_MAX_INPUT_CHARS", self.max_input_chars)
+        self.retry_backoff = app.config.get("SUMMARY_RETRY_BACKOFF", self.retry_backoff)
+
+    def is_fresh(self, session):
+        """
+        Tells whether a session's summary lags less than one refresh window.
+
+        Args:
+        session (dict): Session document with the summary fields.
+        """
+        if not self.refresh_every or not session.get("summary"):
+            return False
+        lag = session.get("message_count", 0) - session.get("summary_message_count", 0)
+        return lag < self.refresh_every
+
+    def maybe_schedule(self, session_oid):
+        """
+        Claims and schedules a summary refresh if enough new messages arrived.
+
+        The claim is a single conditional update, so only one refresh per
+        session runs at a time.
+
+        Args:
+        session_oid (ObjectId): The session that just received messages.
+        """
+        if not self.refresh_every:
+            return
+        now = datetime.now()
+        claimed = mongo.db.sessions.update_one(
+            {
+                "_id": session_oid,
+                "$expr": {"$gte": [
+                    {"$subtract": ["$message_count", {"$ifNull": ["$summary_message_count", 0]}]},
+                    self.refresh_every,
+                ]},
+                "$or": [
+                    {"summary_claimed_at": None},
+                    {"summary_claimed_at": {"$lt": now - self.claim_timeout}},
+                ],
+                # Not while a failed refresh is backing off
+                "$and": [{"$or": [
+                    {"summary_retry_at": None},
+                    {"summary_retry_at": {"$lte": now}},
+                ]}],
+            },
+            {"$set": {"summary_claimed_at": now}}
+        )
+        if claimed.modified_count:
+            self._executor.submit(self._refresh, session_oid)
+
+    def _pick_model(self, session, messages):
+        """
+        Picks the model that summarizes a session.
+
+        Args:
+        session (dict): Session document with its summary_model.
+        messages (list): The new messages, oldest first.
+
+        Returns:
+        str: A local model name, "gemini", or None if there is none to use.
+        """
+        if self.model_type == "local":
+            return self.model_name or None
+        if self.model_type == "cloud":
+            return "gemini"
+        # The session's own model: a local one if it ever used one, so its chats stay local
+        local = [m["model_name"] for m in messages if m.get("model_name") and m["model_name"] != "gemini"]
+        if local:
+            return local[-1]
+        if session.get("summary_model") and session["summary_model"] != "gemini":
+            return session["summary_model"]
+        return "gemini"
+
+    def _generate(self, model, prompt):
+        if model != "gemini":
+            payload = {"model": model, "prompt": prompt, "system": SUMMARY_INSTRUCTION, "stream": False}
+            if ollama_pool.rejects(model):
+                raise BackendUnavailable("No Ollama host is available (circuits open)")
+            # Queued like a guest request, so summaries never get ahead of users
+            with admission.slot(model, "summarizer", False):
+                res = call_ollama(payload)
+            res.raise_for_status()
+            return res.json().get("response", "")
+        return gemini_models.get(SUMMARY_INSTRUCTION).generate_content(prompt).text
+
+    def _refresh(self, session_oid):
+        session = None
+        try:
+            session = mongo.db.sessions.find_one(
+                {"_id": session_oid},
+                {"summary": 1, "summary_message_count": 1, "summary_last_message_id": 1, "summary_model": 1,
+                 "summary_failures": 1}
+            )
+            if not session:
+                return
+            query = {"session_id": session_oid}
+            if session.get("summary_last_message_id"):
+                query["_id"] = {"$gt": session["summary_last_message_id"]}
+            messages = list(mongo.db.messages.find(query, {"role": 1, "content": 1, "model_name": 1})
+                            .sort("_id", ASCENDING))
+            if not messages:
+                return
+            model = self._pick_model(session, messages)
+            if model is None:
+                return
+
+            # Keep the newest part of the new messages if they exceed the input budget
+            transcript = "".join(f"{m['role']}: {m['content']}\n" for m in messages)[-self.max_input_chars:]
+            prompt = (
+                f"Previous summary:\n{session.get('summary') or '(none)'}\n\n"
+                f"New messages:\n{transcript}\n"
+                f"Updated summary:"
+            )
+            summary = self._generate(model, prompt).strip()
+            if summary:
+                mongo.db.sessions.update_one(
+                    {"_id": session_oid},
+                    {"$set": {
+                        "summary": summary,
+                        "summary_model": model,
+                        "summary_message_count": session.get("summary_message_count", 0) + len(messages),
+                        "summary_last_message_id": messages[-1]["_id"],
+                        "summary_updated_at": datetime.now(),
+                    }, "$unset": {"summary_retry_at": "", "summary_failures": ""}}
+                )
+        except Exception as e:
+            print(f"Summary refresh failed for {session_oid}: {e}")
+            failures = (session or {}).get("summary_failures", 0) + 1
+            delay = min(self.retry_backoff * 2 ** (failures - 1), 3600)
+            mongo.db.sessions.update_one(
+                {"_id": session_oid},
+                {"$set": {"summary_failures": failures,
+                          "summary_retry_at": datetime.now() + timedelta(seconds=delay)}}
+            )
+        finally:
+            mongo.db.sessions.update_one({"_id": session_oid}, {"$unset": {"summary_claimed_at": ""}})
+
+
+summarizer = SessionSummarizer()
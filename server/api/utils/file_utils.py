@@ -1,7 +1,20 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import fitz
+from api.config import Config
 # Allowed image extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'mp4', 'pdf', 'mp3'}
 
+# Extracted text of recently seen PDFs, keyed by content hash and limits
+_pdf_text_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+_pdf_pool = None
+_pdf_workers = 0
+
 
 def allowed_file(filename):
     """
@@ -15,20 +28,106 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text_from_pdf_bytes(file_bytes: bytes) -> str:
+def iter_pdf_pages(file_bytes: bytes, start: int = 0, stop: int = None):
+    """
+    Yields the text of PDF pages one at a time.
+
+    Args:
+    file_bytes (bytes): PDF file content.
+    start (int): Index of the first page.
+    stop (int): Index after the last page, defaults to the end of the document.
+
+    Yields:
+    str: Plain text of each page.
+    """
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        for page in doc.pages(start, min(stop, doc.page_count) if stop is not None else None):
+            yield page.get_text()
+
+def _extract_page_range(file_bytes, start, stop):
+    # Runs in a worker process
+    return list(iter_pdf_pages(file_bytes, start, stop))
+
+def _get_pdf_pool():
+    global _pdf_pool, _pdf_workers
+    if _pdf_pool is None:
+        _pdf_workers = Config.PDF_WORKERS or os.cpu_count() or 1
+        # spawn: forking a process that already runs threads is not safe.
+        # Spawned workers re-import the main module as __mp_main__, which
+        # api/app.py guards so that they never create the app
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=_pdf_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+def _iter_pages_parallel(file_bytes, page_count):
+    pool = _get_pdf_pool()
+    workers = _pdf_workers
+    step = max(Config.PDF_PARALLEL_MIN_PAGES // 2, -(-page_count // workers))
+    futures = [
+        pool.submit(_extract_page_range, file_bytes, start, min(start + step, page_count))
+        for start in range(0, page_count, step)
+    ]
+    try:
+        # Ranges are consumed in order, so a char cutoff can drop the remaining ones
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def extract_text_from_pdf_bytes(file_bytes: bytes, max_pages: int = None, max_chars: int = None) -> str:
     """
     Extracts text content from PDF file bytes.
 
+    Extraction stops after `max_pages` pages or `max_chars` characters.
+    Large documents are split into page ranges extracted in a process
+    pool, and results are cached by the sha256 of the file so re-uploading
+    the same PDF costs nothing.
+
     Args:
     file_bytes (bytes): PDF file content.
+    max_pages (int): Page cutoff, defaults to PDF_MAX_PAGES (0 = no limit).
+    max_chars (int): Character cutoff, defaults to PDF_MAX_CHARS (0 = no limit).
 
     Returns:
     str: Extracted plain text from PDF.
     """
+    max_pages = Config.PDF_MAX_PAGES if max_pages is None else max_pages
+    max_chars = Config.PDF_MAX_CHARS if max_chars is None else max_chars
+
+    key = (hashlib.sha256(file_bytes).hexdigest(), max_pages, max_chars)
+    with _pdf_cache_lock:
+        if key in _pdf_text_cache:
+            _pdf_text_cache.move_to_end(key)
+            return _pdf_text_cache[key]
 
-    text = ""
     with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-            text += "\n\n"
-    return text.strip()
\ No newline at end of file
+        page_count = doc.page_count
+    if max_pages:
+        page_count = min(page_count, max_pages)
+
+    if Config.PDF_PARALLEL_MIN_PAGES and page_count >= Config.PDF_PARALLEL_MIN_PAGES:
+        pages = _iter_pages_parallel(file_bytes, page_count)
+    else:
+        pages = iter_pdf_pages(file_bytes, 0, page_count)
+
+    parts = []
+    length = 0
+    for page_text in pages:
+        parts.append(page_text)
+        length += len(page_text) + 2
+        if max_chars and length >= max_chars:
+            break
+    pages.close()
+
+    text = "\n\n".join(parts).strip()
+    if max_chars:
+        text = text[:max_chars]
+
+    with _pdf_cache_lock:
+        _pdf_text_cache[key] = text
+        while len(_pdf_text_cache) > Config.PDF_CACHE_SIZE:
+            _pdf_text_cache.popitem(last=False)
+    return text
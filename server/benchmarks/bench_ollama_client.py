@@ -0,0 +1,52 @@
+"""
+Measures per-request overhead of the pooled OllamaClient against plain
+requests.get/post calls that open a new connection every time.
+
+Usage:
+    python benchmarks/bench_ollama_client.py --requests 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.services.ollama_services import OllamaClient
+from benchmarks.stub_ollama import StubOllamaServer
+
+
+def run(label, call, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        call()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:9.0f} req/s   {elapsed / count * 1e6:8.1f} us/req")
+    return elapsed / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    server = StubOllamaServer().start()
+    client = OllamaClient(base_url=server.url)
+    payload = {"model": "stub:latest", "prompt": "hi", "stream": False}
+    try:
+        cold = run("requests.post (no pool)",
+                   lambda: requests.post(f"{server.url}/api/generate", json=payload, timeout=60).json(),
+                   args.requests)
+        warm = run("OllamaClient.generate",
+                   lambda: client.generate(payload).json(),
+                   args.requests)
+        run("requests.get /api/tags", lambda: requests.get(f"{server.url}/api/tags", timeout=5).json(), args.requests)
+        run("OllamaClient.get /api/tags", lambda: client.get("/api/tags", timeout=5).json(), args.requests)
+        print(f"\nPooled client saves {(cold - warm) * 1e6:.1f} us per generate call ({cold / warm:.2f}x)")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
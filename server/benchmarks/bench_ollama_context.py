@@ -0,0 +1,95 @@
+"""
+Time to first token over multi-turn local chats, with and without reuse of
+the context Ollama returns.
+
+Without context reuse a client has to resend the conversation so far with
+every message, and the model prefills all of it again. With reuse only the
+new message is prefilled. The stub Ollama server charges a fixed prefill
+cost per prompt word to make that visible.
+
+Requires mongomock as an in-memory MongoDB (pip install mongomock).
+
+Usage:
+    python benchmarks/bench_ollama_context.py --turns 8 --prefill-ms 2
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.memory_mongo import memory_db
+from benchmarks.stub_ollama import StubOllamaServer
+
+QUESTION = "Please explain the next step of the deployment plan in a little more detail, including risks. "
+
+
+def run_session(client, turns, reuse):
+    session_id = "1"
+    transcript = ""
+    ttfts = []
+    for turn in range(turns):
+        message = f"{QUESTION}(turn {turn})"
+        sent = f"{transcript}\nuser: {message}" if not reuse else message
+        start = time.perf_counter()
+        first = None
+        reply = ""
+        response = client.post("/chat/stream", data={
+            "message": sent, "model_type": "local", "model_name": "stub:latest", "session_id": session_id,
+        })
+        for frame in response.response:
+            frame = frame.decode() if isinstance(frame, bytes) else frame
+            event = json.loads(frame[len("data: "):])
+            if event["type"] == "chunk":
+                if first is None:
+                    first = time.perf_counter() - start
+                reply += event["text"]
+            elif event["type"] == "complete":
+                session_id = event["session_id"]
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+        ttfts.append(first)
+        transcript += f"\nuser: {message}\nassistant: {reply}"
+    return ttfts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--prefill-ms", type=float, default=2.0, help="stub prefill cost per prompt word")
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(tokens=[f"w{i} " for i in range(60)], prefill_per_token=args.prefill_ms / 1000).start()
+    os.environ["OLLAMA_BASE_URL"] = stub.url
+    from api import create_app, mongo
+    from api.services.summary_services import summarizer
+
+    app = create_app()
+    app.config["MAX_MESSAGES_PER_SESSION"] = args.turns + 1
+    summarizer.refresh_every = 0
+    mongo.db = memory_db()
+    client = app.test_client()
+    # Warm up the engine loop, connection pool and indexes
+    run_session(client, 1, True)
+
+    results = {}
+    for label, reuse in (("history re-sent", False), ("context reused", True)):
+        app.config["OLLAMA_REUSE_CONTEXT"] = reuse
+        stub.stats["prefill_tokens"] = 0
+        per_turn = list(zip(*(run_session(client, args.turns, reuse) for _ in range(args.sessions))))
+        results[label] = [statistics.mean(values) for values in per_turn]
+        print(f"{label:<16} prefilled {stub.stats['prefill_tokens']:>7} words")
+    stub.stop()
+
+    print(f"\n{'turn':>4} " + " ".join(f"{label:>16}" for label in results) + "   TTFT (ms)")
+    for turn in range(args.turns):
+        print(f"{turn + 1:>4} " + " ".join(f"{results[label][turn] * 1000:>16.1f}" for label in results))
+    means = {label: statistics.mean(values) * 1000 for label, values in results.items()}
+    print(f"{'mean':>4} " + " ".join(f"{means[label]:>16.1f}" for label in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Throughput of local chats against one Ollama host versus a pool of hosts.
+
+Every stub host charges `--load-ms` the first time it serves a model. The
+pool keeps sending a model to the hosts that already loaded it and only
+spills over to another host while those are busy, so the number of loads
+stays well below one per request. Admission control allows
+ADMISSION_MAX_CONCURRENT requests per model and host, so the pool admits
+more requests at once.
+
+Requires mongomock as an in-memory MongoDB (pip install mongomock).
+
+Usage:
+    python benchmarks/bench_ollama_pool.py --hosts 3 --requests 120 --concurrency 24
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.memory_mongo import memory_db
+from benchmarks.stub_ollama import StubOllamaServer
+
+MODELS = ["llama3:8b", "phi3:mini", "gemma3:1b"]
+
+
+def chat(client, model):
+    response = client.post("/chat/stream", data={"message": "hello there", "model_type": "local", "model_name": model})
+    for frame in response.response:
+        frame = frame.decode() if isinstance(frame, bytes) else frame
+        event = json.loads(frame[len("data: "):])
+        if event["type"] == "error":
+            raise RuntimeError(event["message"])
+
+
+def run(app, stubs, requests, concurrency):
+    from api.services.admission_services import admission
+    from api.services.ollama_services import ollama_pool
+
+    app.config["OLLAMA_HOSTS"] = ",".join(stub.url for stub in stubs)
+    ollama_pool.init_app(app)
+    admission.init_app(app)
+    for stub in stubs:
+        stub.loaded.clear()
+        stub.stats.update(loads=0, generations=0)
+    ollama_pool.check_all()
+
+    client = app.test_client()
+    rng = random.Random(7)
+    models = [rng.choice(MODELS) for _ in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda model: chat(client, model), models))
+    elapsed = time.perf_counter() - start
+    return elapsed, [dict(stub.stats) for stub in stubs], ollama_pool.snapshot()["stats"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=24)
+    parser.add_argument("--load-ms", type=float, default=500)
+    parser.add_argument("--tokens-per-sec", type=float, default=25)
+    args = parser.parse_args()
+
+    stubs = [
+        StubOllamaServer(models=MODELS, tokens=[f"w{i} " for i in range(20)], tokens_per_sec=args.tokens_per_sec,
+                         first_token_delay=0.05, load_delay=args.load_ms / 1000).start()
+        for _ in range(args.hosts)
+    ]
+    os.environ["OLLAMA_BASE_URL"] = stubs[0].url
+    os.environ["OLLAMA_HEALTH_INTERVAL"] = "0"
+    from api import create_app, mongo, gemini_models
+    from api.services.summary_services import summarizer
+
+    app = create_app()
+    app.config["MAX_MESSAGES_PER_SESSION"] = args.requests + 1
+    # Every request comes from the same test client address
+    app.config["ADMISSION_MAX_QUEUED_PER_USER"] = args.concurrency
+    summarizer.refresh_every = 0
+    gemini_models.enabled = False
+    mongo.db = memory_db()
+    chat(app.test_client(), MODELS[0])
+
+    for label, hosts in (("single host", stubs[:1]), (f"pool of {args.hosts}", stubs)):
+        elapsed, stats, routing = run(app, hosts, args.requests, args.concurrency)
+        print(f"{label:<12} {args.requests / elapsed:>7.1f} req/s  {elapsed:>6.2f}s  "
+              f"loads {sum(s['loads'] for s in stats):>2}  "
+              f"per host {[s['generations'] for s in stats]}  routing {routing}")
+    for stub in stubs:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares PDF text extraction: the original single-pass loop (string
+concatenation over every page), the page-range process pool, and a
+cache hit on re-upload.
+
+Usage:
+    python benchmarks/bench_pdf_extraction.py --pages 300 --pages 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import fitz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.config import Config
+from api.utils import file_utils
+
+LINE = "The quick brown fox jumps over the lazy dog while benchmarks keep running. "
+
+
+def make_pdf(pages, lines_per_page=45):
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(f"{number}:{row} {LINE}" for row in range(lines_per_page))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def baseline(file_bytes):
+    # The implementation before pages were streamed, bounded and cached
+    text = ""
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        for page in doc:
+            text += page.get_text()
+    return text.strip()
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, action="append")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    Config.PDF_WORKERS = args.workers
+    Config.PDF_MAX_PAGES = 0
+    Config.PDF_MAX_CHARS = 0
+    # Start the pool outside the measurements
+    file_utils._get_pdf_pool().submit(len, b"").result()
+
+    print(f"{'pages':>6} {'baseline':>10} {'serial':>10} {'parallel':>10} {'cached':>10}   ({args.workers} workers)")
+    for pages in args.pages or [300, 1000]:
+        data = make_pdf(pages)
+        base, expected = timed(lambda: baseline(data))
+
+        Config.PDF_PARALLEL_MIN_PAGES = 0
+        file_utils._pdf_text_cache.clear()
+        serial, _ = timed(lambda: file_utils.extract_text_from_pdf_bytes(data))
+
+        Config.PDF_PARALLEL_MIN_PAGES = 1
+        file_utils._pdf_text_cache.clear()
+        parallel, text = timed(lambda: file_utils.extract_text_from_pdf_bytes(data))
+        cached, _ = timed(lambda: file_utils.extract_text_from_pdf_bytes(data))
+
+        assert text.split() == expected.split()
+        print(f"{pages:>6} {base * 1000:>8.0f}ms {serial * 1000:>8.0f}ms {parallel * 1000:>8.0f}ms {cached * 1e6:>8.0f}us")
+
+
+if __name__ == "__main__":
+    main()
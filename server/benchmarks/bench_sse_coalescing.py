@@ -0,0 +1,138 @@
+"""
+Frames per second and server CPU per stream of /chat/stream, with every
+token sent as its own SSE frame versus chunks coalesced per time window.
+
+The ASGI app runs under uvicorn in this process. The stub Ollama server
+and the load generator run as child processes, so the CPU time measured
+here is the app's own: upstream parsing, event handling, JSON encoding
+and socket writes. The load generator reports frames received and the
+time to first token, which coalescing must not increase.
+
+Requires mongomock as an in-memory MongoDB (pip install mongomock).
+
+Usage:
+    python benchmarks/bench_sse_coalescing.py --streams 50 --tokens 600 --tokens-per-sec 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVER_DIR)
+from benchmarks.memory_mongo import memory_db
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def drive(url, streams):
+    form = {"message": "hello", "model_type": "local", "model_name": "stub:latest"}
+    limits = httpx.Limits(max_connections=streams, max_keepalive_connections=0)
+    ttfts, frames, failures = [], 0, 0
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600)) as client:
+        async def one():
+            nonlocal frames, failures
+            start = time.perf_counter()
+            first = None
+            async with client.stream("POST", f"{url}/chat/stream", data=form) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event["type"] == "chunk":
+                        frames += 1
+                        if first is None:
+                            first = time.perf_counter() - start
+                    elif event["type"] == "error":
+                        failures += 1
+            ttfts.append(first)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(streams)))
+        wall = time.perf_counter() - start
+
+    return {"wall": wall, "frames": frames, "failures": failures,
+            "ttft_p50": statistics.median(ttfts), "ttft_max": max(ttfts)}
+
+
+def run(url, streams):
+    # Drive the load from a child process so its CPU is not counted
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--drive", url, "--streams", str(streams)]
+    )
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=600, help="tokens per reply")
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--window-ms", type=float, default=30)
+    parser.add_argument("--drive", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.drive:
+        print(json.dumps(asyncio.run(drive(args.drive, args.streams))))
+        return
+
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, "benchmarks", "stub_ollama.py"), "--port", str(stub_port),
+         "--tokens", str(args.tokens), "--tokens-per-sec", str(args.tokens_per_sec), "--first-token-delay", "0.05"],
+        stdout=subprocess.PIPE,
+    )
+    stub.stdout.readline()
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{stub_port}"
+    os.environ["OLLAMA_HEALTH_INTERVAL"] = "0"
+    # Measure streaming, not the admission queue in front of it
+    os.environ["ADMISSION_MAX_CONCURRENT"] = "0"
+
+    import uvicorn
+    from api import mongo
+    from api.asgi import app
+    from api.services.stream_engine import stream_engine
+    from api.services.summary_services import summarizer
+
+    mongo.db = memory_db()
+    summarizer.refresh_every = 0
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="off", backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{port}"
+
+    print(f"{args.streams} concurrent streams, {args.tokens} tokens at {args.tokens_per_sec:g} tok/s each\n")
+    run(url, 2)
+    for label, window in (("per token", 0), (f"coalesced {args.window_ms:g} ms", args.window_ms)):
+        stream_engine.coalesce_ms = window
+        cpu = time.process_time()
+        result = run(url, args.streams)
+        cpu = time.process_time() - cpu
+        print(f"{label:<16} frames/s={result['frames'] / result['wall']:>8.0f}  "
+              f"frames/stream={result['frames'] / args.streams:>6.1f}  "
+              f"CPU/stream={cpu / args.streams * 1000:>6.1f} ms  "
+              f"TTFT p50={result['ttft_p50'] * 1000:>5.0f} ms max={result['ttft_max'] * 1000:>5.0f} ms  "
+              f"wall={result['wall']:5.2f}s  errors={result['failures']}")
+
+    server.should_exit = True
+    stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
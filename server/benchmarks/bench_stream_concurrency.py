@@ -0,0 +1,161 @@
+"""
+Load test for /chat/stream: how many streams can be open at once.
+
+Runs the same burst of concurrent streaming requests against
+  * the WSGI app on a server with a fixed pool of worker threads
+    (one thread is held per open stream), and
+  * the ASGI entry point (api/asgi.py) under uvicorn,
+both backed by a stub Ollama server. Persistence is replaced by an
+in-memory stand-in so only the streaming path is measured.
+
+Usage:
+    python benchmarks/bench_stream_concurrency.py --streams 500 --workers 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.stub_ollama import StubOllamaServer
+
+
+class PooledWSGIServer:
+    """Werkzeug server that handles requests on a fixed pool of threads."""
+
+    def __init__(self, app, workers):
+        from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+        pool = ThreadPoolExecutor(workers)
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        class Server(BaseWSGIServer):
+            request_queue_size = 4096
+
+            def process_request(self, request, client_address):
+                pool.submit(self._handle, request, client_address)
+
+            def _handle(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        self.server = Server("127.0.0.1", 0, app, handler=QuietHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class UvicornServer:
+    def __init__(self, app, port):
+        import uvicorn
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off", backlog=4096)
+        self.server = uvicorn.Server(config)
+        self.url = f"http://127.0.0.1:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+
+
+async def drive(url, streams):
+    form = {"message": "hello", "model_type": "local", "model_name": "stub:latest"}
+    limits = httpx.Limits(max_connections=streams, max_keepalive_connections=0)
+    ttfts, totals, failures = [], [], 0
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600)) as client:
+        async def one():
+            nonlocal failures
+            start = time.perf_counter()
+            first = None
+            try:
+                async with client.stream("POST", f"{url}/chat/stream", data=form) as response:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data: "):
+                            continue
+                        event = json.loads(line[6:])
+                        if event["type"] == "chunk" and first is None:
+                            first = time.perf_counter() - start
+                        elif event["type"] == "error":
+                            failures += 1
+                            return
+                ttfts.append(first)
+                totals.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(streams)))
+        wall = time.perf_counter() - start
+
+    return wall, ttfts, totals, failures
+
+
+def report(label, stub, wall, ttfts, totals, failures):
+    ok = len(totals)
+    p = lambda data, q: statistics.quantiles(data, n=100)[q - 1] if len(data) > 1 else (data[0] if data else 0)
+    print(f"{label:<34} peak concurrent={stub.stats['peak_active']:<5} ok={ok:<5} failed={failures:<4} "
+          f"wall={wall:6.2f}s  TTFT p50={p(ttfts, 50):6.3f}s p95={p(ttfts, 95):6.3f}s  "
+          f"total p95={p(totals, 95):6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=32, help="thread pool size of the WSGI server")
+    parser.add_argument("--tokens-per-sec", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = StubOllamaServer(tokens=[f"t{i} " for i in range(20)], tokens_per_sec=args.tokens_per_sec,
+                            first_token_delay=0.1).start()
+    os.environ["OLLAMA_BASE_URL"] = stub.url
+    # Measure the streaming path itself, not the admission queue in front of it
+    os.environ["ADMISSION_MAX_CONCURRENT"] = "0"
+
+    import api.services.stream_engine as stream_engine_module
+    import api.services.persistence_services as persistence_module
+    stream_engine_module.apply_exchanges = persistence_module.apply_exchanges = lambda writes: []
+    from api.asgi import app as asgi_app, flask_app
+
+    print(f"{args.streams} concurrent streams, {len(stub.tokens)} tokens at {args.tokens_per_sec} tok/s each\n")
+
+    wsgi = PooledWSGIServer(flask_app, args.workers).start()
+    result = asyncio.run(drive(wsgi.url, args.streams))
+    report(f"before: WSGI, {args.workers} worker threads", stub, *result)
+    wsgi.stop()
+
+    stub.stats["peak_active"] = 0
+    asgi = UvicornServer(asgi_app, args.port).start()
+    result = asyncio.run(drive(asgi.url, args.streams))
+    report("after: ASGI stream engine", stub, *result)
+    asgi.stop()
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Checks that background /chat jobs (async=true) answer and save like /chat.
+
+Runs the stub Ollama server and the fake Gemini module, then sends the
+same requests to /chat and as jobs: a reply from the local model, and, with
+the stub failing, a reply that falls back to Gemini. The job's
+result must carry the same model_name, model_type, fallback_used and
+reply text as /chat, and the saved bot messages must be alike. A job
+with an uploaded image, answered directly, must land in the user's history.
+
+Requires mongomock as an in-memory MongoDB (pip install mongomock).
+
+Usage:
+    python benchmarks/check_chat_jobs.py
+"""
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.memory_mongo import memory_db
+from benchmarks.stub_ollama import StubOllamaServer
+
+COMPARED = ("response", "model_name", "model_type", "fallback_used")
+
+
+def check(label, ok, detail):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}: {detail}")
+    return ok
+
+
+def run_job(client, form, headers=None):
+    submitted = client.post("/chat", data={**form, "async": "true"}, headers=headers)
+    if submitted.status_code != 202:
+        return submitted.json
+    status = client.get(f"/chat/jobs/{submitted.json['job_id']}?wait=10", headers=headers).json
+    return status.get("result", status)
+
+
+def saved_reply(mongo, session_id):
+    from bson import ObjectId
+    from api.services.persistence_services import write_behind
+
+    write_behind.flush()
+    reply = mongo.db.messages.find_one({"session_id": ObjectId(session_id), "role": "bot"})
+    return {key: reply.get(key) for key in ("content", "model_name", "interrupted")}
+
+
+def main():
+    stub = StubOllamaServer(tokens=[f"t{i} " for i in range(8)], tokens_per_sec=200).start()
+    os.environ["OLLAMA_BASE_URL"] = stub.url
+    os.environ["OLLAMA_HEALTH_INTERVAL"] = "0"
+    from api import create_app, mongo
+    from api.services.summary_services import summarizer
+    from benchmarks import fake_gemini
+
+    app = create_app()
+    summarizer.refresh_every = 0
+    mongo.db = memory_db()
+    fake_gemini.install(tokens=6, tokens_per_sec=200, first_token_delay=0.01)
+    client = app.test_client()
+    results = []
+
+    for label in ("local reply", "gemini fallback"):
+        if label == "gemini fallback":
+            stub.failing = True
+        form = {"message": f"check {label}", "model_type": "local", "model_name": "stub:latest"}
+        sync = client.post("/chat", data=form).json
+        job = run_job(client, form)
+        results.append(check(f"{label} result", all(sync.get(key) == job.get(key) for key in COMPARED),
+                             {key: (sync.get(key), job.get(key)) for key in COMPARED}))
+        sync_saved, job_saved = saved_reply(mongo, sync["session_id"]), saved_reply(mongo, job["session_id"])
+        results.append(check(f"{label} saved message", sync_saved == job_saved, (sync_saved, job_saved)))
+
+    # An image is answered directly, and must still be saved to the logged-in user
+    account = {"email": "jobs@example.com", "password": "check"}
+    client.post("/api/register", json=account)
+    headers = {"Authorization": f"Bearer {client.post('/api/login', json=account).json['token']}"}
+    upload = {"message": "what is this", "model_type": "cloud", "model_name": "gemini", "async": "true",
+              "uploaded_file": (io.BytesIO(b"\x89PNG fake"), "photo.png", "image/png")}
+    answer = client.post("/chat", data=upload, headers=headers, content_type="multipart/form-data").json
+    history = client.post("/chat/history", json={}, headers=headers).json
+    results.append(check("image upload owned", answer["session_id"] in [h["_id"] for h in history],
+                         f"{len(history)} session(s) in the user's history"))
+
+    stub.stop()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
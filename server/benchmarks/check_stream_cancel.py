@@ -0,0 +1,142 @@
+"""
+Checks that a chat stream stops its upstream generation when the client
+disconnects, and that the partial reply is kept.
+
+Runs a slow stub Ollama server and a stand-in Gemini model, reads a few
+chunks of a stream through the WSGI app and the ASGI entry point, then
+drops the connection. After that the stub must not send more tokens and
+must see the connection closed, the stand-in Gemini stream must be
+closed, and the session must hold the partial reply marked interrupted.
+
+Requires mongomock as an in-memory MongoDB (pip install mongomock).
+
+Usage:
+    python benchmarks/check_stream_cancel.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.memory_mongo import memory_db
+from benchmarks.stub_ollama import StubOllamaServer
+
+CHUNKS_BEFORE_STOP = 3
+
+
+class StandInGemini:
+    """Endless Gemini stream that records whether it was closed."""
+
+    def __init__(self):
+        self.sent = 0
+        self.closed = False
+
+    async def generate_content_async(self, *args, **kwargs):
+        return self
+
+    async def __aiter__(self):
+        try:
+            while True:
+                await asyncio.sleep(0.05)
+                self.sent += 1
+                yield type("Chunk", (), {"text": f"g{self.sent} "})()
+        finally:
+            self.closed = True
+
+
+def form(model_name):
+    return {"message": "tell me a long story", "model_type": "local" if model_name != "gemini" else "cloud",
+            "model_name": model_name}
+
+
+def read_then_drop_wsgi(client, model_name):
+    response = client.post("/chat/stream", data=form(model_name))
+    chunks = 0
+    for frame in response.response:
+        event = json.loads(frame.decode()[len("data: "):])
+        if event["type"] == "chunk":
+            chunks += 1
+            if chunks == CHUNKS_BEFORE_STOP:
+                break
+    response.close()
+
+
+def read_then_drop_asgi(asgi_app, model_name):
+    body = "&".join(f"{k}={v.replace(' ', '+')}" for k, v in form(model_name).items()).encode()
+    scope = {"type": "http", "method": "POST", "path": "/chat/stream", "query_string": b"",
+             "headers": [(b"content-type", b"application/x-www-form-urlencoded")], "client": ("127.0.0.1", 1)}
+
+    async def run():
+        disconnected = asyncio.Event()
+        chunks = 0
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal chunks
+            if message["type"] == "http.response.body" and b'"chunk"' in message.get("body", b""):
+                chunks += 1
+                if chunks == CHUNKS_BEFORE_STOP:
+                    disconnected.set()
+
+        await asyncio.wait_for(asgi_app(scope, receive, send), 10)
+
+    asyncio.run(run())
+
+
+def check(label, ok, detail):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}: {detail}")
+    return ok
+
+
+def main():
+    stub = StubOllamaServer(tokens=[f"t{i} " for i in range(400)], tokens_per_sec=20).start()
+    os.environ["OLLAMA_BASE_URL"] = stub.url
+    from api import asgi, mongo, gemini_models
+    from api.services.summary_services import summarizer
+    from api.services.stream_engine import stream_engine
+
+    summarizer.refresh_every = 0
+    mongo.db = memory_db()
+    client = asgi.flask_app.test_client()
+    results = []
+
+    for label, drop in (("wsgi", lambda: read_then_drop_wsgi(client, "stub:latest")),
+                        ("asgi", lambda: read_then_drop_asgi(asgi.app, "stub:latest"))):
+        aborted = stub.stats["aborted"]
+        drop()
+        time.sleep(0.5)
+        tokens = stub.stats["tokens"]
+        time.sleep(1.0)
+        results.append(check(f"{label} ollama stopped", stub.stats["tokens"] == tokens and stub.stats["active"] == 0,
+                             f"{tokens} tokens sent, {stub.stats['tokens'] - tokens} more after the disconnect"))
+        results.append(check(f"{label} ollama connection closed", stub.stats["aborted"] == aborted + 1,
+                             f"{stub.stats['aborted'] - aborted} aborted generation(s)"))
+
+    gemini = StandInGemini()
+    gemini_models.enabled = True
+    gemini_models.get = lambda *args: gemini
+    read_then_drop_wsgi(client, "gemini")
+    time.sleep(0.5)
+    results.append(check("gemini stream closed", gemini.closed, f"{gemini.sent} chunks produced"))
+
+    replies = list(mongo.db.messages.find({"role": "bot"}))
+    interrupted = [m for m in replies if m.get("interrupted")]
+    results.append(check("partial replies saved", len(interrupted) == 3 == len(replies),
+                         [m["content"][:24] for m in interrupted]))
+    results.append(check("cancellations counted", stream_engine.stats["cancelled"] == 3, stream_engine.stats))
+    stub.stop()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Stand-in for the google.generativeai module used by the benchmarks.
+
+Provides `configure` and a `GenerativeModel` whose generate_content (sync)
+and generate_content_async (with or without stream=True) produce a fixed
+reply at a configurable token rate after a first-token delay, without any
+network access. `install()` points the app's Gemini registry at it.
+"""
+import asyncio
+import time
+
+settings = {"tokens": 32, "tokens_per_sec": 50.0, "first_token_delay": 0.2}
+stats = {"calls": 0, "streams": 0}
+
+
+def configure(api_key=None, **kwargs):
+    pass
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Stream:
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._index = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._index >= len(self._tokens):
+            raise StopAsyncIteration
+        await asyncio.sleep(settings["first_token_delay"] if self._index == 0 else 1 / settings["tokens_per_sec"])
+        self._index += 1
+        return _Chunk(self._tokens[self._index - 1])
+
+    async def aclose(self):
+        self._index = len(self._tokens)
+
+
+class GenerativeModel:
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @staticmethod
+    def _tokens():
+        return [f"gem{i} " for i in range(settings["tokens"])]
+
+    @staticmethod
+    def _duration():
+        return settings["first_token_delay"] + (settings["tokens"] - 1) / settings["tokens_per_sec"]
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        stats["calls"] += 1
+        time.sleep(self._duration())
+        return _Chunk("".join(self._tokens()))
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        stats["calls"] += 1
+        if stream:
+            stats["streams"] += 1
+            return _Stream(self._tokens())
+        await asyncio.sleep(self._duration())
+        return _Chunk("".join(self._tokens()))
+
+
+def install(tokens=None, tokens_per_sec=None, first_token_delay=None):
+    """
+    Makes the app's Gemini registry build fake models.
+
+    Args:
+    tokens (int): Tokens per reply.
+    tokens_per_sec (float): Token rate of a reply.
+    first_token_delay (float): Seconds before the first token.
+    """
+    import sys
+    from api import gemini_models
+    from api.services import gemini_services
+
+    for name, value in (("tokens", tokens), ("tokens_per_sec", tokens_per_sec),
+                        ("first_token_delay", first_token_delay)):
+        if value is not None:
+            settings[name] = value
+    gemini_services.genai = sys.modules[__name__]
+    gemini_models.enabled = True
+    with gemini_models._lock:
+        gemini_models._models.clear()
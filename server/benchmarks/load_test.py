@@ -0,0 +1,426 @@
+"""
+Load test of the whole app against local stand-ins for Ollama, Gemini and
+MongoDB, with results saved as JSON so runs can be compared across commits.
+
+The app is built by create_app() and served in this process, by uvicorn
+(api.asgi, the default) or by the threaded WSGI server `python app.py`
+uses (--server wsgi), with:
+- the stub Ollama server (benchmarks/stub_ollama.py) in a child process,
+  at the given token rate and first-token delay;
+- the fake Gemini module (benchmarks/fake_gemini.py), at the same rate;
+- an in-memory MongoDB (benchmarks/memory_mongo.py).
+
+Virtual users run in a child process, so the CPU and memory measured here
+are the app's own. Each user picks requests from the weighted mix with its
+own seeded random generator: /chat and /chat/stream messages (a share of
+them to Gemini) that fill sessions of a few messages, /chat/history for
+the user's sessions and /models. Users sign up and log in before the run
+(with --guests they stay anonymous and, all coming from one address, share
+a guest's admission quota). Reported per request kind: throughput,
+p50/p95/p99 latency, time to first token for streams, requests rejected
+by admission control (429) and errors; for the server: CPU time and
+resident memory.
+
+Requires the benchmark requirements (pip install -r benchmarks/requirements.txt).
+
+Usage:
+    python benchmarks/load_test.py --users 50 --duration 30 --output results/base.json
+    python benchmarks/load_test.py --users 50 --duration 30 --compare results/base.json
+"""
+import argparse
+import asyncio
+import atexit
+import functools
+import json
+import math
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVER_DIR)
+from benchmarks.memory_mongo import memory_db
+
+KINDS = ("chat", "stream", "history", "models")
+LOCAL_MODEL = "stub:latest"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of numbers, None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r}, expected one of {', '.join(KINDS)}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def rss_mb():
+    # Current resident set size of this process
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+class Rejected(Exception):
+    """A request shed by admission control."""
+
+
+class User:
+    """
+    One virtual user: its random generator, sessions and samples.
+    """
+
+    def __init__(self, index, args, client, url, samples):
+        self.index = index
+        self.args = args
+        self.client = client
+        self.url = url
+        self.samples = samples
+        self.random = random.Random(args.seed * 100003 + index)
+        self.session_id = "1"
+        self.session_messages = 0
+        self.sessions = []
+        self.sent = 0
+        self.headers = {}
+
+    async def sign_in(self):
+        account = {"email": f"load{self.index}@example.com", "password": "load-test"}
+        response = await self.client.post(f"{self.url}/api/register", json=account)
+        if response.status_code != 409:
+            response.raise_for_status()
+        response = await self.client.post(f"{self.url}/api/login", json=account)
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+    def _form(self):
+        self.sent += 1
+        gemini = self.random.random() < self.args.gemini_share
+        return {
+            # Distinct prompts so no reply comes from the response cache
+            "message": f"user {self.index} message {self.sent}: tell me about load testing",
+            "model_type": "cloud" if gemini else "local",
+            "model_name": "gemini" if gemini else LOCAL_MODEL,
+            "session_id": self.session_id,
+        }
+
+    def _saved(self, session_id):
+        if not session_id:
+            return
+        if session_id != self.session_id:
+            self.session_id = session_id
+            self.session_messages = 0
+            self.sessions = (self.sessions + [session_id])[-10:]
+        self.session_messages += 1
+        if self.session_messages >= self.args.messages_per_session:
+            self.session_id = "1"
+
+    async def chat(self):
+        response = await self.client.post(f"{self.url}/chat", data=self._form(), headers=self.headers)
+        response.raise_for_status()
+        self._saved(response.json().get("session_id"))
+
+    async def stream(self, start):
+        session_id = None
+        ttft = None
+        async with self.client.stream("POST", f"{self.url}/chat/stream", data=self._form(),
+                                      headers=self.headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event["type"] == "chunk" and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif event["type"] == "error" and event.get("queue_full"):
+                    raise Rejected()
+                elif event["type"] == "error":
+                    raise RuntimeError(event.get("message"))
+                elif event["type"] in ("session_info", "complete"):
+                    session_id = event.get("session_id") or session_id
+        self._saved(session_id)
+        return ttft
+
+    async def history(self):
+        # Signed-in users get their own sessions, guests name theirs
+        body = {} if self.headers else {"session_ids": self.sessions}
+        response = await self.client.post(f"{self.url}/chat/history", json=body, headers=self.headers)
+        response.raise_for_status()
+
+    async def models(self):
+        response = await self.client.get(f"{self.url}/models", headers=self.headers)
+        response.raise_for_status()
+
+    async def run(self, kinds, weights, deadline, measure_from):
+        while time.perf_counter() < deadline:
+            kind = self.random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            ttft = None
+            try:
+                if kind == "stream":
+                    ttft = await self.stream(start)
+                else:
+                    await getattr(self, kind)()
+                error = None
+            except Rejected:
+                error = Rejected
+            except httpx.HTTPStatusError as e:
+                error = Rejected if e.response.status_code == 429 else f"HTTP {e.response.status_code} from {kind}"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if start < measure_from:
+                continue
+            sample = self.samples[kind]
+            if error is Rejected:
+                sample["rejected"] += 1
+            elif error:
+                sample["errors"].append(error)
+            else:
+                sample["latency"].append(time.perf_counter() - start)
+                if ttft is not None:
+                    sample["ttft"].append(ttft)
+
+
+async def drive(url, args):
+    kinds = list(args.mix)
+    weights = [args.mix[kind] for kind in kinds]
+    samples = {kind: {"latency": [], "ttft": [], "errors": [], "rejected": 0} for kind in kinds}
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120)) as client:
+        users = [User(i, args, client, url, samples) for i in range(args.users)]
+        if not args.guests:
+            await asyncio.gather(*(user.sign_in() for user in users))
+        start = time.perf_counter()
+        measure_from = start + args.warmup
+        # Tell the server process when to start measuring CPU and memory
+        asyncio.get_running_loop().call_later(args.warmup, functools.partial(print, "measuring", flush=True))
+        deadline = measure_from + args.duration
+        await asyncio.gather(*(user.run(kinds, weights, deadline, measure_from) for user in users))
+        wall = time.perf_counter() - measure_from
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    results = {}
+    for kind, sample in samples.items():
+        latency, ttft = sample["latency"], sample["ttft"]
+        results[kind] = {
+            "requests": len(latency),
+            "rejected": sample["rejected"],
+            "errors": len(sample["errors"]),
+            "error_examples": sorted(set(sample["errors"]))[:3],
+            "throughput_rps": round(len(latency) / wall, 2),
+            "latency_ms": {f"p{q}": ms(percentile(latency, q)) for q in (50, 95, 99)},
+        }
+        if kind == "stream":
+            results[kind]["ttft_ms"] = {f"p{q}": ms(percentile(ttft, q)) for q in (50, 95, 99)}
+    total = sum(r["requests"] for r in results.values())
+    return {"wall_s": round(wall, 2), "total_rps": round(total / wall, 2), "requests": results}
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--", "api"], cwd=SERVER_DIR,
+                                             stderr=subprocess.DEVNULL, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(result, baseline):
+    def delta(new, old):
+        if new is None or old is None or not old:
+            return ""
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    changed = [key for key in result["config"] if result["config"][key] != baseline.get("config", {}).get(key)]
+    if changed:
+        print(f"  (different settings: {', '.join(changed)})")
+    rows = [("total rps", result["total_rps"], baseline["total_rps"])]
+    for kind, current in result["requests"].items():
+        old = baseline["requests"].get(kind)
+        if not old:
+            continue
+        rows.append((f"{kind} rps", current["throughput_rps"], old["throughput_rps"]))
+        for q in ("p50", "p95", "p99"):
+            rows.append((f"{kind} {q} ms", current["latency_ms"][q], old["latency_ms"][q]))
+        if "ttft_ms" in current and "ttft_ms" in old:
+            for q in ("p50", "p95"):
+                rows.append((f"{kind} TTFT {q} ms", current["ttft_ms"][q], old["ttft_ms"][q]))
+    rows.append(("server RSS peak MB", result["server"]["rss_mb_peak"], baseline["server"]["rss_mb_peak"]))
+    rows.append(("server CPU s", result["server"]["cpu_s"], baseline["server"]["cpu_s"]))
+    for label, new, old in rows:
+        print(f"  {label:<20} {str(old):>10} -> {str(new):>10}  {delta(new, old)}")
+
+
+def report(result):
+    config = result["config"]
+    print(f"{config['users']} users for {config['duration']:g}s, mix {config['mix']}, "
+          f"{config['tokens']} tokens at {config['tokens_per_sec']:g} tok/s\n")
+    for kind, r in result["requests"].items():
+        latency = r["latency_ms"]
+        line = (f"{kind:<8} rps={r['throughput_rps']:>7.1f}  p50={latency['p50']}  p95={latency['p95']}  "
+                f"p99={latency['p99']} ms  rejected={r['rejected']}  errors={r['errors']}")
+        if "ttft_ms" in r:
+            line += f"  TTFT p50={r['ttft_ms']['p50']} p95={r['ttft_ms']['p95']} ms"
+        print(line)
+        for example in r["error_examples"]:
+            print(f"         error: {example}")
+    server = result["server"]
+    print(f"\ntotal rps={result['total_rps']}  server CPU={server['cpu_s']}s  "
+          f"RSS start={server['rss_mb_start']} peak={server['rss_mb_peak']} end={server['rss_mb_end']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default="chat=3,stream=4,history=2,models=1",
+                        help="weights of the request kinds (chat, stream, history, models)")
+    parser.add_argument("--gemini-share", type=float, default=0.2, help="share of messages sent to Gemini")
+    parser.add_argument("--messages-per-session", type=int, default=5)
+    parser.add_argument("--guests", action="store_true", help="send requests without signing in")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per reply")
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--first-token-delay", type=float, default=0.1)
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi",
+                        help="serve api.asgi with uvicorn, or the Flask app with a threaded WSGI server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="where to save the results (JSON)")
+    parser.add_argument("--compare", help="results of an earlier run to compare with (JSON)")
+    parser.add_argument("--drive", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.drive:
+        print(json.dumps(asyncio.run(drive(args.drive, args))))
+        return
+
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, "benchmarks", "stub_ollama.py"), "--port", str(stub_port),
+         "--tokens", str(args.tokens), "--tokens-per-sec", str(args.tokens_per_sec),
+         "--first-token-delay", str(args.first_token_delay)],
+        stdout=subprocess.PIPE,
+    )
+    atexit.register(stub.terminate)
+    stub.stdout.readline()
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{stub_port}"
+    os.environ["OLLAMA_HEALTH_INTERVAL"] = "0"
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+    from api import mongo
+    from benchmarks import fake_gemini
+
+    port = free_port()
+    if args.server == "asgi":
+        import uvicorn
+        from api.asgi import app
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                               lifespan="off", backlog=4096))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        stop = lambda: setattr(server, "should_exit", True)
+    else:
+        from werkzeug.serving import WSGIRequestHandler, make_server
+        from api import create_app
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server("127.0.0.1", port, create_app(), threaded=True, request_handler=QuietHandler)
+        server.socket.listen(4096)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stop = server.shutdown
+    mongo.db = memory_db()
+    fake_gemini.install(tokens=args.tokens, tokens_per_sec=args.tokens_per_sec,
+                        first_token_delay=args.first_token_delay)
+    url = f"http://127.0.0.1:{port}"
+
+    memory = {}
+    sampling = threading.Event()
+
+    def sample_memory():
+        while not sampling.wait(0.2):
+            memory["peak"] = max(memory["peak"], rss_mb())
+
+    command = [sys.executable, os.path.abspath(__file__), "--drive", url] + sys.argv[1:]
+    driver = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        driver.stdout.readline()
+        cpu = time.process_time()
+        memory["start"] = memory["peak"] = rss_mb()
+        threading.Thread(target=sample_memory, daemon=True).start()
+        output = driver.stdout.read()
+        if driver.wait():
+            raise SystemExit(f"Load generator failed with exit status {driver.returncode}")
+        cpu = time.process_time() - cpu
+        result = json.loads(output)
+    finally:
+        sampling.set()
+        driver.kill()
+        stop()
+
+    commit, dirty = git_revision()
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "compare", "drive")},
+        **result,
+        "server": {
+            "cpu_s": round(cpu, 2),
+            "rss_mb_start": round(memory["start"], 1),
+            "rss_mb_peak": round(memory["peak"], 1),
+            "rss_mb_end": round(rss_mb(), 1),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+    report(result)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+In-memory MongoDB for the benchmarks and checks, backed by mongomock.
+
+pymongo 4.9+ passes a `sort` argument when it adds UpdateOne/ReplaceOne to
+a bulk write, which mongomock's bulk builder does not accept yet. The
+helper drops it (the chat store never sorts bulk updates) so bulk_write
+works against the in-memory database.
+
+Requires mongomock (pip install mongomock).
+"""
+import functools
+
+import mongomock
+from mongomock.collection import BulkOperationBuilder
+
+
+def _drop_sort(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+if not getattr(BulkOperationBuilder.add_update, "__wrapped__", None):
+    BulkOperationBuilder.add_update = _drop_sort(BulkOperationBuilder.add_update)
+    BulkOperationBuilder.add_replace = _drop_sort(BulkOperationBuilder.add_replace)
+
+
+def memory_db():
+    """Returns a fresh in-memory database."""
+    return mongomock.MongoClient().db
@@ -0,0 +1,187 @@
+"""
+Minimal stand-in for the Ollama HTTP API used by the benchmarks.
+
+Implements /api/tags, /api/ps, /api/show and /api/generate (streaming and
+non-streaming) with configurable first-token delay and token rate.
+Generating with a model that is not loaded first costs `load_delay`
+seconds; keep_alive=0 unloads it, and models not in `models` are not found.
+Prompt processing costs `prefill_per_token` seconds per prompt word not
+covered by the `context` sent with the request, and the final chunk
+returns the extended context like Ollama does. While `failing` is set,
+generate requests get their connection closed without an answer.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.stats["requests"] += 1
+        if self.path == "/api/tags":
+            self._send_json({"models": [
+                {"name": name, "digest": f"sha256:{name}"} for name in self.server.models
+            ]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [
+                {"name": name, "model": name, "size": self.server.model_size, "size_vram": self.server.model_size}
+                for name in list(self.server.loaded)
+            ]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        self.server.stats["requests"] += 1
+        data = self._read_json()
+        if self.path == "/api/show":
+            self._send_json({"modelfile": "", "parameters": "", "details": {"family": data.get("name", "")}})
+        elif self.path == "/api/generate":
+            self._generate(data)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, data):
+        model = data.get("model")
+        if self.server.failing:
+            self.close_connection = True
+            return
+        if data.get("keep_alive") in (0, "0", "0s"):
+            self.server.loaded.pop(model, None)
+            self._send_json({"model": model, "response": "", "done": True, "done_reason": "unload"})
+            return
+        if model not in self.server.models:
+            self._send_json({"error": f"model '{model}' not found"}, status=404)
+            return
+        with self.server.load_lock:
+            # Concurrent requests for a model that is loading wait for that one load
+            if model not in self.server.loaded:
+                self.server.stats["loads"] += 1
+                if self.server.load_delay:
+                    time.sleep(self.server.load_delay)
+                self.server.loaded[model] = True
+        if not data.get("prompt") and not data.get("context"):
+            # Empty prompt: only load the model
+            self._send_json({"model": model, "response": "", "done": True, "done_reason": "load"})
+            return
+        with self.server.lock:
+            self.server.stats["generations"] += 1
+            self.server.stats["active"] += 1
+            self.server.stats["peak_active"] = max(self.server.stats["peak_active"], self.server.stats["active"])
+        try:
+            self._generate_tokens(data)
+        finally:
+            with self.server.lock:
+                self.server.stats["active"] -= 1
+
+    def _generate_tokens(self, data):
+        tokens = self.server.tokens
+        context = list(data.get("context") or [])
+        prompt = data.get("prompt", "") if context else f"{data.get('system', '')} {data.get('prompt', '')}"
+        prompt_tokens = len(prompt.split())
+        self.server.stats["prefill_tokens"] += prompt_tokens
+        delay = self.server.first_token_delay + prompt_tokens * self.server.prefill_per_token
+        if delay:
+            time.sleep(delay)
+        context += [len(context) + i for i in range(prompt_tokens + len(tokens))]
+        # Durations in nanoseconds, like Ollama reports them
+        final = {"model": data.get("model"), "response": "", "done": True, "context": context,
+                 "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(delay * 1e9),
+                 "eval_count": len(tokens), "eval_duration": int(len(tokens) * self.server.token_interval * 1e9)}
+        if not data.get("stream", True):
+            time.sleep(len(tokens) * self.server.token_interval)
+            self._send_json({**final, "response": "".join(tokens)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                self._write_chunk({"model": data.get("model"), "response": token, "done": False})
+                self.server.stats["tokens"] += 1
+                if self.server.token_interval:
+                    time.sleep(self.server.token_interval)
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stats["aborted"] += 1
+            self.close_connection = True
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, port=0, models=None, tokens=None, tokens_per_sec=0, first_token_delay=0.0,
+                 prefill_per_token=0.0, load_delay=0.0, model_size=1 << 30):
+        super().__init__(("127.0.0.1", port), StubOllamaHandler)
+        self.models = models or ["stub:latest"]
+        self.tokens = tokens or [f"tok{i} " for i in range(32)]
+        self.token_interval = 1.0 / tokens_per_sec if tokens_per_sec else 0.0
+        self.first_token_delay = first_token_delay
+        self.prefill_per_token = prefill_per_token
+        self.load_delay = load_delay
+        self.model_size = model_size
+        self.loaded = {}
+        self.failing = False
+        self.stats = {"requests": 0, "tokens": 0, "prefill_tokens": 0, "loads": 0, "aborted": 0, "active": 0,
+                      "peak_active": 0, "generations": 0}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a stub Ollama server")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per reply")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(args.port, tokens=[f"tok{i} " for i in range(args.tokens)],
+                              tokens_per_sec=args.tokens_per_sec, first_token_delay=args.first_token_delay)
+    print(f"Stub Ollama listening on {server.url}", flush=True)
+    server.serve_forever()